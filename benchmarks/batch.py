@@ -0,0 +1,82 @@
+"""Throughput of run_batch as the number of worker processes grows.
+
+python benchmarks/batch.py
+python benchmarks/batch.py --jobs 64 --blocks 20000 --workers 1 2 4 8
+
+Every job builds a family of pockets that differ in size and depth and saves it. Speedup is against the first worker
+count given; with the jobs spread evenly it should stay close to the number of workers, up to the number of cores.
+"""
+
+import argparse
+import math
+import os
+import tempfile
+
+from mach30.enums import CircularMotionDirection, SpindleDirection
+from mach30.mill.batch import ToolLibrary, parameter_grid, run_batch
+from mach30.mill.builder import ProgramBuilder
+from mach30.mill.models import SpindleSettings, Tool
+
+TOOLS = [
+    Tool(
+        number=1,
+        description="0.5 inch end mill",
+        spindle=SpindleSettings(direction=SpindleDirection.FORWARD, speed=3000),
+    ),
+    Tool(
+        number=2,
+        description="0.25 inch end mill",
+        spindle=SpindleSettings(direction=SpindleDirection.FORWARD, speed=6000),
+    ),
+]
+
+
+def pocket(builder: ProgramBuilder, tools: ToolLibrary, size: float, depth: float, blocks: int) -> None:
+    with builder.program():
+        builder.default_config()
+        passes = 0
+        while len(builder.codes) < blocks:
+            tool = tools[passes % len(tools) + 1]
+            builder.use_tool(tool)
+            with builder.compensate(tool, {"x": size, "y": 0.0, "z": 1.0}, {"x": size, "y": 0.0, "z": 1.0}):
+                for step in range(20):
+                    scale = size * (1 - step / 40)
+                    builder.linear_feed(z=-depth * (step + 1) / 20, feedrate=10)
+                    builder.linear_feed(y=scale / 2, feedrate=18)
+                    builder.circular_feed(CircularMotionDirection.COUNTERCLOCKWISE, x=0.0, y=scale, r=scale / 2)
+                    builder.linear_feed(x=-scale / 2)
+                    builder.linear_feed(y=0.0)
+                    builder.linear_feed(x=math.copysign(scale, size))
+            builder.zhome()
+            passes += 1
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=32)
+    parser.add_argument("--blocks", type=int, default=10_000, help="blocks in each program")
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, 2, os.cpu_count() or 1}))
+    parser.add_argument("--stream", action="store_true", help="stream programs out instead of saving them at the end")
+    args = parser.parse_args()
+
+    depths = [0.05 * (i + 1) for i in range(4)]
+    sizes = [1.0 + 0.25 * i for i in range(-(-args.jobs // len(depths)))]
+    grid = parameter_grid(size=sizes, depth=depths, blocks=[args.blocks])[: args.jobs]
+    print(f"{len(grid)} programs of {args.blocks} blocks on {os.cpu_count()} cores")
+    baseline = None
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as output:
+            report = run_batch(pocket, grid, output, tools=TOOLS, workers=workers, stream=args.stream)
+        assert not report.failures, str(report)
+        baseline = baseline or report.seconds
+        speedup = baseline / report.seconds
+        build = sum(result.build_seconds for result in report.results)
+        save = sum(result.save_seconds for result in report.results)
+        print(
+            f"{workers:3} workers: {report.seconds:7.2f}s, {len(grid) / report.seconds:7.1f} programs/s, "
+            f"speedup {speedup:5.2f} (build {build:.2f}s, save {save:.2f}s over all jobs)"
+        )
+
+
+if __name__ == "__main__":
+    main()
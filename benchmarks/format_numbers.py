@@ -0,0 +1,46 @@
+"""Number formatting: fixed-precision batch formatting against the repr formatting it replaced.
+
+python benchmarks/format_numbers.py --numbers 1000000
+"""
+
+import argparse
+import time
+import typing as t
+
+import numpy as np
+
+from mach30.mill.builder import ProgramBuilder
+from mach30.mill.formatting import format_number, format_numbers
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--numbers", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    values = np.round(np.random.default_rng(0).uniform(-10, 10, args.numbers), 4) + 1e-12
+    as_list = values.tolist()
+    cases: dict[str, t.Callable[[], object]] = {
+        "repr (old)": lambda: [f"X{value}" for value in as_list],
+        "format_number": lambda: ["X" + format_number(value, 4) for value in as_list],
+        "format_numbers": lambda: ["X" + text for text in format_numbers(values, 4)],
+    }
+    for name, case in cases.items():
+        best = min(_time(case) for _ in range(args.repeat))
+        print(f"{name:>16}: {best:.3f}s, {args.numbers / best / 1e6:.2f}M numbers/s")
+
+    builder = ProgramBuilder(number=1)
+    builder.linear_feed_many(20, x=values, y=values[::-1])
+    best = min(_time(lambda: list(builder.codes.render_blocks(cache=False))) for _ in range(args.repeat))
+    print(f"{'render_blocks':>16}: {best:.3f}s for {len(builder.codes)} blocks")
+
+
+def _time(case: t.Callable[[], object]) -> float:
+    start = time.perf_counter()
+    case()
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""Build, render and save times, peak memory and allocations for synthetic programs of a given size.
+
+python benchmarks/generation.py --sizes 1000 100000 1000000 --output results.json
+python benchmarks/generation.py --sizes 1000 100000 --compare results.json
+
+Saving also writes the binary archive format and times mapping it back in.
+
+Every program cycles through tool changes, cutter compensation, contours made of linear and circular feeds, rapids
+and a drilling cycle until it has the requested number of blocks. Results are written as JSON so runs from different
+commits can be compared with --compare.
+"""
+
+import argparse
+import gc
+import json
+import math
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from mach30.enums import CircularMotionDirection, SpindleDirection
+from mach30.mill.archive import load_archive, save_archive
+from mach30.mill.builder import ProgramBuilder
+from mach30.mill.gcode import DrillCycle
+from mach30.mill.models import SpindleSettings, Tool
+
+TOOLS = [
+    Tool(
+        number=1,
+        description="0.5 inch end mill",
+        spindle=SpindleSettings(direction=SpindleDirection.FORWARD, speed=3000),
+    ),
+    Tool(
+        number=2,
+        description="0.25 inch end mill",
+        spindle=SpindleSettings(direction=SpindleDirection.FORWARD, speed=6000),
+    ),
+    Tool(number=3, description="drill", spindle=SpindleSettings(direction=SpindleDirection.FORWARD, speed=4500)),
+]
+# how many contour passes each operation makes between tool changes
+PASSES = 20
+
+
+def build(blocks: int) -> ProgramBuilder:
+    builder = ProgramBuilder(number=1, preamble_comments=["generation benchmark"])
+    with builder.program():
+        builder.default_config()
+        operation = 0
+        while len(builder.codes) < blocks:
+            _operation(builder, operation)
+            operation += 1
+    return builder
+
+
+def _operation(builder: ProgramBuilder, operation: int) -> None:
+    tool = TOOLS[operation % len(TOOLS)]
+    builder.rapid(x=0, y=0)
+    builder.use_tool(tool)
+    if tool.number == 3:
+        with DrillCycle(builder=builder, f=15, z=-0.35, r=0.1) as drill:
+            for hole in range(4 * PASSES):
+                drill.move(x=math.cos(hole / 10) * 2, y=math.sin(hole / 10) * 2)
+        builder.zhome()
+        return
+
+    with builder.compensate(tool, {"x": 1.0, "y": 0.0, "z": 1.0}, {"x": 1.0, "y": 0.0, "z": 1.0}):
+        builder.rapid(x=1.0, y=0.0, z=0.1)
+        for depth in range(PASSES):
+            z = -0.01 * (depth + 1)
+            builder.linear_feed(z=z, feedrate=10)
+            builder.linear_feed(y=0.5, feedrate=18)
+            builder.circular_feed(CircularMotionDirection.COUNTERCLOCKWISE, x=0.5, y=1.0, r=0.5)
+            builder.linear_feed(x=-0.5)
+            builder.circular_feed(CircularMotionDirection.COUNTERCLOCKWISE, x=-1.0, y=0.5, r=0.5)
+            builder.linear_feed(y=-0.5)
+            builder.circular_feed(CircularMotionDirection.COUNTERCLOCKWISE, x=-0.5, y=-1.0, i=0.5, j=0.0)
+            builder.linear_feed(x=0.5)
+            builder.circular_feed(CircularMotionDirection.COUNTERCLOCKWISE, x=1.0, y=-0.5, i=0.0, j=0.5)
+            builder.linear_feed(y=0.0)
+        builder.rapid(z=1.0)
+    builder.zhome()
+
+
+def measure(blocks: int, memory: bool = True, workers: int = 1) -> dict[str, float]:
+    gc.collect()
+    allocated = sys.getallocatedblocks()
+    start = time.perf_counter()
+    builder = build(blocks)
+    result: dict[str, float] = {"blocks": len(builder.codes), "build_s": time.perf_counter() - start}
+    result["allocations_per_block"] = (sys.getallocatedblocks() - allocated) / len(builder.codes)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "bench.nc"
+        # saving doesn't fill the render cache, so it's timed first and renders every block itself
+        start = time.perf_counter()
+        builder.save(path, with_line_numbers=True)
+        result["save_s"] = time.perf_counter() - start
+        result["file_mb"] = path.stat().st_size / 1e6
+        if workers > 1:
+            start = time.perf_counter()
+            builder.save(path, with_line_numbers=True, workers=workers)
+            result["save_parallel_s"] = time.perf_counter() - start
+        archive = Path(tmp) / "bench.m30"
+        start = time.perf_counter()
+        save_archive(builder, archive)
+        result["archive_save_s"] = time.perf_counter() - start
+        start = time.perf_counter()
+        load_archive(archive)
+        result["archive_load_s"] = time.perf_counter() - start
+    start = time.perf_counter()
+    builder.render(with_line_numbers=True)
+    result["render_s"] = time.perf_counter() - start
+    start = time.perf_counter()
+    builder.render()
+    result["rerender_s"] = time.perf_counter() - start
+    del builder
+
+    if memory:
+        # tracemalloc slows everything down, so memory is measured on a separate run
+        gc.collect()
+        tracemalloc.start()
+        builder = build(blocks)
+        result["build_peak_mb"] = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        with tempfile.TemporaryFile("w") as f:
+            builder.save(f)
+        result["save_peak_mb"] = (tracemalloc.get_traced_memory()[1] - baseline) / 1e6
+        tracemalloc.stop()
+    return result
+
+
+def _commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list[dict[str, float]], baseline: list[dict[str, float]]) -> None:
+    """Print how each measurement changed against a previous run of the same sizes"""
+    before = {int(row["blocks"]): row for row in baseline}
+    for row in results:
+        old = before.get(int(row["blocks"]))
+        if old is None:
+            continue
+        changes = [f"{key} {row[key] / old[key]:.2f}x" for key in row if key != "blocks" and old.get(key)]
+        print(f"{int(row['blocks']):>9} blocks: " + ", ".join(changes))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    parser.add_argument("--workers", type=int, default=1, help="also time saving with this many render processes")
+    parser.add_argument("--no-memory", action="store_true", help="skip the (slow) tracemalloc runs")
+    parser.add_argument("--output", type=Path, help="write the results to this JSON file")
+    parser.add_argument("--compare", type=Path, help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    results = []
+    for blocks in args.sizes:
+        results.append(measure(blocks, memory=not args.no_memory, workers=args.workers))
+        print(json.dumps(results[-1]), file=sys.stderr)
+    report = {"commit": _commit(), "python": platform.python_version(), "results": results}
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        compare(results, json.loads(args.compare.read_text())["results"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""Parser throughput in MB/s.
+
+python benchmarks/parse_throughput.py --blocks 200000
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from mach30.mill.builder import ProgramBuilder
+from mach30.mill.parser import load_store
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--blocks", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    builder = ProgramBuilder(number=1, preamble_comments=["parse throughput"])
+    builder.linear_feed(feedrate=40, x=0, y=0, z=0)
+    for i in range(args.blocks):
+        builder.linear_feed(x=i * 0.001, y=(i % 100) * 0.01, comment="pass" if i % 50 == 0 else None)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "bench.nc"
+        builder.save(path, with_line_numbers=True)
+        size = path.stat().st_size
+        best = min(_time(path) for _ in range(args.repeat))
+    print(f"parsed {size / 1e6:.1f} MB ({args.blocks} blocks) in {best:.3f}s: {size / 1e6 / best:.1f} MB/s")
+
+
+def _time(path: Path) -> float:
+    start = time.perf_counter()
+    load_store(path)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Cold import time of mach30.mill modules, each measured in a fresh interpreter with `python -X importtime`.
+
+python benchmarks/startup.py
+python benchmarks/startup.py --module mach30.mill.builder mach30.mill.gcode --repeat 10
+
+Nothing is imported beforehand, so the time includes every dependency the modules pull in (pydantic, and numpy if
+anything imports it at module level), which is what a script that builds a program pays before its first line runs.
+The slowest modules, mach30 or not, are listed by their own (self) time. tests/test_startup.py takes the same
+measurement and records it with the test results.
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import typing as t
+
+
+def import_times(modules: t.Sequence[str]) -> tuple[dict[str, tuple[int, int]], int]:
+    """Self and cumulative microseconds of every module imported by `import modules` in a fresh interpreter, and the
+    microseconds of the whole import"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {', '.join(modules)}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times, total = {}, 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:") :].split("|")
+        # a module is listed once, where it's first imported, and indented by how deep that import is
+        times[name.strip()] = (int(own), int(cumulative))
+        if not name[1:].startswith(" "):
+            total += int(cumulative)
+    return times, total
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", nargs="+", default=["mach30.mill.builder", "mach30.mill.gcode"])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="list this many of the slowest modules")
+    args = parser.parse_args()
+
+    measured = [import_times(args.module) for _ in range(args.repeat)]
+    runs = [times for times, _ in measured]
+    totals = [total / 1000 for _, total in measured]
+    print(
+        f"import {', '.join(args.module)}: {statistics.median(totals):.1f} ms "
+        f"(median of {args.repeat}, min {min(totals):.1f})"
+    )
+    print(f"numpy imported: {'yes' if all('numpy' in run for run in runs) else 'no'}")
+    own = [sum(times[0] for name, times in run.items() if name.split(".")[0] == "mach30") / 1000 for run in runs]
+    print(f"mach30 modules themselves: {statistics.median(own):.1f} ms")
+    modules = {name for run in runs for name in run}
+    slowest = sorted(modules, key=lambda name: -statistics.median(run.get(name, (0, 0))[0] for run in runs))
+    for name in slowest[: args.top]:
+        print(f"  {statistics.median(run.get(name, (0, 0))[0] for run in runs) / 1000:6.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import mmap
+import os
+import struct
+from pathlib import Path
+
+import numpy as np
+from pydantic import BaseModel
+
+from .builder import ProgramBuilder
+from .formatting import NumberFormat
+from .modal_state import ModalState
+from .models import Tool
+from .store import MappedCodeStore
+
+MAGIC = b"MACH30P\0"
+VERSION = 1
+# magic, version and the length of the JSON header that follows
+_PREAMBLE = struct.Struct("<8sII")
+# every column starts on a multiple of this, so the views of it are aligned
+_ALIGNMENT = 8
+# the block table, in the order it's written: (types, numbers, is_int, offsets) are the store's columns, comments are
+# kept as the blocks that have one, where each comment ends in `comment_text` and the text itself
+_COLUMNS: dict[str, str] = {
+    "offsets": "<u8",
+    "numbers": "<f8",
+    "types": "u1",
+    "is_int": "u1",
+    "comment_blocks": "<u8",
+    "comment_ends": "<u8",
+    "comment_text": "u1",
+}
+
+
+class ArchiveError(ValueError):
+    pass
+
+
+class Column(BaseModel):
+    """Where a column is in the block table, which starts at the first multiple of 8 bytes after the header: its byte
+    offset from the start of the table and its number of items"""
+
+    offset: int
+    count: int
+
+
+class ArchiveHeader(BaseModel):
+    number: int
+    preamble_comments: list[str] = []
+    tools: list[Tool] = []
+    number_format: NumberFormat
+    # what the program left active, so blocks added to it after loading are written the same as before saving
+    modal: ModalState
+    columns: dict[str, Column]
+
+
+def save_archive(program: ProgramBuilder, fname: Path | str) -> None:
+    """Save a program in the binary archive format, which `load_archive` maps back in without parsing.
+
+    The file is a short preamble (magic, format version, header length), a JSON header with the program's number,
+    preamble comments, tools, number format and modal state, then the block table: one little endian column each for the word
+    types, numbers and integer flags, the block offsets and the comments.
+    """
+    types, numbers, is_int, offsets = program.codes.columns
+    comments = program.codes.comments
+    comment_blocks = sorted(comments)
+    comment_texts = [comments[block] for block in comment_blocks]
+    # comment ends count characters, so the text is decoded once and sliced
+    comment_ends = np.cumsum([len(text) for text in comment_texts], dtype=np.uint64)
+    data: dict[str, np.ndarray] = {
+        "offsets": np.frombuffer(offsets, dtype=np.uint64),
+        "numbers": np.frombuffer(numbers, dtype=np.float64),
+        "types": np.frombuffer(types, dtype=np.uint8),
+        "is_int": np.frombuffer(is_int, dtype=np.uint8),
+        "comment_blocks": np.array(comment_blocks, dtype=np.uint64),
+        "comment_ends": comment_ends,
+        "comment_text": np.frombuffer("".join(comment_texts).encode(), dtype=np.uint8),
+    }
+    header = ArchiveHeader(
+        number=program.number,
+        preamble_comments=program.preamble_comments,
+        tools=program.tools,
+        number_format=program.number_format,
+        modal=program.modal,
+        columns={},
+    )
+    offset = 0
+    for name, dtype in _COLUMNS.items():
+        header.columns[name] = Column(offset=offset, count=len(data[name]))
+        offset = _aligned(offset + len(data[name]) * np.dtype(dtype).itemsize)
+    encoded = header.model_dump_json().encode()
+    table = _aligned(_PREAMBLE.size + len(encoded))
+
+    with open(fname, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, VERSION, len(encoded)))
+        f.write(encoded)
+        for name, dtype in _COLUMNS.items():
+            f.write(b"\0" * (table + header.columns[name].offset - f.tell()))
+            f.write(data[name].astype(dtype, copy=False).data)
+
+
+def load_archive(fname: Path | str) -> ProgramBuilder:
+    """Map a program saved with `save_archive` back in.
+
+    The blocks are numpy views of the mapped file, so loading takes about as long as reading the header and the
+    comments, however many blocks there are, and rendering reads the file as it goes. The modal state comes from the
+    header rather than replaying the blocks, so blocks added to a loaded program know which codes are active and where
+    the tool is, as with `load_program`.
+    """
+    with open(fname, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < _PREAMBLE.size:
+            raise ArchiveError(f"{fname} is too short to be a program archive")
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, header_size = _PREAMBLE.unpack_from(mapped)
+    if magic != MAGIC:
+        raise ArchiveError(f"{fname} is not a program archive")
+    if version != VERSION:
+        raise ArchiveError(f"{fname} is a version {version} archive, this version of mach30 reads version {VERSION}")
+    header = ArchiveHeader.model_validate_json(mapped[_PREAMBLE.size : _PREAMBLE.size + header_size])
+    table = _aligned(_PREAMBLE.size + header_size)
+
+    columns = {}
+    for name, dtype in _COLUMNS.items():
+        column = header.columns[name]
+        if table + column.offset + column.count * np.dtype(dtype).itemsize > size:
+            raise ArchiveError(f"{fname} is truncated: its {name} column runs past the end")
+        columns[name] = np.frombuffer(mapped, dtype=dtype, count=column.count, offset=table + column.offset)
+
+    text = columns["comment_text"].tobytes().decode()
+    ends = columns["comment_ends"].tolist()
+    comments = dict(zip(columns["comment_blocks"].tolist(), map(text.__getitem__, map(slice, [0] + ends, ends))))
+    store = MappedCodeStore(columns["types"], columns["numbers"], columns["is_int"], columns["offsets"], comments)
+    return ProgramBuilder(
+        number=header.number,
+        preamble_comments=header.preamble_comments,
+        tools=header.tools,
+        number_format=header.number_format,
+        codes=store,
+        modal=header.modal,
+    )
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
@@ -0,0 +1,201 @@
+import itertools
+import os
+import traceback
+import typing as t
+from pathlib import Path
+from time import perf_counter
+
+from pydantic import BaseModel, ValidationError
+
+from .builder import ProgramBuilder
+from .models import Tool
+
+
+class ToolLibrary(t.Mapping[int, Tool]):
+    """Tools by number, shared read-only by every job of a batch.
+
+    A batch sends its library to each worker process once, when the worker starts. Unpickling a model doesn't validate
+    it again, so workers get the tools exactly as they were built, however many jobs they run.
+    """
+
+    def __init__(self, tools: t.Iterable[Tool] = ()) -> None:
+        self._tools = {tool.number: tool for tool in tools}
+
+    def __getitem__(self, number: int) -> Tool:
+        return self._tools[number]
+
+    def __iter__(self) -> t.Iterator[int]:
+        return iter(self._tools)
+
+    def __len__(self) -> int:
+        return len(self._tools)
+
+    def __repr__(self) -> str:
+        return f"ToolLibrary({', '.join(str(tool) for tool in self._tools.values())})"
+
+
+# what a job can fail with: bad parameters or an invalid program, and errors writing it. Anything else is a bug and is
+# raised, not reported
+JOB_ERRORS = (OSError, ValueError, ValidationError)
+
+# fills in a builder: generate(builder, tools, **params)
+Generator = t.Callable[..., None]
+
+
+class JobResult(BaseModel):
+    """How one program of a batch went. `error` holds the traceback of a job that failed."""
+
+    number: int
+    params: dict[str, t.Any]
+    path: Path
+    blocks: int = 0
+    build_seconds: float = 0.0
+    save_seconds: float = 0.0
+    worker: int | None = None
+    error: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    @property
+    def seconds(self) -> float:
+        return self.build_seconds + self.save_seconds
+
+
+class BatchReport(BaseModel):
+    results: list[JobResult]
+    workers: int
+    seconds: float
+
+    @property
+    def failures(self) -> list[JobResult]:
+        return [result for result in self.results if not result.ok]
+
+    @property
+    def job_seconds(self) -> float:
+        """Time spent in the jobs themselves, added up over every worker"""
+        return sum(result.seconds for result in self.results)
+
+    def __str__(self) -> str:
+        lines = [
+            (
+                f"{len(self.results) - len(self.failures)} of {len(self.results)} programs in {self.seconds:.2f}s on "
+                f"{self.workers} workers ({self.job_seconds:.2f}s of jobs)"
+            )
+        ]
+        for result in self.failures:
+            lines.append(f"O{result.number:05} {result.params} failed: {t.cast(str, result.error).splitlines()[-1]}")
+        return "\n".join(lines)
+
+
+def parameter_grid(**axes: t.Iterable[t.Any]) -> list[dict[str, t.Any]]:
+    """Every combination of the values of each keyword, e.g. parameter_grid(width=[1, 2], depth=[0.1, 0.2])"""
+    names = list(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*axes.values())]
+
+
+class _Job(t.NamedTuple):
+    number: int
+    params: dict[str, t.Any]
+    path: Path
+
+
+class _Options(t.NamedTuple):
+    generate: Generator
+    tools: ToolLibrary
+    with_line_numbers: bool
+    stream: bool
+    preamble_comments: list[str]
+
+
+# what a worker process was started with, so jobs only carry their own parameters
+_worker_options: _Options | None = None
+
+
+def _start_worker(options: _Options) -> None:
+    global _worker_options
+    _worker_options = options
+
+
+def _run_job(job: _Job, options: _Options | None = None) -> JobResult:
+    options = options or t.cast(_Options, _worker_options)
+    result = JobResult(number=job.number, params=job.params, path=job.path, worker=os.getpid())
+    builder = ProgramBuilder(number=job.number, preamble_comments=list(options.preamble_comments))
+    start = perf_counter()
+    try:
+        if options.stream:
+            with builder.stream_to(job.path, with_line_numbers=options.with_line_numbers):
+                options.generate(builder, options.tools, **job.params)
+            result.build_seconds = perf_counter() - start
+        else:
+            options.generate(builder, options.tools, **job.params)
+            result.build_seconds = perf_counter() - start
+            start = perf_counter()
+            builder.save(job.path, with_line_numbers=options.with_line_numbers)
+            result.save_seconds = perf_counter() - start
+        result.blocks = len(builder.codes)
+    except JOB_ERRORS:
+        result.build_seconds = result.build_seconds or perf_counter() - start
+        result.error = traceback.format_exc()
+        # a failed job doesn't leave half a program behind
+        job.path.unlink(missing_ok=True)
+    return result
+
+
+def run_batch(
+    generate: Generator,
+    grid: t.Iterable[t.Mapping[str, t.Any]],
+    output_dir: Path | str,
+    tools: ToolLibrary | t.Iterable[Tool] = (),
+    workers: int | None = None,
+    first_number: int = 1,
+    filename: str = "O{number:05}.nc",
+    with_line_numbers: bool = False,
+    stream: bool = False,
+    preamble_comments: t.Sequence[str] = (),
+) -> BatchReport:
+    """Build and save a program for every set of parameters in `grid`, in `workers` processes (one per core by
+    default).
+
+    Every job gets a new builder numbered from `first_number` up, and calls `generate(builder, tools, **params)` to
+    fill it in. The program is then saved under `output_dir` as `filename`, formatted with its number and parameters,
+    or with `stream` it's written out while it's built (see `ProgramBuilder.stream_to`). `generate` has to be a module
+    level function so it can be sent to the workers. A job that fails with one of `JOB_ERRORS`, or whose worker dies,
+    doesn't stop the others; its traceback is in the report, and so are the timings of every job, in the order of
+    `grid`. Any other exception is raised.
+    """
+    workers = workers or os.cpu_count() or 1
+    assert workers >= 1, "need at least one worker"
+    library = tools if isinstance(tools, ToolLibrary) else ToolLibrary(tools)
+    options = _Options(generate, library, with_line_numbers, stream, list(preamble_comments))
+    output = Path(output_dir)
+    output.mkdir(parents=True, exist_ok=True)
+    jobs = [
+        _Job(number, dict(params), output / filename.format(number=number, **params))
+        for number, params in enumerate(grid, start=first_number)
+    ]
+    assert len({job.path for job in jobs}) == len(jobs), f"{filename!r} gives some programs the same file name"
+
+    start = perf_counter()
+    if workers == 1 or len(jobs) <= 1:
+        results = [_run_job(job, options) for job in jobs]
+        return BatchReport(results=results, workers=1, seconds=perf_counter() - start)
+
+    # imported here as the process pool machinery is slow to import and most programs never need it
+    from concurrent.futures import ProcessPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+
+    workers = min(workers, len(jobs))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_start_worker, initargs=(options,)) as pool:
+        futures = [pool.submit(_run_job, job) for job in jobs]
+        results = []
+        for job, future in zip(jobs, futures):
+            try:
+                results.append(future.result())
+            except BrokenProcessPool:
+                # the worker itself went down
+                results.append(
+                    JobResult(number=job.number, params=job.params, path=job.path, error=traceback.format_exc())
+                )
+    return BatchReport(results=results, workers=workers, seconds=perf_counter() - start)
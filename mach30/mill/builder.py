@@ -1,8 +1,12 @@
+import functools
+import itertools
+import os
 import typing as t
 from pathlib import Path
+from time import perf_counter_ns
 from typing import SupportsFloat as maybe_float
 
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field
 
 from mach30.enums import (
     CircularMotionDirection,
@@ -10,12 +14,12 @@ from mach30.enums import (
     GGroups,
     MotionPlane,
     PositionMode,
-    SpindleDirection,
     ToolLengthCompensation,
     Units,
     WorkOffset,
 )
 
+from .formatting import DEFAULT_FORMAT, NumberFormat
 from .gcode_basic import (
     CancelCannedCycle,
     CancelCutterComp,
@@ -24,11 +28,50 @@ from .gcode_basic import (
     CWFeed,
     LinearFeed,
     Rapid,
-    UseMachineCoord,
 )
-from .helpers import combine_codes, kwargs_to_codes
+from .helpers import combine_codes, kwargs_to_codes, kwargs_to_words
 from .mcode import MCode, ToolChange
-from .models import Code, GCode, SpindleSettings, Tool
+from .modal_state import ModalState
+from .models import (
+    G_CODE_GROUPS,
+    Code,
+    GCode,
+    SpindleSettings,
+    Tool,
+    Word,
+    flatten_code,
+    freeze,
+)
+from .store import CODE_TYPES, TYPE_INDEX, CodeSink, CodeStore, write_lines, write_text
+
+if t.TYPE_CHECKING:
+    import numpy as np
+    from numpy.typing import ArrayLike
+
+    from .cache import SaveCache
+    from .instrument import Stats
+
+F = t.TypeVar("F", bound=t.Callable[..., t.Any])
+
+MOTION_CODES: dict[int, type[Rapid | LinearFeed | CWFeed | CCWFeed]] = {
+    0: Rapid,
+    1: LinearFeed,
+    CircularMotionDirection.CLOCKWISE.value: CWFeed,
+    CircularMotionDirection.COUNTERCLOCKWISE.value: CCWFeed,
+}
+
+
+# blocks every program starts and ends with, frozen so they are shared and only ever rendered once. They're made
+# without validating, which would build their classes
+PROGRAM_START: tuple[Code, ...] = (
+    freeze(CancelCannedCycle.model_construct(comment="cancel canned cycle")),
+    freeze(CancelCutterComp.model_construct(comment="cancel cutter compensation")),
+    freeze(CancelToolLengthComp.model_construct(comment="cancel tool length compensation")),
+)
+PROGRAM_END: tuple[Code, ...] = (
+    freeze(MCode.model_construct(code_number=5, comment="turn off spindle")),
+    freeze(MCode.model_construct(code_number=30, comment="end program")),
+)
 
 
 class BuilderCtx:
@@ -44,25 +87,52 @@ class BuilderCtx:
         self.exit_cb(self)
 
 
+def _timed(timer: str) -> t.Callable[[F], F]:
+    """Time a ProgramBuilder method under `timer` in the builder's stats while it's instrumented. Only for methods that
+    run once in a while; the ones that run for every block time themselves, as even an empty wrapper slows them down."""
+
+    def decorate(method: F) -> F:
+        @functools.wraps(method)
+        def wrapper(self: "ProgramBuilder", *args: t.Any, **kwargs: t.Any) -> t.Any:
+            if (stats := self.__pydantic_private__["_stats"]) is None:  # type: ignore[index]
+                return method(self, *args, **kwargs)
+            start = perf_counter_ns()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                stats.record(timer, start)
+
+        return t.cast(F, wrapper)
+
+    return decorate
+
+
 class ProgramBuilder(BaseModel):
+    # built the first time a builder is made, like the codes, and the save cache and instrumentation modules are
+    # imported by the methods that use them, so importing the builder builds no models
+    model_config = ConfigDict(validate_assignment=True, defer_build=True)
+
     number: int
     preamble_comments: t.List[str] = []
-    codes: t.List[Code] = []
+    codes: CodeStore = Field(default_factory=CodeStore)
     tools: t.List[Tool] = []
+    number_format: NumberFormat = DEFAULT_FORMAT
 
-    modal_stacks: t.Dict[GGroups, t.List[Code]] = {}
-    mode_stack: t.List[GGroups] = []
+    modal: ModalState = Field(default_factory=ModalState)
 
-    _coolant_on: bool = False
-    _use_global: bool = False
-    _motion_feedrate: int | float | None = None
-    _spindle_settings: SpindleSettings = SpindleSettings(direction=SpindleDirection.OFF, speed=0)  # should be stack
+    # set while instrumented, and read straight from the private attributes by the methods that time themselves,
+    # which is much quicker than going through pydantic's attribute lookup
+    _stats: "Stats | None" = None
+    _detailed_stats: "Stats | None" = None
+
+    @property
+    def stats(self) -> "Stats | None":
+        """The Stats being collected while the builder is instrumented"""
+        return self._stats
 
     @property
     def current_mode(self) -> GGroups | None:
-        if not self.mode_stack:
-            return None
-        return self.mode_stack[-1]
+        return self.modal.last_group
 
     @property
     def current_tool(self) -> Tool | None:
@@ -72,46 +142,180 @@ class ProgramBuilder(BaseModel):
 
     @property
     def current_mode_op(self) -> Code | None:
-        if not self.current_mode:
-            return None
-        stack = self.modal_stacks.get(self.current_mode, [])
-        if not stack:
-            return None
-        return stack[-1]
+        return self.modal.current_code
 
     def _add_one(self, code: Code) -> None:
-        if hasattr(code, "group"):
-            self.modal_stacks.setdefault(code.group, []).append(code)
-            if code.group != GGroups.NONMODAL:
-                self.mode_stack.append(code.group)
-
-        if self._use_global:
-            self.codes.append(UseMachineCoord(sub_codes=[code], comment=code.comment))
-        else:
-            self.codes.append(code)
+        modal = self.modal
+        if isinstance(code, GCode):
+            modal.set(code)
+        self._add_words(flatten_code(code), code.comment)
+
+    def _add_words(self, words: list[Word], comment: str | None = None) -> None:
+        # Fast path for blocks without a modal code: skip building Code objects entirely
+        modal = self.modal
+        if modal.machine_coordinates:
+            words.insert(0, ("G", 53))
+        self.codes.append_words(words, comment)
+        modal.move(words)
 
     def add(self, *codes: Code) -> None:
-        for code in codes:
-            self._add_one(code)
+        if (stats := self.__pydantic_private__["_stats"]) is not None:  # type: ignore[index]
+            start = perf_counter_ns()
+        try:
+            for code in codes:
+                self._add_one(code)
+        finally:
+            if stats is not None:
+                stats.record("add", start)
 
     def __str__(self) -> str:
         return self.render(with_line_numbers=True)
 
-    def render(self, with_line_numbers: bool = False) -> str:
-        return f"%\nO{self.number:05}\n{self._render_comments()}\n\n{self._render_codes(with_line_numbers=with_line_numbers)}\n%"
+    @_timed("render")
+    def render(self, with_line_numbers: bool = False, workers: int = 1) -> str:
+        """The program's text. With `workers` above one the blocks are rendered in that many processes."""
+        if workers > 1 and self.codes:
+            blocks = self.codes.render_chunks(workers, with_line_numbers, self.number_format)
+            return "\n".join(self._header_lines()) + "\n" + "".join(blocks) + "%"
+        return "\n".join(self.iter_lines(with_line_numbers=with_line_numbers))
+
+    def iter_lines(self, with_line_numbers: bool = False, cache: bool = True) -> t.Iterator[str]:
+        yield from self._header_lines()
+        if not self.codes:
+            yield ""
+        yield from self._iter_code_lines(with_line_numbers=with_line_numbers, cache=cache)
+        yield "%"
+
+    def _header_lines(self) -> list[str]:
+        return ["%", f"O{self.number:05}", self._render_comments(), ""]
 
     def _render_comments(self) -> str:
         all_comments = self.preamble_comments + [str(tool) for tool in self.tools]
         return "\n".join(f"({comment})" for comment in all_comments)
 
     def _render_codes(self, with_line_numbers: bool = False) -> str:
+        return "\n".join(self._iter_code_lines(with_line_numbers=with_line_numbers))
+
+    def _iter_code_lines(self, with_line_numbers: bool = False, cache: bool = True) -> t.Iterator[str]:
+        # block text is cached on the store, so rendering with and without line numbers only renders the blocks once
+        blocks = self.codes.render_blocks(cache=cache, number_format=self.number_format)
         if with_line_numbers:
-            return "\n".join(f"N{i:03} {code.render()}" for i, code in enumerate(self.codes, start=1))
-        return "\n".join(code.render() for code in self.codes)
+            return (f"N{i:03} {block}" for i, block in enumerate(blocks, start=1))
+        return blocks
+
+    def digest(self) -> str:
+        """A hash of everything the program's text is made from: its number, preamble comments, tools, number format
+        and blocks. The blocks are hashed as they're added (see `CodeStore.digest`), so only the header is hashed
+        whole."""
+        # imported here as hashlib is slow to import and most programs are never hashed
+        import hashlib
+
+        header = self.model_dump_json(include={"number", "preamble_comments", "tools", "number_format"})
+        return hashlib.blake2b(f"{header}\0{self.codes.digest()}".encode(), digest_size=16).hexdigest()
 
-    def save(self, fname: Path, with_line_numbers: bool = False) -> None:
-        with open(fname, "w") as f:
-            print(self.render(with_line_numbers=with_line_numbers), file=f)
+    def save(
+        self,
+        fname: Path | str | t.IO,
+        with_line_numbers: bool = False,
+        chunk_lines: int = 4096,
+        workers: int = 1,
+        cache: "SaveCache | None" = None,
+    ) -> None:
+        """Write the program to a path or an open stream.
+
+        A path gets a temporary file next to it that's renamed over it when done, so the program is never seen half
+        written. With a `cache`, a program that's the same as the one last saved to the path (by `digest`) isn't
+        rendered or written again, as long as the file wasn't changed since.
+        """
+        from .cache import atomic_open
+
+        if not isinstance(fname, (str, os.PathLike)):
+            self.write(fname, with_line_numbers=with_line_numbers, chunk_lines=chunk_lines, workers=workers)
+            return
+        digest = ""
+        if cache is not None:
+            digest = f"{self.digest()}{'-numbered' if with_line_numbers else ''}"
+            if cache.is_current(fname, digest):
+                return
+        with atomic_open(fname) as f:
+            self.write(f, with_line_numbers=with_line_numbers, chunk_lines=chunk_lines, workers=workers)
+        if cache is not None:
+            cache.record(fname, digest)
+
+    @_timed("write")
+    def write(self, stream: t.IO, with_line_numbers: bool = False, chunk_lines: int = 4096, workers: int = 1) -> None:
+        if workers > 1 and self.codes:
+            write_lines(stream, self._header_lines())
+            for text in self.codes.render_chunks(workers, with_line_numbers, self.number_format):
+                write_text(stream, text)
+            write_lines(stream, ["%"])
+            return
+        # Only chunk_lines rendered lines are held at a time, so memory stays flat no matter the program size. Text that
+        # an earlier render cached is reused, but nothing new is cached.
+        chunk: list[str] = []
+        for line in self.iter_lines(with_line_numbers=with_line_numbers, cache=False):
+            chunk.append(line)
+            if len(chunk) >= chunk_lines:
+                write_lines(stream, chunk)
+                chunk.clear()
+        write_lines(stream, chunk)
+
+    def stream_to(
+        self, fname: Path | str | t.IO, with_line_numbers: bool = False, chunk_lines: int = 4096
+    ) -> "BuilderCtx":
+        """Write blocks out as they are added instead of keeping them on the builder.
+
+        The tool comments in the header are only known once the program is done. When streaming to a path the blocks
+        go to a temporary file next to it, and on exit the header and the blocks replace the path in one go, as with
+        `save`; a stream gets its header up front, so every tool has to be in `tools` before streaming starts.
+        """
+        import contextlib
+        import shutil
+        import tempfile
+
+        from .cache import atomic_open
+
+        # the temporary body lives from entering the stream to leaving it
+        files = contextlib.ExitStack()
+        streamed_header: list[str] = []
+
+        def enter_stream(ctx: "BuilderCtx") -> None:
+            if isinstance(fname, (str, os.PathLike)):
+                # an unnamed file, removed as soon as `files` closes it on exit
+                temp = tempfile.TemporaryFile("w+", dir=Path(fname).parent, suffix=".body")  # noqa: SIM115
+                body = files.enter_context(temp)
+                sink = CodeSink(body, with_line_numbers, chunk_lines, self.number_format)
+            else:
+                streamed_header.extend(ctx.builder._header_lines())
+                write_lines(fname, streamed_header)
+                sink = CodeSink(fname, with_line_numbers, chunk_lines, self.number_format)
+            for i in range(len(ctx.builder.codes)):
+                sink.append_words(ctx.builder.codes.words(i), ctx.builder.codes.comment(i))
+            ctx.builder.codes = sink
+
+        def exit_stream(ctx: "BuilderCtx") -> None:
+            sink = ctx.builder.codes
+            assert isinstance(sink, CodeSink)
+            with files:
+                # the builder keeps the sink, which only knows how many blocks were written, so a streamed program
+                # can't be rendered or saved again, or added to
+                sink.finish()
+                footer = [""] if not sink else []
+                footer.append("%")
+                if not isinstance(fname, (str, os.PathLike)):
+                    write_lines(sink.stream, footer)
+                    assert (
+                        ctx.builder._header_lines() == streamed_header
+                    ), "the header changed after it was streamed; declare all tools before streaming"
+                    return
+                # like save, the program replaces the file in one go, so it's never seen half written
+                sink.stream.seek(0)
+                with atomic_open(fname) as f:
+                    write_lines(f, ctx.builder._header_lines())
+                    shutil.copyfileobj(sink.stream, f)
+                    write_lines(f, footer)
+
+        return BuilderCtx(self, enter_stream, exit_stream)
 
     def compensate(
         self,
@@ -206,10 +410,10 @@ class ProgramBuilder(BaseModel):
                     comment="set spindle direction and speed",
                 )
             )
-            self._spindle_settings = tool.spindle
+            self.modal.spindle = tool.spindle
 
     def override_spindle(self, new_settings: SpindleSettings) -> "BuilderCtx":
-        old_settings = self._spindle_settings
+        old_settings = self.modal.spindle
 
         def enter_spindle(ctx: "BuilderCtx") -> None:
             ctx.builder.add(
@@ -219,7 +423,7 @@ class ProgramBuilder(BaseModel):
                     comment="set spindle direction and speed",
                 )
             )
-            ctx.builder._spindle_settings = new_settings
+            ctx.builder.modal.spindle = new_settings
 
         def exit_spindle(ctx: "BuilderCtx") -> None:
             ctx.builder.add(
@@ -229,7 +433,7 @@ class ProgramBuilder(BaseModel):
                     comment="reset spindle direction and speed",
                 )
             )
-            ctx.builder._spindle_settings = old_settings
+            ctx.builder.modal.spindle = old_settings
 
         return BuilderCtx(self, enter_spindle, exit_spindle)
 
@@ -257,13 +461,10 @@ class ProgramBuilder(BaseModel):
 
     def program(self) -> "BuilderCtx":
         def start_program(ctx: "BuilderCtx") -> None:
-            ctx.builder.add(CancelCannedCycle(comment="cancel canned cycle"))
-            ctx.builder.add(CancelCutterComp(comment="cancel cutter compensation"))
-            ctx.builder.add(CancelToolLengthComp(comment="cancel tool length compensation"))
+            ctx.builder.add(*PROGRAM_START)
 
         def exit_program(ctx: "BuilderCtx") -> None:
-            ctx.builder.add(MCode(code_number=5, comment="turn off spindle"))
-            ctx.builder.add(MCode(code_number=30, comment="end program"))
+            ctx.builder.add(*PROGRAM_END)
 
         return BuilderCtx(self, start_program, exit_program)
 
@@ -281,13 +482,13 @@ class ProgramBuilder(BaseModel):
         comment: str | None = None,
     ) -> None:
 
-        self._move(Rapid(), comment=comment, x=x, y=y, z=z, a=a, b=b, c=c)
+        self._move(0, comment=comment, x=x, y=y, z=z, a=a, b=b, c=c)
 
     def _resolve_feedrate(self, feedrate: maybe_float | None) -> float:
         if feedrate is not None:
             return float(feedrate)
-        assert self._motion_feedrate is not None, "You need to provide an initial feedrate"
-        return float(self._motion_feedrate)
+        assert self.modal.feedrate is not None, "You need to provide an initial feedrate"
+        return float(self.modal.feedrate)
 
     def linear_feed(
         self,
@@ -300,9 +501,17 @@ class ProgramBuilder(BaseModel):
         c: maybe_float | None = None,
         comment: str | None = None,
     ) -> None:
-        motion_code = LinearFeed.with_feedrate(feedrate=self._resolve_feedrate(feedrate))
-
-        self._move(motion_code, comment=comment, x=x, y=y, z=z, a=a, b=b, c=c)
+        self._move(
+            1,
+            feedrate=self._resolve_feedrate(feedrate),
+            comment=comment,
+            x=x,
+            y=y,
+            z=z,
+            a=a,
+            b=b,
+            c=c,
+        )
 
     def circular_feed(
         self,
@@ -318,66 +527,224 @@ class ProgramBuilder(BaseModel):
         r: maybe_float | None = None,
         comment: str | None = None,
     ) -> None:
-        use_feedrate = self._resolve_feedrate(feedrate)
-
-        motion_code: CWFeed | CCWFeed = (
-            CWFeed.with_feedrate(feedrate=use_feedrate)
-            if direction == CircularMotionDirection.CLOCKWISE
-            else CCWFeed.with_feedrate(feedrate=use_feedrate)
+        self._move(
+            direction.value,
+            feedrate=self._resolve_feedrate(feedrate),
+            comment=comment,
+            x=x,
+            y=y,
+            z=z,
+            a=a,
+            i=i,
+            j=j,
+            k=k,
+            r=r,
         )
 
-        self._move(motion_code, comment=comment, x=x, y=y, z=z, a=a, i=i, j=j, k=k, r=r)
-
     def _move(
         self,
-        motion_code: Rapid | LinearFeed | CWFeed | CCWFeed,
+        motion: int,
+        feedrate: float | None = None,
         comment: str | None = None,
         **kwargs: maybe_float | None,
     ) -> None:
-        codes: t.List[Code] = []
-        if self._should_update_motion(motion_code):
-            codes.append(motion_code)
-            if motion_code.code_number in (1, 2, 3):
-                assert hasattr(motion_code, "feedrate")  # you're welcome mypy
-                self._motion_feedrate = motion_code.feedrate
-
-        codes.extend(kwargs_to_codes(**kwargs))
-        if maybe_code := combine_codes(codes):
-            if comment:
-                maybe_code.comment = comment
-            self.add(maybe_code)
+        if (stats := self.__pydantic_private__["_stats"]) is not None:  # type: ignore[index]
+            start = perf_counter_ns()
+        try:
+            if not self._should_update_motion(motion, feedrate):
+                # Motion mode is unchanged, so the block is only axis words and never needs Code objects
+                if words := kwargs_to_words(**kwargs):
+                    self._add_words(words, comment)
+                return
+
+            if feedrate is not None:
+                self.modal.feedrate = feedrate
+            if maybe_code := self._motion_code(motion, feedrate, **kwargs):
+                if comment:
+                    maybe_code.comment = comment
+                self.add(maybe_code)
+        finally:
+            if stats is not None:
+                stats.record("move", start)
+
+    def _motion_code(self, motion: int, feedrate: float | None, **kwargs: maybe_float | None) -> Code | None:
+        if (stats := self.__pydantic_private__["_detailed_stats"]) is not None:  # type: ignore[index]
+            start = perf_counter_ns()
+        try:
+            motion_cls = MOTION_CODES[motion]
+            codes: list[Code] = []
+            if feedrate is None:
+                codes.append(motion_cls())
+            else:
+                codes.append(motion_cls.with_feedrate(feedrate=feedrate))  # type: ignore[union-attr]
+            codes.extend(kwargs_to_codes(**kwargs))
+            return combine_codes(codes)
+        finally:
+            if stats is not None:
+                stats.record("build_codes", start)
+
+    def rapid_many(
+        self,
+        x: "ArrayLike | None" = None,
+        y: "ArrayLike | None" = None,
+        z: "ArrayLike | None" = None,
+        a: "ArrayLike | None" = None,
+        b: "ArrayLike | None" = None,
+        c: "ArrayLike | None" = None,
+    ) -> None:
+        """rapid() for every point of the given coordinate arrays; NaN leaves an axis out of that point's block"""
+        self._move_many(0, None, x=x, y=y, z=z, a=a, b=b, c=c)
+
+    def linear_feed_many(
+        self,
+        feedrate: "ArrayLike | None" = None,
+        x: "ArrayLike | None" = None,
+        y: "ArrayLike | None" = None,
+        z: "ArrayLike | None" = None,
+        a: "ArrayLike | None" = None,
+        b: "ArrayLike | None" = None,
+        c: "ArrayLike | None" = None,
+    ) -> None:
+        """linear_feed() for every point of the given arrays. `feedrate` may be a scalar or an array as well."""
+        self._move_many(1, feedrate, x=x, y=y, z=z, a=a, b=b, c=c)
+
+    def circular_feed_many(
+        self,
+        direction: CircularMotionDirection,
+        feedrate: "ArrayLike | None" = None,
+        x: "ArrayLike | None" = None,
+        y: "ArrayLike | None" = None,
+        z: "ArrayLike | None" = None,
+        a: "ArrayLike | None" = None,
+        i: "ArrayLike | None" = None,
+        j: "ArrayLike | None" = None,
+        k: "ArrayLike | None" = None,
+        r: "ArrayLike | None" = None,
+    ) -> None:
+        self._move_many(direction.value, feedrate, x=x, y=y, z=z, a=a, i=i, j=j, k=k, r=r)
+
+    @_timed("move_many")
+    def _move_many(self, motion: int, feedrate: "ArrayLike | None", **kwargs: "ArrayLike | None") -> None:
+        import numpy as np
+
+        axes = {key: np.asarray(values, dtype=np.float64) for key, values in kwargs.items() if values is not None}
+        if not axes:
+            return
+        columns = np.stack(np.broadcast_arrays(*axes.values()))
+        assert columns.ndim == 2, "coordinates must be one-dimensional"
+        count = columns.shape[1]
+
+        # A block only needs its motion code when the mode or the feedrate changes, which is the first point (where
+        # _move decides for itself) and every point whose feedrate differs from the one before it
+        starts = [0]
+        feedrates: np.ndarray | None = None
+        if motion != 0:
+            if feedrate is None:
+                feedrate = self._resolve_feedrate(None)
+            feedrates = np.broadcast_to(np.asarray(feedrate, dtype=np.float64), (count,))
+            assert not np.isnan(feedrates).any(), "feedrates can't be NaN"
+            starts.extend((np.flatnonzero(feedrates[1:] != feedrates[:-1]) + 1).tolist())
+        starts.append(count)
+
+        letters = [key.upper() for key in axes]
+        for start, stop in itertools.pairwise(starts):
+            point = {key: None if np.isnan(value) else float(value) for key, value in zip(axes, columns[:, start])}
+            self._move(motion, None if feedrates is None else float(feedrates[start]), None, **point)
+            if stop > start + 1:
+                self._add_columns(letters, columns[:, start + 1 : stop])
+
+    @_timed("add_columns")
+    def _add_columns(self, letters: list[str], columns: "np.ndarray") -> None:
+        """Append one block per column of `columns` (one row per letter), skipping NaN words like _add_words"""
+        import numpy as np
+
+        self.modal.move_columns(letters, columns)
+        present = ~np.isnan(columns)
+        types = np.array([TYPE_INDEX[letter] for letter in letters], dtype=np.uint8)
+        is_int = np.zeros(len(letters), dtype=np.uint8)
+        if self.modal.machine_coordinates:
+            present = np.vstack([present.any(axis=0), present])
+            columns = np.vstack([np.full(columns.shape[1], 53.0), columns])
+            types = np.concatenate([[TYPE_INDEX["G"]], types]).astype(np.uint8)
+            is_int = np.concatenate([[1], is_int]).astype(np.uint8)
+        # word order is block by block, then letter by letter
+        present, columns = present.T, columns.T
+        counts = present.sum(axis=1)
+        ends = np.cumsum(counts[counts > 0])
+        self.codes.extend_columns(
+            np.broadcast_to(types, present.shape)[present].tolist(),
+            columns[present].tolist(),
+            np.broadcast_to(is_int, present.shape)[present].tolist(),
+            ends.tolist(),
+        )
+
+    def instrument(self, stats: "Stats | None" = None, detailed: bool = False) -> "BuilderCtx":
+        """Count the modal codes and words added and time the builder's main methods while in this context.
+
+        The context gives back the Stats being filled in (a new one unless `stats` is given), which can be exported
+        with `to_dict` or `to_prometheus`. Words and modal codes are counted from the stored program when the context
+        exits, so they aren't counted for blocks streamed out with `stream_to`.
+
+        `add` and `move` run for every block, so they check whether the builder is instrumented themselves and only
+        read the clock when it is; rendering, writing and adding many blocks at once are wrapped. `detailed` also times
+        building the codes of a move and deciding whether it needs a motion code.
+        """
+        import numpy as np
+
+        from .instrument import Stats
+
+        collected = stats or Stats()
+        codes, first_word = self.codes, 0
+
+        def enter_instrument(ctx: "BuilderCtx") -> Stats:
+            nonlocal first_word
+            if not isinstance(codes, CodeSink):
+                first_word = len(codes.columns[0])
+            ctx.builder._stats = collected
+            ctx.builder._detailed_stats = collected if detailed else None
+            return collected
+
+        def exit_instrument(ctx: "BuilderCtx") -> None:
+            ctx.builder._stats = ctx.builder._detailed_stats = None
+            if ctx.builder.codes is codes and not isinstance(codes, CodeSink):
+                types = np.frombuffer(codes.columns[0], dtype=np.uint8)[first_word:]
+                counts = np.bincount(types, minlength=len(CODE_TYPES))
+                collected.words.update({CODE_TYPES[i]: int(counts[i]) for i in np.flatnonzero(counts)})
+                numbers = np.frombuffer(codes.columns[1], dtype=np.float64)[first_word:]
+                g_numbers, g_counts = np.unique(numbers[types == TYPE_INDEX["G"]], return_counts=True)
+                for number, count in zip(g_numbers.tolist(), g_counts.tolist()):
+                    if (group := G_CODE_GROUPS.get(number)) is not None:
+                        collected.groups[group.name] += count
+
+        return BuilderCtx(self, enter_instrument, exit_instrument)
 
     def use_global(self) -> "BuilderCtx":
+        previous = self.modal.machine_coordinates
+
         def enter_global(ctx: "BuilderCtx") -> None:
-            ctx.builder._use_global = True
+            ctx.builder.modal.machine_coordinates = True
 
         def exit_global(ctx: "BuilderCtx") -> None:
-            ctx.builder._use_global = False
+            ctx.builder.modal.machine_coordinates = previous
 
         return BuilderCtx(self, enter_global, exit_global)
 
-    def _should_update_motion(self, new_code: Rapid | LinearFeed | CWFeed | CCWFeed) -> bool:
-        if self.current_mode is None:
-            return True
-        if self.current_mode != GGroups.MOTION:
-            return True
-        if self.current_mode_op is None:
-            return True
-        if self.current_mode_op.code_number != new_code.code_number:
-            return True
-        if new_code.code_number in (1, 2, 3):
-            assert hasattr(new_code, "feedrate")  # you're welcome mypy
-            feedrate = new_code.feedrate
-            if self._motion_feedrate is None or self._motion_feedrate != feedrate:
+    def _should_update_motion(self, motion: int, feedrate: float | None = None) -> bool:
+        if (stats := self.__pydantic_private__["_detailed_stats"]) is not None:  # type: ignore[index]
+            start = perf_counter_ns()
+        try:
+            modal = self.modal
+            if modal.last_group != GGroups.MOTION:
+                return True
+            if t.cast(Code, modal.codes[GGroups.MOTION]).code_number != motion:
                 return True
-        return False
+            return feedrate is not None and (modal.feedrate is None or modal.feedrate != feedrate)
+        finally:
+            if stats is not None:
+                stats.record("should_update_motion", start)
 
     def _should_update_spindle(self, new_spindle: SpindleSettings) -> bool:
-        if self._spindle_settings is None:
-            return True
-        if self._spindle_settings != new_spindle:
-            return True
-        return False
+        return self.modal.spindle != new_spindle
 
     def zhome(self, comment: str | None = None) -> None:
         with self.use_global():
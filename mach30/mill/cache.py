@@ -0,0 +1,93 @@
+import os
+import threading
+import typing as t
+from contextlib import contextmanager
+from pathlib import Path
+
+from pydantic import BaseModel, ValidationError
+
+
+class CacheEntry(BaseModel):
+    """The digest of the program saved to a file, and the size and modification time the file had once written"""
+
+    digest: str
+    size: int
+    mtime_ns: int
+
+
+class _Entries(BaseModel):
+    files: dict[str, CacheEntry] = {}
+
+
+class SaveCache:
+    """What was last saved to each file, so that saving a program that hasn't changed since can be skipped.
+
+    A file that was changed or removed after it was saved is written again. The cache is read when it's created and
+    written back by `flush`, or on leaving a `with` block:
+
+        with SaveCache("programs/.mach30-cache.json") as cache:
+            for program in programs:
+                program.save(f"programs/O{program.number:05}.nc", cache=cache)
+    """
+
+    def __init__(self, fname: Path | str) -> None:
+        self.fname = Path(fname)
+        try:
+            self._entries = _Entries.model_validate_json(self.fname.read_bytes())
+        except (FileNotFoundError, ValidationError):
+            # a cache that can't be read only costs writing everything once more
+            self._entries = _Entries()
+        self._changed = False
+
+    def __enter__(self) -> t.Self:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.flush()
+
+    def __len__(self) -> int:
+        return len(self._entries.files)
+
+    def is_current(self, fname: Path | str, digest: str) -> bool:
+        """Whether `fname` still holds what was saved to it with this digest"""
+        entry = self._entries.files.get(_key(fname))
+        if entry is None or entry.digest != digest:
+            return False
+        try:
+            stat = os.stat(fname)
+        except FileNotFoundError:
+            return False
+        return (stat.st_size, stat.st_mtime_ns) == (entry.size, entry.mtime_ns)
+
+    def record(self, fname: Path | str, digest: str) -> None:
+        stat = os.stat(fname)
+        self._entries.files[_key(fname)] = CacheEntry(digest=digest, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+        self._changed = True
+
+    def flush(self) -> None:
+        if not self._changed:
+            return
+        with atomic_open(self.fname, "w") as f:
+            f.write(self._entries.model_dump_json())
+        self._changed = False
+
+
+def _key(fname: Path | str) -> str:
+    return str(Path(fname).absolute())
+
+
+@contextmanager
+def atomic_open(fname: Path | str, mode: str = "w") -> t.Iterator[t.IO]:
+    """Open a temporary file next to `fname` that replaces it once the block is done, so `fname` is never seen half
+    written. If the block raises, the temporary file is removed and `fname` is left as it was."""
+    path = Path(fname)
+    # the pid and thread keep concurrent writers of the same file apart, and open() gives the file the usual
+    # permissions, which a NamedTemporaryFile (always 0600) wouldn't
+    temp = path.with_name(f".{path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+    try:
+        with open(temp, mode) as f:
+            yield f
+    except BaseException:
+        temp.unlink(missing_ok=True)
+        raise
+    os.replace(temp, path)
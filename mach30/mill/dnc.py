@@ -0,0 +1,221 @@
+import asyncio
+import os
+import termios
+import tty
+import typing as t
+from collections import deque
+from enum import Enum
+from time import perf_counter
+
+from pydantic import BaseModel
+
+from .builder import ProgramBuilder
+
+XON = 0x11
+XOFF = 0x13
+
+
+class FlowControl(Enum):
+    # the controller sends XOFF when its buffer fills up and XON once it can take more
+    XON_XOFF = "xon/xoff"
+    # the controller answers every line it's done with, e.g. "ok"
+    ACK = "ack"
+
+
+class FeedMetrics(BaseModel):
+    """How a drip feed went. `last_line` is the number of the last line sent, so a feed can resume after it."""
+
+    lines_sent: int = 0
+    bytes_sent: int = 0
+    last_line: int = 0
+    seconds: float = 0.0
+    paused_seconds: float = 0.0
+    acks: int = 0
+    ack_latency_total: float = 0.0
+    ack_latency_max: float = 0.0
+
+    @property
+    def lines_per_second(self) -> float:
+        return self.lines_sent / self.seconds if self.seconds else 0.0
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes_sent / self.seconds if self.seconds else 0.0
+
+    @property
+    def ack_latency_mean(self) -> float | None:
+        return self.ack_latency_total / self.acks if self.acks else None
+
+
+def program_lines(program: ProgramBuilder | t.Iterable[str], with_line_numbers: bool = False) -> t.Iterator[str]:
+    """The lines of a program as they'd be saved to a file, one physical line each"""
+    lines = program.iter_lines(with_line_numbers, cache=False) if isinstance(program, ProgramBuilder) else program
+    for line in lines:
+        # the header's comments come as one string
+        if "\n" in line:
+            yield from line.split("\n")
+        else:
+            yield line
+
+
+async def open_serial(
+    path: str | os.PathLike, baudrate: int = 9600
+) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """Streams for a serial port (or a pty) in raw mode, so XON and XOFF reach the feeder instead of the tty driver"""
+    fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    try:
+        tty.setraw(fd)
+        attributes = termios.tcgetattr(fd)
+        attributes[4] = attributes[5] = getattr(termios, f"B{baudrate}")
+        termios.tcsetattr(fd, termios.TCSANOW, attributes)
+    except BaseException:
+        os.close(fd)
+        raise
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(fd, "rb", buffering=0))
+    transport, protocol = await loop.connect_write_pipe(
+        asyncio.streams.FlowControlMixin, os.fdopen(os.dup(fd), "wb", buffering=0)
+    )
+    return reader, asyncio.StreamWriter(transport, protocol, reader, loop)
+
+
+class DripFeeder:
+    """Sends a program to a controller a line at a time, as fast as the controller's flow control allows.
+
+    With XON/XOFF, sending stops as soon as an XOFF is read and `buffer_lines` is how many lines are written before
+    looking for one (and waiting for them to leave), which bounds how far past an XOFF the feed runs. With acks, at most
+    `buffer_lines` lines are sent ahead of their acks, so it should be no more than the controller's buffer holds; any
+    other answer from the controller stops the feed with a RuntimeError.
+    """
+
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        flow: FlowControl = FlowControl.XON_XOFF,
+        buffer_lines: int = 16,
+        ack: bytes = b"ok",
+        newline: str = "\n",
+        encoding: str = "ascii",
+    ) -> None:
+        assert buffer_lines > 0, "at least one line has to be in flight"
+        self.reader = reader
+        self.writer = writer
+        self.flow = flow
+        self.buffer_lines = buffer_lines
+        self.ack = ack
+        self.newline = newline
+        self.encoding = encoding
+        self.metrics = FeedMetrics()
+        self._resume = asyncio.Event()
+        self._window = asyncio.Semaphore(buffer_lines)
+        self._sent_at: deque[float] = deque()
+        self._paused_at: float | None = None
+        self._listener: asyncio.Task | None = None
+
+    async def feed(
+        self, program: ProgramBuilder | t.Iterable[str], start_line: int = 1, with_line_numbers: bool = False
+    ) -> FeedMetrics:
+        """Send every line of `program` from line number `start_line` (counted from 1) on, and wait until the
+        controller has taken them all. `metrics` is kept up to date while it runs, so it's still there if it fails.
+        """
+        metrics, writer, ack = self.metrics, self.writer, self.flow == FlowControl.ACK
+        self._resume.set()
+        self._listener = asyncio.create_task(self._listen())
+        start = perf_counter()
+        unflushed = 0
+        try:
+            for number, line in enumerate(program_lines(program, with_line_numbers), start=1):
+                if number < start_line:
+                    continue
+                if ack:
+                    if self._window.locked():
+                        await self._until(self._window.acquire())
+                    else:
+                        await self._window.acquire()
+                elif not self._resume.is_set():
+                    await self._until(self._resume.wait())
+                data = (line + self.newline).encode(self.encoding)
+                writer.write(data)
+                if ack:
+                    self._sent_at.append(perf_counter())
+                metrics.lines_sent += 1
+                metrics.bytes_sent += len(data)
+                metrics.last_line = number
+                unflushed += 1
+                if unflushed >= self.buffer_lines:
+                    await writer.drain()
+                    # drain only waits when the transport is backed up, but the listener has to get to see an XOFF
+                    await asyncio.sleep(0)
+                    unflushed = 0
+            await writer.drain()
+            # every line has to be taken before the feed is done
+            for _ in range(self.buffer_lines if ack else 0):
+                await self._until(self._window.acquire())
+        finally:
+            if self._listener.done() and not self._listener.cancelled():
+                # the error already surfaced through _until, or the feed was done before it mattered
+                self._listener.exception()
+            self._listener.cancel()
+            metrics.seconds += perf_counter() - start
+            if self._paused_at is not None:
+                metrics.paused_seconds += perf_counter() - self._paused_at
+                self._paused_at = None
+        return metrics
+
+    async def _until(self, awaitable: t.Awaitable[t.Any]) -> None:
+        """Wait for `awaitable`, unless the listener stops first (on a controller error or disconnect)"""
+        listener = t.cast(asyncio.Task, self._listener)
+        waiter = asyncio.ensure_future(awaitable)
+        await asyncio.wait([waiter, listener], return_when=asyncio.FIRST_COMPLETED)
+        if not waiter.done():
+            waiter.cancel()
+            listener.result()
+            raise ConnectionError("the controller closed the connection")
+
+    async def _listen(self) -> None:
+        if self.flow == FlowControl.ACK:
+            await self._listen_for_acks()
+        else:
+            await self._listen_for_xon_xoff()
+
+    async def _listen_for_acks(self) -> None:
+        metrics = self.metrics
+        while answer := await self.reader.readline():
+            answer = answer.strip()
+            if not answer:
+                continue
+            if answer != self.ack:
+                raise RuntimeError(f"the controller answered {answer.decode(self.encoding, 'replace')!r}")
+            if self._sent_at:
+                latency = perf_counter() - self._sent_at.popleft()
+                metrics.acks += 1
+                metrics.ack_latency_total += latency
+                metrics.ack_latency_max = max(metrics.ack_latency_max, latency)
+            self._window.release()
+
+    async def _listen_for_xon_xoff(self) -> None:
+        while data := await self.reader.read(256):
+            for byte in data:
+                if byte == XOFF and self._resume.is_set():
+                    self._resume.clear()
+                    self._paused_at = perf_counter()
+                elif byte == XON and not self._resume.is_set():
+                    self._resume.set()
+                    if self._paused_at is not None:
+                        self.metrics.paused_seconds += perf_counter() - self._paused_at
+                        self._paused_at = None
+
+
+async def drip_feed(
+    program: ProgramBuilder | t.Iterable[str],
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    start_line: int = 1,
+    with_line_numbers: bool = False,
+    **options: t.Any,
+) -> FeedMetrics:
+    """Feed `program` through a DripFeeder made with `options`, over e.g. `asyncio.open_connection` or `open_serial`"""
+    feeder = DripFeeder(reader, writer, **options)
+    return await feeder.feed(program, start_line=start_line, with_line_numbers=with_line_numbers)
@@ -0,0 +1,351 @@
+import typing as t
+from enum import IntEnum
+
+import numpy as np
+from pydantic import BaseModel
+
+from mach30.enums import Units
+
+from .builder import ProgramBuilder
+from .store import TYPE_INDEX, CodeStore
+
+MM_PER_INCH = 25.4
+_AXES = ("X", "Y", "Z")
+# (first axis, second axis, normal axis) and the center offset letters of each arc plane, ordered so that a positive
+# sweep from the first axis to the second one is counterclockwise
+_PLANES = {17: ((0, 1, 2), ("I", "J")), 18: ((2, 0, 1), ("K", "I")), 19: ((1, 2, 0), ("J", "K"))}
+_CANNED_CYCLES = (81, 82, 83, 84)
+
+
+class SegmentKind(IntEnum):
+    NONE = 0
+    RAPID = 1
+    LINEAR = 2
+    ARC = 3
+    CANNED_CYCLE = 4
+    DWELL = 5
+    TOOL_CHANGE = 6
+
+
+class MachineSettings(BaseModel):
+    """Machine parameters for cycle time estimates. Lengths are in `units`, times in seconds.
+
+    The defaults are roughly a Haas VF-2.
+    """
+
+    units: Units = Units.INCHES
+    # units per minute
+    rapid_rate: float = 1000.0
+    # units per second squared, or None to reach every feedrate instantly
+    acceleration: float | None = None
+    tool_change_time: float = 2.8
+    # position of the active work offset in machine coordinates, for G53 and G28 moves
+    work_offset: dict[str, float] = {}
+
+
+class Segments(t.NamedTuple):
+    """Per-block results, one entry per block of the program"""
+
+    kind: np.ndarray
+    rapid_length: np.ndarray
+    feed_length: np.ndarray
+    time: np.ndarray
+    tool: np.ndarray
+    # whether the block changes tools (M06), which it can do along with a move or a dwell
+    tool_change: np.ndarray
+
+
+class Totals(BaseModel):
+    time: float = 0.0
+    rapid_length: float = 0.0
+    feed_length: float = 0.0
+
+
+class OperationTotals(Totals):
+    """Totals for the blocks between two tool changes"""
+
+    tool: int
+    first_block: int
+
+
+class CycleEstimate(Totals):
+    rapid_time: float = 0.0
+    feed_time: float = 0.0
+    dwell_time: float = 0.0
+    tool_change_time: float = 0.0
+    by_tool: dict[int, Totals] = {}
+    by_operation: list[OperationTotals] = []
+
+
+def ffill(values: np.ndarray, valid: np.ndarray, initial: float) -> np.ndarray:
+    """Carry the last valid value forward, starting from `initial`"""
+    last = np.where(valid, np.arange(len(values)), -1)
+    np.maximum.accumulate(last, out=last)
+    return np.where(last >= 0, values[last], initial)
+
+
+def _move_time(length: np.ndarray, rate: np.ndarray, acceleration: float | None) -> np.ndarray:
+    """Time to cover `length` at `rate` (units per minute), starting and ending at rest"""
+    velocity = rate / 60
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if not acceleration:
+            cruise = length / velocity
+            return np.where(length > 0, cruise, 0.0)
+        # trapezoidal profile, or triangular when the segment is too short to reach the feedrate
+        trapezoid = length / velocity + velocity / acceleration
+        triangle = 2 * np.sqrt(length / acceleration)
+        return np.where(length > 0, np.where(length * acceleration >= velocity**2, trapezoid, triangle), 0.0)
+
+
+class ProgramColumns:
+    """Per-block views of a program's words, for passes over a whole program at once like the estimate's"""
+
+    def __init__(self, store: CodeStore) -> None:
+        types, numbers, is_int, offsets = store.columns
+        # copies, since a live view of the store's arrays would stop it from growing
+        self.types = np.array(types, dtype=np.uint8)
+        self.numbers = np.array(numbers, dtype=np.float64)
+        self.is_int = np.array(is_int, dtype=bool)
+        self.n = len(offsets) - 1
+        counts: np.ndarray = np.diff(np.array(offsets, dtype=np.int64))
+        self.block = np.repeat(np.arange(self.n), counts)
+        self._values: dict[str, np.ndarray] = {}
+        g_words = (self.types == TYPE_INDEX["G"]) & self.is_int
+        self._g_blocks, self._g_numbers = self.block[g_words], self.numbers[g_words]
+
+    def values(self, letter: str) -> np.ndarray:
+        """The number of each block's `letter` word, NaN where it has none"""
+        if letter not in self._values:
+            values = np.full(self.n, np.nan)
+            mask = self.types == TYPE_INDEX[letter]
+            values[self.block[mask]] = self.numbers[mask]
+            self._values[letter] = values
+        return self._values[letter]
+
+    def any_of(self, letters: str) -> np.ndarray:
+        """Blocks with a word of any of `letters`"""
+        found = np.zeros(self.n, dtype=bool)
+        found[self.block[np.isin(self.types, [TYPE_INDEX[letter] for letter in letters])]] = True
+        return found
+
+    def has(self, letter: str, numbers: t.Iterable[int]) -> np.ndarray:
+        if letter == "G":
+            blocks = self._g_blocks[np.isin(self._g_numbers, list(numbers))]
+        else:
+            mask = (self.types == TYPE_INDEX[letter]) & self.is_int & np.isin(self.numbers, list(numbers))
+            blocks = self.block[mask]
+        found = np.zeros(self.n, dtype=bool)
+        found[blocks] = True
+        return found
+
+    def mode(self, numbers: t.Iterable[int], initial: int, cancels: t.Iterable[int] = ()) -> np.ndarray:
+        """The modal G code of one group in effect for each block; `cancels` reset the group to 0"""
+        events = np.full(self.n, -1.0)
+        for codes, value in ((list(numbers), None), (list(cancels), 0.0)):
+            hit = np.isin(self._g_numbers, codes)
+            events[self._g_blocks[hit]] = self._g_numbers[hit] if value is None else value
+        return ffill(events, events >= 0, initial).astype(np.int64)
+
+
+def _arc_lengths(
+    program: ProgramColumns,
+    arcs: np.ndarray,
+    clockwise: np.ndarray,
+    plane: np.ndarray,
+    start: np.ndarray,
+    end: np.ndarray,
+    scale: np.ndarray,
+) -> np.ndarray:
+    lengths = np.zeros(program.n)
+    if not arcs.any():
+        return lengths
+    radius = program.values("R") * scale
+    offsets = {letter: np.nan_to_num(program.values(letter)) * scale for letter in "IJK"}
+    for number, ((u, v, normal), (i, j)) in _PLANES.items():
+        rows = arcs & (plane == number)
+        if not rows.any():
+            continue
+        u0, v0, u1, v1 = start[u, rows], start[v, rows], end[u, rows], end[v, rows]
+        r = radius[rows]
+        by_radius = ~np.isnan(r)
+        # R form: the chord fixes the sweep, and a negative R picks the long way around
+        half_chord = np.clip(np.hypot(u1 - u0, v1 - v0) / (2 * np.abs(np.where(by_radius, r, 1.0))), 0, 1)
+        sweep_r = 2 * np.arcsin(half_chord)
+        sweep_r = np.where(r < 0, 2 * np.pi - sweep_r, sweep_r)
+        # IJK form: the center is relative to the start point, and a zero sweep is a full circle
+        cu, cv = u0 + offsets[i][rows], v0 + offsets[j][rows]
+        angle0, angle1 = np.arctan2(v0 - cv, u0 - cu), np.arctan2(v1 - cv, u1 - cu)
+        sweep_c = np.where(clockwise[rows], angle0 - angle1, angle1 - angle0) % (2 * np.pi)
+        sweep_c = np.where(np.isclose(sweep_c, 0) | np.isclose(sweep_c, 2 * np.pi), 2 * np.pi, sweep_c)
+        planar = np.where(by_radius, np.abs(np.nan_to_num(r)) * sweep_r, np.hypot(u0 - cu, v0 - cv) * sweep_c)
+        lengths[rows] = np.hypot(planar, end[normal, rows] - start[normal, rows])
+    return lengths
+
+
+def simulate(program: ProgramBuilder | CodeStore, machine: MachineSettings | None = None) -> Segments:
+    """Walk the program's blocks and work out how far and how long each of them moves.
+
+    Arcs are measured from either R or IJK words (helical arcs included) and feed moves take the modal F in units
+    per minute. Canned cycles (G81-G84) drill at the current position and at every XY move until G80, from the
+    initial Z down to R at the rapid rate, to Z at the feedrate and back to the initial Z (G98) or R (G99). Rotary axes,
+    G95 feed per revolution and spindle ramp-up are not modelled.
+    """
+    machine = machine or MachineSettings()
+    store = program.codes if isinstance(program, ProgramBuilder) else program
+    p = ProgramColumns(store)
+    n = p.n
+    kind = np.zeros(n, dtype=np.uint8)
+
+    units = p.mode((20, 21), machine.units.value)
+    to_machine_units = 1.0 if machine.units == Units.INCHES else MM_PER_INCH
+    scale = np.where(units == Units.INCHES.value, 1.0, 1 / MM_PER_INCH) * to_machine_units
+    incremental = p.mode((90, 91), 90) == 91
+    motion = p.mode((0, 1, 2, 3), 0)
+    plane = p.mode((17, 18, 19), 17)
+    canned = p.mode(_CANNED_CYCLES, 0, cancels=(0, 1, 2, 3, 80))
+    in_cycle = canned > 0
+    machine_coords = p.has("G", (53,))
+    home = p.has("G", (28,))
+
+    # Absolute words (and machine coordinates) anchor an axis; incremental words between anchors add up
+    start_point = np.empty((3, n))
+    end_point = np.empty((3, n))
+    specified = np.zeros(n, dtype=bool)
+    for axis, letter in enumerate(_AXES):
+        values = p.values(letter) * scale
+        given = ~np.isnan(values)
+        if letter == "Z":
+            # inside a canned cycle Z is the bottom of the hole, and the tool goes back up after every hole
+            given &= ~in_cycle
+        offset = machine.work_offset.get(letter, 0.0) * to_machine_units
+        values = np.where(machine_coords, values - offset, values)
+        values = np.where(home & given, -offset, values)
+        anchors = given & (~incremental | machine_coords | home)
+        deltas = np.cumsum(np.where(given & ~anchors, values, 0.0))
+        base = ffill(values - deltas, anchors, -offset)
+        end_point[axis] = base + deltas
+        start_point[axis, 0] = -offset
+        start_point[axis, 1:] = end_point[axis, :-1]
+        specified |= given
+
+    feedrate = ffill(p.values("F") * scale, ~np.isnan(p.values("F")), np.nan)
+    rapid_length = np.zeros(n)
+    feed_length = np.zeros(n)
+    time = np.zeros(n)
+
+    travel = np.linalg.norm(end_point - start_point, axis=0)
+    # an arc needs its R or center in the block; without one the move is treated as a straight feed
+    has_center = p.any_of("RIJK")
+    arcs = ~in_cycle & np.isin(motion, (2, 3)) & has_center
+    arc_lengths = _arc_lengths(p, arcs, motion == 2, plane, start_point, end_point, scale)
+    rapids = ~in_cycle & specified & ((motion == 0) | machine_coords | home)
+    feeds = ~in_cycle & ~rapids & (specified | arcs)
+    if np.isnan(feedrate[feeds]).any():
+        raise ValueError(f"feed move without a feedrate in block {int(np.argmax(feeds & np.isnan(feedrate)))}")
+
+    rapid_length[rapids] = travel[rapids]
+    feed_length[feeds] = np.where(arcs, arc_lengths, travel)[feeds]
+    kind[rapids] = SegmentKind.RAPID
+    kind[feeds & ~arcs] = SegmentKind.LINEAR
+    kind[arcs] = SegmentKind.ARC
+    rapid_rate = np.full(n, machine.rapid_rate)
+    time += _move_time(rapid_length, rapid_rate, machine.acceleration)
+    time += _move_time(feed_length, feedrate, machine.acceleration)
+
+    # Canned cycles: every hole is a rapid over to it followed by the cycle itself
+    holes = in_cycle & (specified | p.has("G", _CANNED_CYCLES))
+    if holes.any():
+        in_this_cycle = in_cycle & ~np.isnan(p.values("R"))
+        r_level = ffill(p.values("R") * scale, in_this_cycle, np.nan)[holes]
+        bottom = ffill(p.values("Z") * scale, in_cycle & ~np.isnan(p.values("Z")), np.nan)[holes]
+        peck = ffill(p.values("Q") * scale, in_cycle & ~np.isnan(p.values("Q")), np.nan)[holes]
+        dwell = np.nan_to_num(ffill(p.values("P"), in_cycle & ~np.isnan(p.values("P")), 0.0)[holes])
+        to_r = p.mode((98, 99), 98)[holes] == 99
+        cycle, initial, hole_feed = canned[holes], end_point[2, holes], feedrate[holes]
+        if np.isnan(r_level).any() or np.isnan(bottom).any() or np.isnan(hole_feed).any():
+            raise ValueError("canned cycle without an R, Z or feedrate")
+
+        over = travel[holes]
+        down = np.maximum(initial - r_level, 0)
+        depth = np.maximum(r_level - bottom, 0)
+        tapping = cycle == 84
+        # G83 goes back up to R after every peck and rapids back down to where the last one stopped
+        pecks = np.where((cycle == 83) & (peck > 0), np.ceil(depth / np.where(peck > 0, peck, 1)), 1)
+        peck_travel = np.where(pecks > 1, peck * pecks * (pecks - 1), 0)
+        retract = np.where(tapping, 0, depth) + np.where(to_r, 0, down)
+        # in each hole, every rapid and feed starts and ends at rest
+        hole_time = (
+            _move_time(over, rapid_rate[holes], machine.acceleration)
+            + _move_time(down, rapid_rate[holes], machine.acceleration)
+            + _move_time(depth, hole_feed, machine.acceleration) * np.where(tapping, 2, 1) * np.maximum(pecks, 1)
+            + _move_time(retract, rapid_rate[holes], machine.acceleration)
+            + _move_time(peck_travel, rapid_rate[holes], machine.acceleration)
+            + np.where(cycle == 82, dwell, 0)
+        )
+        rapid_length[holes] = over + down + retract + peck_travel
+        feed_length[holes] = depth * np.where(tapping, 2, 1)
+        time[holes] = hole_time
+        kind[holes] = SegmentKind.CANNED_CYCLE
+
+    # G04 P is in seconds, or milliseconds when it is written without a decimal point
+    dwells = p.has("G", (4,))
+    if dwells.any():
+        dwell_p = p.values("P")[dwells]
+        millis = np.zeros(n, dtype=bool)
+        p_words = p.types == TYPE_INDEX["P"]
+        millis[p.block[p_words & p.is_int]] = True
+        time[dwells] += np.nan_to_num(np.where(millis[dwells], dwell_p / 1000, dwell_p))
+        kind[dwells & (kind == SegmentKind.NONE)] = SegmentKind.DWELL
+
+    tool_changes = p.has("M", (6,))
+    time[tool_changes] += machine.tool_change_time
+    kind[tool_changes & (kind == SegmentKind.NONE)] = SegmentKind.TOOL_CHANGE
+    tools = p.values("T")
+    tool = ffill(tools, ~np.isnan(tools), 0).astype(np.int64)
+
+    return Segments(kind, rapid_length, feed_length, time, tool, tool_changes)
+
+
+def _breakdown(segments: Segments, keys: np.ndarray, count: int) -> list[Totals]:
+    sums = [
+        np.bincount(keys, weights=column, minlength=count)
+        for column in (segments.time, segments.rapid_length, segments.feed_length)
+    ]
+    return [Totals(time=sums[0][i], rapid_length=sums[1][i], feed_length=sums[2][i]) for i in range(count)]
+
+
+def estimate(program: ProgramBuilder | CodeStore, machine: MachineSettings | None = None) -> CycleEstimate:
+    """Cycle time and travel of a whole program, with a breakdown by tool and by operation.
+
+    An operation runs from one tool change (M06) to the next; anything before the first one is tool 0.
+    """
+    machine = machine or MachineSettings()
+    segments = simulate(program, machine)
+    kind, time = segments.kind, segments.time
+    # a block that changes tools as well as moving or dwelling counts the change apart from the rest
+    change_time = np.where(segments.tool_change, machine.tool_change_time, 0.0)
+    motion_time = time - change_time
+    feeding = (kind == SegmentKind.LINEAR) | (kind == SegmentKind.ARC)
+
+    tools, tool_keys = np.unique(segments.tool, return_inverse=True)
+    by_tool = _breakdown(segments, tool_keys, len(tools))
+    operation_keys = np.cumsum(segments.tool_change)
+    operations = int(operation_keys[-1]) + 1 if len(kind) else 0
+    firsts = np.searchsorted(operation_keys, np.arange(operations))
+    by_operation = [
+        OperationTotals(tool=int(segments.tool[first]), first_block=int(first), **totals.model_dump())
+        for first, totals in zip(firsts, _breakdown(segments, operation_keys, operations))
+        if totals.time or totals.rapid_length or totals.feed_length
+    ]
+
+    return CycleEstimate(
+        time=float(time.sum()),
+        rapid_length=float(segments.rapid_length.sum()),
+        feed_length=float(segments.feed_length.sum()),
+        rapid_time=float(motion_time[kind == SegmentKind.RAPID].sum()),
+        feed_time=float(motion_time[feeding].sum()),
+        dwell_time=float(motion_time[kind == SegmentKind.DWELL].sum()),
+        tool_change_time=float(change_time.sum()),
+        by_tool={int(tool): totals for tool, totals in zip(tools, by_tool)},
+        by_operation=by_operation,
+    )
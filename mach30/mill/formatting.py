@@ -0,0 +1,129 @@
+import math
+import typing as t
+
+from pydantic import BaseModel, ConfigDict
+
+from mach30.enums import Units
+
+if t.TYPE_CHECKING:
+    import numpy as np
+    from numpy.typing import ArrayLike
+
+# numpy is imported by the functions that use it rather than here, as it takes longer to import than the whole package
+# and a program that's only built and written never needs it
+
+# fractional parts are looked up in a table of every step below one for up to this many decimals
+_TABLE_DECIMALS = 5
+_MAX_DECIMALS = 9
+_POWERS = [10.0**decimals for decimals in range(_MAX_DECIMALS + 1)]
+# past this the scaled value is no longer an exact integer in a float
+_MAX_SCALED = 2.0**53
+
+_FRACTIONS: dict[tuple[int, bool], list[str]] = {}
+
+
+class Precision(BaseModel):
+    """Decimals numbers are rounded to, with overrides for single letters (e.g. {"F": 1, "S": 0})"""
+
+    model_config = ConfigDict(frozen=True, defer_build=True)
+
+    decimals: int
+    letters: dict[str, int] = {}
+
+    def for_letter(self, letter: str) -> int:
+        return self.letters.get(letter, self.decimals)
+
+
+class NumberFormat(BaseModel):
+    """How floats are written out: rounded to a fixed number of decimals picked by the active units and the letter.
+
+    `units` are the ones in effect until the program selects some with G20 or G21. Trailing zeros are dropped down to
+    a single one (`X1.0`, `X0.875`) unless `trailing_zeros` is set (`X1.0000`).
+    """
+
+    model_config = ConfigDict(frozen=True, defer_build=True)
+
+    inches: Precision = Precision.model_construct(decimals=4)
+    millimeters: Precision = Precision.model_construct(decimals=3)
+    units: Units = Units.INCHES
+    trailing_zeros: bool = False
+
+    def precision(self, units: Units) -> Precision:
+        return self.inches if units == Units.INCHES else self.millimeters
+
+    def decimals(self, units: Units, letter: str) -> int:
+        return self.precision(units).for_letter(letter)
+
+    def decimals_table(self, letters: t.Sequence[str]) -> "np.ndarray":
+        """Decimals for every letter (columns), in inches (row 0) and millimeters (row 1)"""
+        import numpy as np
+
+        return np.array([[self.decimals(units, letter) for letter in letters] for units in Units], dtype=np.int64)
+
+
+# made without validating, so neither model is built (which pydantic would do on the first validation) until a
+# format is given explicitly
+DEFAULT_FORMAT = NumberFormat.model_construct()
+
+
+def _fractions(decimals: int, trailing_zeros: bool) -> list[str]:
+    """Text for the fractional part of every multiple of 10**-decimals below one, e.g. ".875" for 8750 at 4 decimals"""
+    key = (decimals, trailing_zeros)
+    if (table := _FRACTIONS.get(key)) is None:
+        table = _FRACTIONS[key] = [_fraction(step, decimals, trailing_zeros) for step in range(10**decimals)]
+    return table
+
+
+def _fraction(step: int, decimals: int, trailing_zeros: bool) -> str:
+    if not decimals:
+        return "." if trailing_zeros else ".0"
+    digits = f"{step:0{decimals}}"
+    return "." + (digits if trailing_zeros else digits.rstrip("0") or "0")
+
+
+def format_number(value: float, decimals: int, trailing_zeros: bool = False) -> str:
+    """A single number rounded to `decimals` places; `format_numbers` is much quicker for many of them"""
+    scaled = round(value * 10**decimals) if math.isfinite(value) else None
+    if scaled is None or abs(scaled) >= _MAX_SCALED:
+        return f"{value:.{decimals}f}"
+    whole, step = divmod(abs(scaled), 10**decimals)
+    return f"{'-' if scaled < 0 else ''}{whole}{_fraction(step, decimals, trailing_zeros)}"
+
+
+def format_numbers(values: "ArrayLike", decimals: "ArrayLike", trailing_zeros: bool = False) -> list[str]:
+    """Text for a whole array of numbers, each rounded to its own (or one shared) number of decimals.
+
+    The rounding and the split into whole and fractional parts are done on the arrays; the fractional part's text
+    comes from a lookup table, so the only per-number work left is joining two strings.
+    """
+    import numpy as np
+
+    numbers = np.asarray(values, dtype=np.float64)
+    places = np.broadcast_to(np.asarray(decimals, dtype=np.int64), numbers.shape)
+    assert not len(places) or 0 <= places.min() <= places.max() <= _MAX_DECIMALS, "unsupported number of decimals"
+    scale = np.array(_POWERS)[places]
+    scaled = np.rint(numbers * scale)
+    # -0.0 rounds to a negative zero, which shouldn't get a sign
+    negative = (scaled < 0).tolist()
+    magnitude = np.abs(scaled)
+    # NaN, inf and numbers too big to split exactly are formatted one at a time
+    odd = ~(magnitude < _MAX_SCALED)
+    if odd.any():
+        magnitude[odd] = 0
+    whole, steps = np.divmod(magnitude, scale)
+    places_list = places.tolist()
+    if len(places) and places.max() <= _TABLE_DECIMALS:
+        used = set(places_list)
+        tables = [_fractions(d, trailing_zeros) if d in used else [] for d in range(_TABLE_DECIMALS + 1)]
+        fractions = [tables[d][step] for d, step in zip(places_list, steps.astype(np.int64).tolist())]
+    else:
+        fractions = [
+            _fraction(step, d, trailing_zeros) for d, step in zip(places_list, steps.astype(np.int64).tolist())
+        ]
+    texts = [
+        f"-{whole}{fraction}" if neg else f"{whole}{fraction}"
+        for neg, whole, fraction in zip(negative, whole.astype(np.int64).tolist(), fractions)
+    ]
+    for i in np.flatnonzero(odd).tolist():
+        texts[i] = format_number(float(numbers[i]), places_list[i], trailing_zeros)
+    return texts
@@ -13,12 +13,18 @@ from .gcode_basic import SpotDrillCycle as _SpotDrillCycle
 from .gcode_basic import TapCycle as _TapCycle
 from .helpers import combine_codes, kwargs_to_codes
 from .modal_code import ModalCode
-from .models import Code, GCode, GGroups
+from .models import Code, GCode, GGroups, freeze
+
+if t.TYPE_CHECKING:
+    from numpy.typing import ArrayLike
+
+    from .holes import HoleOrder
 
 
 class CannedCycle(ModalCode):
     group: GGroups = GGroups.CANNED_CYCLE
-    cancel: t.ClassVar[GCode] = _CancelCannedCycle(comment="cancel canned cycle")
+    # the codes below are made without validating, which would build their classes on import
+    cancel: t.ClassVar[GCode] = freeze(_CancelCannedCycle.model_construct(comment="cancel canned cycle"))
     exit_code: GCode = cancel
 
     def move(
@@ -34,6 +40,34 @@ class CannedCycle(ModalCode):
         if maybe_code := combine_codes(codes):
             self.builder.add(maybe_code)
 
+    def move_many(self, points: "ArrayLike", optimize: bool = False, start: "ArrayLike | None" = None) -> "HoleOrder":
+        """Drill at every (x, y) or (x, y, z) point, given as an (N, 2) or (N, 3) array.
+
+        With `optimize` the holes are reordered to cut down rapid travel, starting from `start`, which defaults to the
+        builder's current XY position when it's known. The returned report has the order the holes were drilled in
+        and the travel before and after reordering.
+        """
+        # imported here as numpy takes longer to import than the rest of the package, and few programs drill holes
+        import numpy as np
+
+        from .holes import HoleOrder, order_holes, path_length
+
+        holes = np.asarray(points, dtype=np.float64)
+        if not holes.size:
+            return HoleOrder(order=[], travel_before=0.0, travel_after=0.0)
+        if holes.ndim != 2 or holes.shape[1] not in (2, 3):
+            raise ValueError(f"points must be an (N, 2) or (N, 3) array, not one of shape {holes.shape}")
+        position = self.builder.modal.position
+        if start is None and "X" in position and "Y" in position:
+            start = (position["X"], position["Y"])
+        if optimize:
+            report = order_holes(holes, start=start)
+        else:
+            travel = path_length(holes, None if start is None else np.asarray(start, dtype=np.float64))
+            report = HoleOrder(order=list(range(len(holes))), travel_before=travel, travel_after=travel)
+        self.builder._add_columns(list("XYZ"[: holes.shape[1]]), holes[report.order].T)
+        return report
+
     def goto_initial_z(self) -> None:
         self.builder.add(CannedCycleInitialPointReturn(comment="return to initial point"))
 
@@ -43,7 +77,7 @@ class CannedCycle(ModalCode):
 
 class DrillCycle(CannedCycle):
     group: GGroups = GGroups.CANNED_CYCLE
-    enter_code: GCode = _DrillCycle(comment="begin drilling cycle")
+    enter_code: GCode = _DrillCycle.model_construct(comment="begin drilling cycle")
 
     def __init__(self, f: maybe_float, z: maybe_float, r: maybe_float | None = None, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -55,7 +89,7 @@ class DrillCycle(CannedCycle):
 
 class SpotDrillCycle(CannedCycle):
     group: GGroups = GGroups.CANNED_CYCLE
-    enter_code: GCode = _SpotDrillCycle(comment="begin spot drilling cycle")
+    enter_code: GCode = _SpotDrillCycle.model_construct(comment="begin spot drilling cycle")
 
     def __init__(
         self,
@@ -77,7 +111,7 @@ class SpotDrillCycle(CannedCycle):
 
 class PeckDrillCycle(CannedCycle):
     group: GGroups = GGroups.CANNED_CYCLE
-    enter_code: GCode = _PeckDrillCycle(comment="begin peck drilling cycle")
+    enter_code: GCode = _PeckDrillCycle.model_construct(comment="begin peck drilling cycle")
 
     def __init__(
         self,
@@ -109,7 +143,7 @@ class PeckDrillCycle(CannedCycle):
 
 class TapCycle(CannedCycle):
     group: GGroups = GGroups.CANNED_CYCLE
-    enter_code: GCode = _TapCycle(comment="begin tapping cycle")
+    enter_code: GCode = _TapCycle.model_construct(comment="begin tapping cycle")
 
     def __init__(
         self,
@@ -137,7 +171,7 @@ class TapCycle(CannedCycle):
 
 class SetCutterCompensation(ModalCode):
     group: GGroups = GGroups.CUTTER_COMPENSATION
-    cancel: t.ClassVar[GCode] = _CancelCutterComp(comment="cancel cutter compensation")
+    cancel: t.ClassVar[GCode] = freeze(_CancelCutterComp.model_construct(comment="cancel cutter compensation"))
     exit_code: GCode = cancel
 
     def __init__(self, direction: CutterCompensationDirection, d: maybe_float, *args, **kwargs):
@@ -154,7 +188,7 @@ class SetCutterCompensation(ModalCode):
 
 class SetToolLengthCompensation(ModalCode):
     group: GGroups = GGroups.TOOL_LENGTH_OFFSET
-    cancel: t.ClassVar[GCode] = _CancelToolLengthComp(comment="cancel tool length compensation")
+    cancel: t.ClassVar[GCode] = freeze(_CancelToolLengthComp.model_construct(comment="cancel tool length compensation"))
     exit_code: GCode = cancel
 
     def __init__(self, direction: ToolLengthCompensation, h: int, *args, **kwargs):
@@ -0,0 +1,156 @@
+import math
+
+import numpy as np
+from numpy.typing import ArrayLike
+from pydantic import BaseModel
+
+# how many nearby holes are considered when building and improving a tour
+_NEIGHBORS = 10
+
+
+class HoleOrder(BaseModel):
+    """The order holes were visited in (as indices into the points given), and the rapid travel between them"""
+
+    order: list[int]
+    travel_before: float
+    travel_after: float
+
+
+def path_length(points: np.ndarray, start: np.ndarray | None = None) -> float:
+    """XY travel through `points` in order, from `start` if there is one"""
+    xy = points[:, :2]
+    if start is not None:
+        xy = np.vstack([start[:2], xy])
+    return float(np.hypot(*np.diff(xy, axis=0).T).sum())
+
+
+def _neighbors(xy: np.ndarray, k: int) -> np.ndarray:
+    """Close to the k nearest other points of every point, nearest first.
+
+    Points are bucketed into a grid with a couple of points per cell and only the surrounding cells are searched,
+    widening the search for points in sparse areas.
+    """
+    n = len(xy)
+    k = min(k, n - 1)
+    low = xy.min(axis=0)
+    size = max(float(np.ptp(xy, axis=0).max()), 1e-9) / max(np.sqrt(n / 2), 1)
+    cells = np.floor((xy - low) / size).astype(np.int64)
+    width = int(cells[:, 1].max()) + 1
+    keys = cells[:, 0] * width + cells[:, 1]
+    by_cell = np.argsort(keys, kind="stable")
+    sorted_keys = keys[by_cell]
+
+    neighbors = np.empty((n, k), dtype=np.int64)
+    for point in range(n):
+        cx, cy = cells[point]
+        ring = 1
+        while True:
+            rows = np.arange(cx - ring, cx + ring + 1)
+            starts = np.searchsorted(sorted_keys, rows * width + max(cy - ring, 0))
+            ends = np.searchsorted(sorted_keys, rows * width + min(cy + ring, width - 1), side="right")
+            candidates = np.concatenate([by_cell[lo:hi] for lo, hi in zip(starts, ends)])
+            candidates = candidates[candidates != point]
+            if len(candidates) >= k or len(candidates) == n - 1:
+                break
+            ring *= 2
+        distances = np.hypot(*(xy[candidates] - xy[point]).T)
+        nearest = np.argpartition(distances, k - 1)[:k] if len(candidates) > k else np.arange(len(candidates))
+        neighbors[point] = candidates[nearest[np.argsort(distances[nearest])]]
+    return neighbors
+
+
+def _nearest_neighbor_tour(xy: np.ndarray, neighbors: np.ndarray, first: int) -> np.ndarray:
+    visited = np.zeros(len(xy), dtype=bool)
+    tour = np.empty(len(xy), dtype=np.int64)
+    current = first
+    for step in range(len(xy)):
+        tour[step] = current
+        visited[current] = True
+        if step == len(xy) - 1:
+            break
+        candidates = neighbors[current][~visited[neighbors[current]]]
+        if len(candidates):
+            current = int(candidates[0])
+        else:
+            # every close hole is done already, so fall back to scanning all of the ones left
+            remaining = np.flatnonzero(~visited)
+            distances = np.hypot(*(xy[remaining] - xy[current]).T)
+            current = int(remaining[np.argmin(distances)])
+    return tour
+
+
+def _two_opt(xy: np.ndarray, neighbors: np.ndarray, tour: np.ndarray, max_passes: int) -> np.ndarray:
+    """Improve an open tour with 2-opt moves between neighboring points; the first point stays first"""
+    n = len(tour)
+    position = np.empty(n, dtype=np.int64)
+    position[tour] = np.arange(n)
+
+    xs, ys = xy[:, 0].tolist(), xy[:, 1].tolist()
+
+    def distance(a: int, b: int) -> float:
+        return math.hypot(xs[a] - xs[b], ys[a] - ys[b])
+
+    for _ in range(max_passes):
+        improved = False
+        for a in range(n):
+            i = int(position[a])
+            if i == n - 1:
+                continue
+            b = int(tour[i + 1])
+            ab = distance(a, b)
+            for c in neighbors[a]:
+                c = int(c)
+                ac = distance(a, c)
+                if ac >= ab:
+                    break
+                j = int(position[c])
+                if j > i + 1:
+                    # a b ... c d -> a c ... b d
+                    d = int(tour[j + 1]) if j + 1 < n else -1
+                    cd = distance(c, d) if d >= 0 else 0.0
+                    bd = distance(b, d) if d >= 0 else 0.0
+                    lo, hi = i + 1, j
+                    delta = ac + bd - ab - cd
+                elif j < i:
+                    # ... c e ... a b -> ... c a ... e b
+                    e = int(tour[j + 1])
+                    delta = ac + distance(e, b) - distance(c, e) - ab
+                    lo, hi = j + 1, i
+                else:
+                    continue
+                if delta < -1e-12:
+                    tour[lo : hi + 1] = tour[lo : hi + 1][::-1].copy()
+                    position[tour[lo : hi + 1]] = np.arange(lo, hi + 1)
+                    improved = True
+                    break
+        if not improved:
+            break
+    return tour
+
+
+def order_holes(points: ArrayLike, start: ArrayLike | None = None, max_passes: int = 50) -> HoleOrder:
+    """Reorder hole positions to cut down the rapid travel between them.
+
+    Builds a nearest-neighbor tour and improves it with 2-opt moves, both limited to each hole's closest neighbors so
+    that thousands of holes only take a few seconds. The tour starts at `start` (e.g. the current position) when it's
+    given, and otherwise at the first point.
+    """
+    holes = np.asarray(points, dtype=np.float64)
+    assert holes.ndim == 2 and holes.shape[1] >= 2, "points must be a sequence of (x, y) or (x, y, z) positions"
+    origin = None if start is None else np.asarray(start, dtype=np.float64)
+    before = path_length(holes, origin)
+    if len(holes) < 3:
+        order = np.arange(len(holes))
+        if origin is not None and len(holes) == 2:
+            order = np.argsort(np.hypot(*(holes[:, :2] - origin[:2]).T), kind="stable")
+        return HoleOrder(order=order.tolist(), travel_before=before, travel_after=path_length(holes[order], origin))
+
+    # the start is pinned by making it point 0 of the tour
+    xy = holes[:, :2] if origin is None else np.vstack([origin[:2], holes[:, :2]])
+    neighbors = _neighbors(xy, _NEIGHBORS)
+    tour = _two_opt(xy, neighbors, _nearest_neighbor_tour(xy, neighbors, 0), max_passes)
+    order = tour if origin is None else tour[1:] - 1
+    after = path_length(holes[order], origin)
+    if after > before:
+        order, after = np.arange(len(holes)), before
+    return HoleOrder(order=order.tolist(), travel_before=before, travel_after=after)
@@ -0,0 +1,59 @@
+import typing as t
+from collections import Counter
+from pathlib import Path
+from time import perf_counter_ns
+
+
+class Stats:
+    """Counters and timers collected while a ProgramBuilder is instrumented.
+
+    `words` counts the words added by code type and `groups` counts modal codes by their group. `calls` counts the
+    calls of each timed method and `nanoseconds` holds how long they ran in total. Timers nest, so the time of `move`
+    includes the `add` it calls.
+    """
+
+    def __init__(self) -> None:
+        self.words: t.Counter[str] = Counter()
+        self.groups: t.Counter[str] = Counter()
+        # plain dicts, as they're updated on every timed call and a Counter is several times slower to update
+        self.calls: dict[str, int] = {}
+        self.nanoseconds: dict[str, int] = {}
+
+    def record(self, timer: str, start: int) -> None:
+        """Count a call timed under `timer` that started at `start` (from `perf_counter_ns`) and ends now"""
+        elapsed = perf_counter_ns() - start
+        calls, nanoseconds = self.calls, self.nanoseconds
+        if timer in calls:
+            calls[timer] += 1
+            nanoseconds[timer] += elapsed
+        else:
+            calls[timer] = 1
+            nanoseconds[timer] = elapsed
+
+    def to_dict(self) -> dict[str, t.Any]:
+        timers = {
+            timer: {"calls": calls, "seconds": self.nanoseconds[timer] / 1e9} for timer, calls in self.calls.items()
+        }
+        return {"words": dict(self.words), "groups": dict(self.groups), "timers": timers}
+
+    def to_prometheus(self, prefix: str = "mach30_builder") -> str:
+        """The stats in the Prometheus text exposition format"""
+        lines: list[str] = []
+
+        def metric(name: str, label: str, values: t.Mapping[str, float], help_text: str) -> None:
+            lines.extend([f"# HELP {prefix}_{name} {help_text}", f"# TYPE {prefix}_{name} counter"])
+            lines.extend(f'{prefix}_{name}{{{label}="{key}"}} {value}' for key, value in sorted(values.items()))
+
+        metric("words_total", "code_type", self.words, "Words added, by code type.")
+        metric("modal_codes_total", "group", self.groups, "Modal codes added, by group.")
+        metric("calls_total", "timer", self.calls, "Calls of timed builder methods.")
+        seconds = {timer: self.nanoseconds[timer] / 1e9 for timer in self.calls}
+        metric("seconds_total", "timer", seconds, "Time spent in timed builder methods.")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: Path | str, prefix: str = "mach30_builder") -> None:
+        """Write the stats for a node exporter style textfile collector; the file is replaced in one step"""
+        path = Path(path)
+        partial = path.with_name(path.name + ".tmp")
+        partial.write_text(self.to_prometheus(prefix))
+        partial.replace(path)
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 
 from mach30.enums import GGroups
 
@@ -7,6 +7,9 @@ from .models import Code
 
 
 class ModalCode(BaseModel):
+    # built when first used, like the builder and the codes
+    model_config = ConfigDict(defer_build=True)
+
     enter_code: Code
     exit_code: Code | None = None
     builder: ProgramBuilder
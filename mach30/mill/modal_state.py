@@ -0,0 +1,175 @@
+import copy
+import typing as t
+
+from pydantic import BaseModel, ConfigDict, GetCoreSchemaHandler
+from pydantic_core import core_schema
+
+from mach30.enums import GGroups, SpindleDirection
+
+from .models import G_CODE_GROUPS, Code, GCode, SpindleSettings, Word, freeze, thaw
+
+if t.TYPE_CHECKING:
+    import numpy as np
+
+AXES = frozenset("XYZABC")
+# G codes whose axis words aren't positions in the work coordinates: homing and machine coordinates
+_MACHINE_G = frozenset({28, 53})
+_SPINDLE_M = frozenset(direction.value for direction in SpindleDirection)
+# the (frozen) code that stands for each G code a replayed block sets, made once per number
+_REPLAYED_G: dict[int | float, GCode] = {}
+
+
+class ModalState:
+    """What a program has set so far: the last code of every G code group, the position, feedrate, spindle, coolant
+    and whether moves are in machine coordinates (G53).
+
+    Every update replaces a slot, so the state stays the same size however long the program gets. `position` holds
+    the last programmed position of each axis in the active coordinates, and an axis is dropped once it can't be
+    known from the program (after G28 or G53 moves, or at the bottom of a canned cycle's holes).
+    """
+
+    __slots__ = (
+        "canned",
+        "codes",
+        "coolant",
+        "feedrate",
+        "incremental",
+        "last_group",
+        "machine_coordinates",
+        "position",
+        "spindle",
+    )
+
+    def __init__(self) -> None:
+        self.codes: dict[GGroups, Code | None] = dict.fromkeys(GGroups)
+        # the group of the last modal code, which is what a motion code has to follow to be left out
+        self.last_group: GGroups | None = None
+        self.incremental = False
+        self.canned = False
+        self.position: dict[str, float] = {}
+        self.feedrate: int | float | None = None
+        self.spindle = SpindleSettings(direction=SpindleDirection.OFF, speed=0)
+        self.coolant = False
+        self.machine_coordinates = False
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source: t.Any, handler: GetCoreSchemaHandler) -> core_schema.CoreSchema:
+        return core_schema.no_info_plain_validator_function(
+            cls._validate,
+            serialization=core_schema.plain_serializer_function_ser_schema(
+                cls._to_fields, return_schema=handler.generate_schema(_ModalStateFields)
+            ),
+        )
+
+    @classmethod
+    def _validate(cls, value: t.Any) -> "ModalState":
+        if isinstance(value, cls):
+            return value
+        fields = _ModalStateFields.model_validate(value)
+        state = cls()
+        state.codes.update((code.group, code) for code in fields.codes)
+        for name in _ModalStateFields.model_fields.keys() - {"codes"}:
+            setattr(state, name, getattr(fields, name))
+        return state
+
+    def _to_fields(self) -> "_ModalStateFields":
+        # frozen codes keep their sub codes in a tuple, which the serializer would warn about
+        codes = [thaw(code) for code in self.codes.values() if code is not None]
+        values = {name: getattr(self, name) for name in _ModalStateFields.model_fields.keys() - {"codes"}}
+        return _ModalStateFields.model_construct(codes=codes, **values)
+
+    def __repr__(self) -> str:
+        active = {group.name: code.render() for group, code in self.codes.items() if code is not None}
+        return f"ModalState(codes={active}, position={self.position}, feedrate={self.feedrate})"
+
+    @property
+    def current_code(self) -> Code | None:
+        """The last modal code added"""
+        return None if self.last_group is None else self.codes[self.last_group]
+
+    def set(self, code: GCode) -> None:
+        group = code.group
+        self.codes[group] = code
+        if group == GGroups.NONMODAL:
+            return
+        self.last_group = group
+        if group == GGroups.DISTANCE_MODE:
+            self.incremental = code.code_number == 91
+        elif group == GGroups.CANNED_CYCLE:
+            self.canned = code.code_number != 80
+
+    def move(self, words: t.Iterable[Word]) -> None:
+        """Update the position with the axis words of a block"""
+        position = self.position
+        machine = self.machine_coordinates
+        for code_type, number in words:
+            if code_type in AXES:
+                if machine or (self.canned and code_type == "Z"):
+                    position.pop(code_type, None)
+                elif self.incremental:
+                    if code_type in position:
+                        position[code_type] += number
+                else:
+                    position[code_type] = float(number)
+            elif code_type == "G" and number in _MACHINE_G:
+                machine = True
+
+    def replay(self, words: list[Word]) -> None:
+        """Update the state with a block that was read rather than built, e.g. one of a loaded program's"""
+        for code_type, number in words:
+            if code_type == "G" and (group := G_CODE_GROUPS.get(number)) is not None:
+                if (code := _REPLAYED_G.get(number)) is None:
+                    code = _REPLAYED_G[number] = freeze(GCode.model_construct(code_number=number, group=group))
+                self.set(code)
+            elif code_type == "F":
+                self.feedrate = number
+            elif code_type == "M" and number in _SPINDLE_M:
+                direction = SpindleDirection(number)
+                speed = 0 if direction == SpindleDirection.OFF else dict(words).get("S", self.spindle.speed)
+                self.spindle = SpindleSettings(direction=direction, speed=speed)
+            elif code_type == "M" and number in (8, 9):
+                self.coolant = number == 8
+        self.move(words)
+
+    def move_columns(self, letters: t.Sequence[str], columns: "np.ndarray") -> None:
+        """Update the position with blocks given as columns (one row per letter), where NaN leaves an axis out"""
+        import numpy as np
+
+        position = self.position
+        for code_type, row in zip(letters, columns):
+            if code_type not in AXES:
+                continue
+            values = row[~np.isnan(row)]
+            if not len(values):
+                continue
+            if self.machine_coordinates or (self.canned and code_type == "Z"):
+                position.pop(code_type, None)
+            elif self.incremental:
+                if code_type in position:
+                    position[code_type] += float(values.sum())
+            else:
+                position[code_type] = float(values[-1])
+
+    def snapshot(self) -> "ModalState":
+        """A copy of the state that later updates don't change"""
+        snapshot = copy.copy(self)
+        snapshot.codes = dict(self.codes)
+        snapshot.position = dict(self.position)
+        return snapshot
+
+
+class _ModalStateFields(BaseModel):
+    """What a ModalState is dumped as, e.g. with the ProgramBuilder it belongs to"""
+
+    model_config = ConfigDict(defer_build=True)
+
+    # the last code of every group that has one; each code knows its group
+    codes: list[GCode] = []
+    last_group: GGroups | None = None
+    incremental: bool = False
+    canned: bool = False
+    position: dict[str, float] = {}
+    feedrate: int | float | None = None
+    spindle: SpindleSettings
+    coolant: bool = False
+    machine_coordinates: bool = False
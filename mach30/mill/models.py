@@ -1,18 +1,38 @@
 import typing as t
+import weakref
+from functools import cached_property
 
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 
-from mach30.enums import GGroups, SpindleDirection
+from mach30.enums import GGroups, SpindleDirection, Units
+
+from .formatting import DEFAULT_FORMAT, NumberFormat, format_number
 
 CodeType = t.Literal["G", "M", "T", "R", "F", "S", "H", "D", "X", "Y", "Z", "A", "B", "C", "P", "I", "J", "K", "Q"]
 
+Word = tuple[str, int | float]
+
+
+def render_word(
+    code_type: str, code_number: float, number_format: NumberFormat = DEFAULT_FORMAT, units: Units | None = None
+) -> str:
+    if isinstance(code_number, int):
+        return f"{code_type}{code_number:02}"
+    decimals = number_format.decimals(units or number_format.units, code_type)
+    return f"{code_type}{format_number(code_number, decimals, number_format.trailing_zeros)}"
+
 
 class SpindleSettings(BaseModel):
+    # built when first used, like the codes below
+    model_config = ConfigDict(defer_build=True)
+
     direction: SpindleDirection
     speed: float | int
 
 
 class Tool(BaseModel):
+    model_config = ConfigDict(defer_build=True)
+
     number: int
     description: str
     spindle: SpindleSettings
@@ -27,6 +47,10 @@ class Tool(BaseModel):
 
 
 class Code(BaseModel):
+    # every code class builds its validator the first time it's used rather than when it's defined, so importing the
+    # whole catalog of codes stays cheap
+    model_config = ConfigDict(defer_build=True)
+
     code_type: CodeType
     code_number: int | float
     sub_codes: t.List["Code"] = []
@@ -42,9 +66,7 @@ class Code(BaseModel):
         return base
 
     def render_without_subcodes(self) -> str:
-        if isinstance(self.code_number, int):
-            return f"{self.code_type}{self.code_number:02}"
-        return f"{self.code_type}{self.code_number}"
+        return render_word(self.code_type, self.code_number)
 
     def __instancecheck__(self, instance: object) -> bool:
         # TODO - make everything classvars so this will actually work.
@@ -56,6 +78,105 @@ class Code(BaseModel):
         )
 
 
+class _Frozen:
+    """Mixed into a Code class by `freeze`. The rendered text is worked out once and kept."""
+
+    sub_codes: tuple[Code, ...]
+    comment: str | None
+
+    @cached_property
+    def _text_without_comment(self) -> str:
+        return super().render_without_comment()  # type: ignore[misc]
+
+    @cached_property
+    def words(self) -> tuple[Word, ...]:
+        return tuple(_flatten(self))  # type: ignore[arg-type]
+
+    def render(self) -> str:
+        return self._text_without_comment + (f" ({self.comment})" if self.comment else "")
+
+    def render_without_comment(self) -> str:
+        return self._text_without_comment
+
+
+C = t.TypeVar("C", bound=Code)
+
+_FROZEN_CLASSES: dict[type[Code], type[Code]] = {}
+# weak, so a frozen code lives only as long as something still uses it
+_INTERNED: "weakref.WeakValueDictionary[t.Hashable, Code]" = weakref.WeakValueDictionary()
+
+
+def _flatten(code: Code) -> list[Word]:
+    if isinstance(code, Comment):
+        return []
+    words: list[Word] = [(code.code_type, code.code_number)]
+    for sub in code.sub_codes:
+        words.extend(_flatten(sub))
+    return words
+
+
+def flatten_code(code: Code) -> list[Word]:
+    """The words of a block in the order Code.render emits them"""
+    if isinstance(code, _Frozen):
+        return list(code.words)
+    return _flatten(code)
+
+
+def freeze(code: C) -> C:  # noqa: UP047 (type parameters need 3.12; this still runs on 3.11)
+    """An immutable, interned copy of `code` (and its sub codes) that only renders once.
+
+    Equal codes -- same class and fields -- share a single instance, so blocks that show up all through a program
+    (like `G80` or `M05`) can be frozen once and added as often as needed.
+    """
+    if isinstance(code, _Frozen):
+        return code
+    key = _intern_key(code)
+    if (interned := _INTERNED.get(key)) is None:
+        cls = type(code)
+        if (frozen_cls := _FROZEN_CLASSES.get(cls)) is None:
+            frozen_cls = _FROZEN_CLASSES[cls] = type(
+                f"Frozen{cls.__name__}", (_Frozen, cls), {"model_config": ConfigDict(frozen=True)}
+            )
+        fields = {name: getattr(code, name) for name in code.model_fields_set | set(cls.model_fields)}
+        fields["sub_codes"] = tuple(freeze(sub) for sub in code.sub_codes)
+        interned = _INTERNED[key] = frozen_cls.model_construct(**fields)
+    return t.cast(C, interned)
+
+
+def thaw(code: Code) -> Code:
+    """A plain copy of a frozen code, with its sub codes in a list again as the model declares them, e.g. to dump it"""
+    if not isinstance(code, _Frozen):
+        return code
+    cls = type(code).__bases__[1]
+    fields = {name: getattr(code, name) for name in cls.model_fields}
+    fields["sub_codes"] = [thaw(sub) for sub in code.sub_codes]
+    return cls.model_construct(**fields)
+
+
+def _intern_key(value: t.Any) -> t.Hashable:
+    if isinstance(value, BaseModel):
+        return (type(value), tuple(_intern_key(getattr(value, name)) for name in type(value).model_fields))
+    if isinstance(value, (list, tuple)):
+        return tuple(_intern_key(item) for item in value)
+    # the type is part of the key, since 1 and 1.0 render differently but are equal
+    return (type(value), value)
+
+
+class Comment(Code):
+    """A block with nothing but a comment, like a note between operations. It has no words, so its code type is
+    empty."""
+
+    code_type: t.Literal[""] = ""  # type: ignore[assignment]
+    code_number: int | float = 0
+    comment: str
+
+    def render_without_comment(self) -> str:
+        return ""
+
+    def render(self) -> str:
+        return f"({self.comment})"
+
+
 class GCode(Code):
     code_type: CodeType = "G"
     group: GGroups
@@ -67,3 +188,21 @@ class GCode(Code):
         return (
             f"https://www.haascnc.com/service/codes-settings.type=gcode.machine=mill.value=G{self.code_number:02}.html"
         )
+
+
+# the G codes of every modal group, which everything that reads or tracks a code's group goes by
+MODAL_G_CODES: dict[GGroups, frozenset[int]] = {
+    GGroups.MOTION: frozenset({0, 1, 2, 3}),
+    GGroups.PLANE_SELECTION: frozenset({17, 18, 19}),
+    GGroups.DISTANCE_MODE: frozenset({90, 91}),
+    GGroups.FEEDRATE_MODE: frozenset({93, 94, 95}),
+    GGroups.UNITS: frozenset({20, 21}),
+    GGroups.CUTTER_COMPENSATION: frozenset({40, 41, 42}),
+    GGroups.TOOL_LENGTH_OFFSET: frozenset({43, 44, 49}),
+    GGroups.CANNED_CYCLE: frozenset({73, 74, 76, 77, 80, 81, 82, 83, 84, 85, 86, 87, 88, 89}),
+    GGroups.CANNED_CYCLE_RETURN_MODE: frozenset({98, 99}),
+    GGroups.COORDINATE_SYSTEM: frozenset({54, 55, 56, 57, 58, 59}),
+}
+G_CODE_GROUPS: dict[int | float, GGroups] = {
+    number: group for group, numbers in MODAL_G_CODES.items() for number in numbers
+}
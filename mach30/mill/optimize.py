@@ -0,0 +1,764 @@
+import math
+import typing as t
+
+import numpy as np
+
+from mach30.enums import GGroups, SpindleDirection
+
+from .formatting import DEFAULT_FORMAT, NumberFormat
+from .models import G_CODE_GROUPS, MODAL_G_CODES, Word
+from .store import CodeStore, units_after
+
+Block = tuple[list[Word], str | None]
+
+AXES = frozenset("XYZABC")
+LINEAR_AXES = ("X", "Y", "Z")
+MOTION = frozenset({0, 1, 2, 3})
+CANNED_CYCLES = MODAL_G_CODES[GGroups.CANNED_CYCLE] - {80}
+# (first axis, second axis, normal axis, first center offset, second center offset) of each plane, ordered so that a
+# positive turn from the first axis to the second one is counterclockwise
+PLANES = {17: ("X", "Y", "Z", "I", "J"), 18: ("Z", "X", "Y", "K", "I"), 19: ("Y", "Z", "X", "J", "K")}
+# G codes that leave the axis words of a block as plain target positions
+_PLAIN_G = frozenset({0, 1, 17, 18, 19, 90, 91, 94})
+# after these the controller's position can't be known from the program text: unit, offset, scaling and rotation
+# changes, homing, and M codes that stop for the operator, change tools or call subprograms
+_LOSE_POSITION_G = frozenset({10, 20, 21, 28, 30, 50, 51, 52, 54, 55, 56, 57, 58, 59, 68, 69, 92})
+_LOSE_POSITION_M = frozenset({0, 1, 6, 97, 98, 99})
+# M codes that end the program or call or return from a subprogram
+_PROGRAM_FLOW_M = frozenset({2, 30, 97, 98, 99})
+
+
+class _ModalState:
+    """The modal state and known absolute position of a program, updated one block at a time"""
+
+    def __init__(self) -> None:
+        self.position: dict[str, float] = {}
+        self.incremental = False
+        self.motion: int | float = 0
+        self.canned = False
+        self.plane: int | float = 17
+        self.feedrate: float | None = None
+        self.g_codes: set[int | float] = set()
+        self.m_codes: set[int | float] = set()
+
+    def enter(self, words: list[Word]) -> None:
+        """Apply the mode changes of a block, before its axis words"""
+        g_codes: set[int | float] = set()
+        m_codes: set[int | float] = set()
+        for code_type, number in words:
+            if code_type == "G":
+                g_codes.add(number)
+            elif code_type == "M":
+                m_codes.add(number)
+            elif code_type == "F":
+                self.feedrate = float(number)
+        self.g_codes, self.m_codes = g_codes, m_codes
+        if not g_codes:
+            return
+        if 91 in g_codes or 90 in g_codes:
+            self.incremental = 91 in g_codes
+        if g_codes & MOTION:
+            self.motion = max(g_codes & MOTION)
+            self.canned = False
+        if g_codes & CANNED_CYCLES:
+            self.canned = True
+        elif 80 in g_codes:
+            self.canned = False
+        if planes := g_codes & PLANES.keys():
+            self.plane = max(planes)
+
+    @property
+    def plain(self) -> bool:
+        """Whether the axis words of the current block are straight G00/G01 moves"""
+        return not self.canned and self.motion < 2 and self.g_codes <= _PLAIN_G
+
+    def move(self, code_type: str, number: float) -> None:
+        current = self.position.get(code_type)
+        if 53 in self.g_codes or (self.canned and code_type == "Z"):
+            # a machine position, or the bottom of a hole that the tool comes straight back up from
+            self.position.pop(code_type, None)
+        elif self.incremental:
+            if current is not None:
+                self.position[code_type] = current + number
+        else:
+            self.position[code_type] = number
+
+    def leave(self) -> None:
+        if self.g_codes & _LOSE_POSITION_G or self.m_codes & _LOSE_POSITION_M:
+            self.position.clear()
+
+
+def iter_without_redundant_axes(blocks: t.Iterable[Block]) -> t.Iterator[Block]:
+    """Drop axis words that don't move the machine, and blocks left without words.
+
+    Positions are tracked per axis in absolute and incremental (G91) mode, where a zero move is redundant. Only plain
+    G00/G01 blocks lose words: G53 blocks, arcs, canned cycle blocks (where repeating a position drills the hole
+    again) and anything else with a G code keep every axis word they have. A block that loses all its words keeps
+    its comment.
+    """
+    state = _ModalState()
+    for words, comment in blocks:
+        state.enter(words)
+        plain = state.plain
+        kept: list[Word] = []
+        for code_type, number in words:
+            if code_type in AXES:
+                if plain and (number == 0 if state.incremental else state.position.get(code_type) == number):
+                    continue
+                state.move(code_type, number)
+            kept.append((code_type, number))
+        state.leave()
+        if kept or comment:
+            yield kept, comment
+
+
+def remove_redundant_axes(store: CodeStore) -> CodeStore:
+    optimized = CodeStore()
+    for words, comment in iter_without_redundant_axes(store.blocks()):
+        optimized.append_words(words, comment)
+    return optimized
+
+
+# the offset word that goes with a compensation code, and is part of the mode it sets
+_OFFSET_WORD = {41: "D", 42: "D", 43: "H", 44: "H"}
+# the modes a control is in when it's switched on (units are a machine setting, so they're left out)
+POWER_ON_MODES: dict[GGroups, int] = {
+    GGroups.MOTION: 0,
+    GGroups.PLANE_SELECTION: 17,
+    GGroups.DISTANCE_MODE: 90,
+    GGroups.FEEDRATE_MODE: 94,
+    GGroups.CUTTER_COMPENSATION: 40,
+    GGroups.TOOL_LENGTH_OFFSET: 49,
+    GGroups.CANNED_CYCLE: 80,
+    GGroups.CANNED_CYCLE_RETURN_MODE: 98,
+    GGroups.COORDINATE_SYSTEM: 54,
+}
+# the cancels a program opens with, so it doesn't rely on what ran before it
+SAFETY_CANCELS = frozenset({40, 49, 80})
+_SPINDLE_M = frozenset(direction.value for direction in SpindleDirection)
+_SPINDLE_ON_M = _SPINDLE_M - {SpindleDirection.OFF.value}
+# stops, tool changes and spindle orientation stop the spindle
+_STOP_SPINDLE_M = frozenset({0, 1, 6, 19})
+
+Mode = tuple[int | float, int | float | None]
+
+
+def iter_without_redundant_modes(
+    blocks: t.Iterable[Block],
+    initial: t.Mapping[GGroups, int] | None = None,
+    keep_opening: t.Collection[int] = SAFETY_CANCELS,
+) -> t.Iterator[Block]:
+    """Drop modal G codes that set their group to the mode it's already in, and spindle M codes (M03/M04/M05) that
+    repeat the spindle's direction and speed, along with the D, H or S words that go with them.
+
+    Nothing is assumed about the modes the program starts in, unless `initial` gives them (e.g. POWER_ON_MODES). The
+    G codes in `keep_opening` are always kept before the program's first move, so the safety cancels a program opens
+    with stay even when `initial` says they're already in effect. Canned cycle blocks are kept as they are, a motion
+    code that ends a canned cycle is kept, and the modes are forgotten after the program ends or calls a subprogram,
+    as is the spindle after a stop or tool change. A block left without words is dropped along with its comment,
+    which in a built program describes the code that was dropped.
+    """
+    modes: dict[GGroups, Mode] = {group: (number, None) for group, number in (initial or {}).items()}
+    spindle: Mode | None = None
+    opening = True
+    for words, comment in blocks:
+        offsets = {code_type: number for code_type, number in words if code_type in "DHS"}
+        dropped: set[str | int] = set()
+        m_codes: set[int | float] = set()
+        for i, (code_type, number) in enumerate(words):
+            if code_type == "G" and (group := G_CODE_GROUPS.get(number)) is not None:
+                letter = _OFFSET_WORD.get(int(number))
+                mode: Mode = (number, offsets.get(letter) if letter else None)
+                if group == GGroups.CANNED_CYCLE and number != 80:
+                    modes[group] = mode
+                    # what motion mode is left once the cycle is cancelled depends on the control
+                    modes.pop(GGroups.MOTION, None)
+                    continue
+                redundant = modes.get(group) == mode and not (opening and number in keep_opening)
+                if group == GGroups.MOTION:
+                    # a motion code also ends a canned cycle, so it's only redundant when none could be active
+                    redundant = redundant and modes.get(GGroups.CANNED_CYCLE) == (80, None)
+                    modes[GGroups.CANNED_CYCLE] = (80, None)
+                if redundant:
+                    dropped.update([i, letter] if letter else [i])
+                modes[group] = mode
+            elif code_type == "M":
+                m_codes.add(number)
+                if number not in _SPINDLE_M:
+                    continue
+                speed = spindle[1] if spindle is not None else None
+                if number != SpindleDirection.OFF.value:
+                    speed = offsets.get("S", speed)
+                if spindle == (number, speed):
+                    dropped.update([i, "S"] if number != SpindleDirection.OFF.value else [i])
+                spindle = (number, speed)
+        if "S" in offsets and not m_codes & _SPINDLE_ON_M and spindle is not None:
+            # a speed change on its own, which a stopped spindle starts at next time
+            spindle = (spindle[0], offsets["S"])
+        if m_codes & _STOP_SPINDLE_M:
+            spindle = None
+        if m_codes & _PROGRAM_FLOW_M:
+            modes.clear()
+            spindle = None
+        opening = opening and not any(code_type in AXES for code_type, _ in words)
+
+        if not dropped:
+            yield words, comment
+        elif kept := [word for i, word in enumerate(words) if i not in dropped and word[0] not in dropped]:
+            yield kept, comment
+
+
+def remove_redundant_modes(
+    store: CodeStore,
+    initial: t.Mapping[GGroups, int] | None = None,
+    keep_opening: t.Collection[int] = SAFETY_CANCELS,
+) -> CodeStore:
+    optimized = CodeStore()
+    for words, comment in iter_without_redundant_modes(store.blocks(), initial=initial, keep_opening=keep_opening):
+        optimized.append_words(words, comment)
+    return optimized
+
+
+class _Arc(t.NamedTuple):
+    center: np.ndarray
+    radius: float
+    sweep: float
+
+
+def _fit_arc(points: np.ndarray, tolerance: float) -> _Arc | None:
+    """The arc through the first and last of `points` (in plane coordinates) if every point and every chord between
+    them is within `tolerance` of it, turning one way by less than a full circle with the normal axis moving in step
+    """
+    a, b, c = points[0, :2], points[len(points) // 2, :2], points[-1, :2]
+    d = 2 * (a[0] * (b[1] - c[1]) + b[0] * (c[1] - a[1]) + c[0] * (a[1] - b[1]))
+    if abs(d) < 1e-12:
+        return None
+    a2, b2, c2 = a @ a, b @ b, c @ c
+    center = np.array(
+        [
+            (a2 * (b[1] - c[1]) + b2 * (c[1] - a[1]) + c2 * (a[1] - b[1])) / d,
+            (a2 * (c[0] - b[0]) + b2 * (a[0] - c[0]) + c2 * (b[0] - a[0])) / d,
+        ]
+    )
+    radius = float(np.hypot(*(a - center)))
+    relative = points[:, :2] - center
+    if np.abs(np.hypot(relative[:, 0], relative[:, 1]) - radius).max() > tolerance:
+        return None
+
+    cross = relative[:-1, 0] * relative[1:, 1] - relative[:-1, 1] * relative[1:, 0]
+    dot = (relative[:-1] * relative[1:]).sum(axis=1)
+    steps = np.arctan2(cross, dot)
+    if not ((steps > 0).all() or (steps < 0).all()):
+        return None
+    sweep = float(steps.sum())
+    if abs(sweep) >= 2 * math.pi - 1e-6:
+        return None
+    # the original path runs along the chords, which bow away from the arc by their sagitta
+    half_chords = np.hypot(*np.diff(points[:, :2], axis=0).T) / 2
+    if (radius - np.sqrt(np.maximum(radius**2 - half_chords**2, 0))).max() > tolerance:
+        return None
+    normal = points[:, 2]
+    turned = np.concatenate([[0.0], np.cumsum(steps)]) / sweep
+    if np.abs(normal - (normal[0] + (normal[-1] - normal[0]) * turned)).max() > tolerance:
+        return None
+    return _Arc(center, radius, sweep)
+
+
+def _longest_arc(points: np.ndarray, start: int, tolerance: float, min_moves: int) -> tuple[int, _Arc] | None:
+    """The furthest point an arc from `start` can reach, found by galloping then bisecting"""
+    end = start + min_moves
+    if end >= len(points) or not (best := _fit_arc(points[start : end + 1], tolerance)):
+        return None
+    step = min_moves
+    low, high = end, None
+    while high is None:
+        end = min(low + step, len(points) - 1)
+        arc = _fit_arc(points[start : end + 1], tolerance) if end > low else None
+        if arc is None:
+            high = end if end > low else low + 1
+        else:
+            low, best = end, arc
+            step *= 2
+    while high - low > 1:
+        middle = (low + high) // 2
+        if arc := _fit_arc(points[start : middle + 1], tolerance):
+            low, best = middle, arc
+        else:
+            high = middle
+    # a run that is straight to within the tolerance is better left as a line
+    half_span = math.hypot(*(points[low, :2] - points[start, :2])) / 2 if abs(best.sweep) <= math.pi else best.radius
+    if best.radius - math.sqrt(max(best.radius**2 - half_span**2, 0)) <= tolerance:
+        return None
+    return low, best
+
+
+class _RunPass:
+    """Collects runs of absolute G01 moves with one feedrate for a subclass to rewrite; everything else goes through
+    as is. A commented block always ends a run, so its comment has a block to stay on.
+    """
+
+    axes: tuple[str, ...] = LINEAR_AXES
+
+    def __init__(self, max_run: int) -> None:
+        self.max_run = max_run
+        self.state = _ModalState()
+        # the motion mode of the output, which differs from the program's after a rewrite changed it
+        self.motion: int | float = 0
+        self.points: list[tuple[float, ...]] = []
+        self.run: list[Block] = []
+        self.run_feedrate: float | None = None
+        self.run_plane: int | float = 17
+
+    def feed(self, words: list[Word], comment: str | None) -> list[Block]:
+        """The blocks that are done once `words` has been seen, usually none while a run is building up"""
+        state, axes = self.state, self.axes
+        position = state.position
+        before = [position.get(axis) for axis in axes]
+        state.enter(words)
+        moves, simple = False, True
+        for code_type, number in words:
+            if code_type in AXES:
+                state.move(code_type, number)
+                moves = True
+                simple = simple and code_type in axes
+            elif code_type != "F" and (code_type != "G" or number != 1):
+                simple = False
+        state.leave()
+
+        fits = (
+            moves
+            and simple
+            and state.motion == 1
+            and not state.incremental
+            and state.feedrate is not None
+            # an axis that isn't known yet can stay that way, as long as the block doesn't move it
+            and (
+                None not in before
+                or all(start is not None or axis not in position for axis, start in zip(axes, before))
+            )
+        )
+        if not fits:
+            return self.flush() + self._pass_through(words, comment)
+
+        done: list[Block] = []
+        if (state.feedrate, state.plane) != (self.run_feedrate, self.run_plane) or len(self.run) >= self.max_run:
+            done = self.flush()
+        if not self.run:
+            self.points.append(tuple(0.0 if start is None else start for start in before))
+            self.run_feedrate, self.run_plane = state.feedrate, state.plane
+        self.points.append(tuple([position.get(axis, 0.0) for axis in axes]))
+        self.run.append((words, comment))
+        if comment:
+            done += self.flush()
+        return done
+
+    def _pass_through(self, words: list[Word], comment: str | None) -> list[Block]:
+        g_codes = self.state.g_codes
+        done: list[Block] = []
+        if g_codes & MOTION:
+            self.motion = self.state.motion
+        elif self.motion != self.state.motion and any(code_type in AXES for code_type, _ in words):
+            if g_codes & CANNED_CYCLES:
+                done.append(([("G", self.state.motion)], None))
+            else:
+                words = [("G", self.state.motion)] + words
+            self.motion = self.state.motion
+        done.append((words, comment))
+        return done
+
+    def _linear(self, words: list[Word]) -> list[Word]:
+        """`words` of a G01 block from the run, with the motion code put back if the output isn't in G01"""
+        if self.motion != 1:
+            self.motion = 1
+            if ("G", 1) not in words:
+                return [("G", 1), ("F", t.cast(float, self.run_feedrate))] + [word for word in words if word[0] != "F"]
+        return words
+
+    def flush(self) -> list[Block]:
+        if not self.run:
+            return []
+        done = list(self._rewrite(np.array(self.points)))
+        self.points.clear()
+        self.run.clear()
+        return done
+
+    def _rewrite(self, points: np.ndarray) -> t.Iterator[Block]:
+        """Blocks to replace the run with, given the start position and the position after every block"""
+        raise NotImplementedError
+
+
+class _ArcFitter(_RunPass):
+    def __init__(self, tolerance: float, use_radius: bool, min_moves: int, max_run: int) -> None:
+        super().__init__(max_run)
+        self.tolerance = tolerance
+        self.use_radius = use_radius
+        self.min_moves = min_moves
+
+    def _rewrite(self, points: np.ndarray) -> t.Iterator[Block]:
+        first, second, normal, first_center, second_center = PLANES[int(self.run_plane)]
+        points = points[:, [LINEAR_AXES.index(axis) for axis in (first, second, normal)]]
+        i = 0
+        while i < len(self.run):
+            found = _longest_arc(points, i, self.tolerance, self.min_moves)
+            if found is None:
+                words, comment = self.run[i]
+                yield self._linear(words), comment
+                i += 1
+                continue
+
+            end, arc = found
+            self.motion = 3 if arc.sweep > 0 else 2
+            start_point, end_point = points[i], points[end]
+            axes = {first: end_point[0], second: end_point[1]}
+            if end_point[2] != start_point[2]:
+                axes[normal] = end_point[2]
+            words = [("G", self.motion), ("F", t.cast(float, self.run_feedrate))]
+            words += [(axis, float(axes[axis])) for axis in LINEAR_AXES if axis in axes]
+            if self.use_radius:
+                # a negative R picks the long way around, which only matters once the arc is clearly over half a turn
+                words.append(("R", arc.radius if abs(arc.sweep) <= math.pi + 1e-6 else -arc.radius))
+            else:
+                offsets = {
+                    first_center: float(arc.center[0] - start_point[0]),
+                    second_center: float(arc.center[1] - start_point[1]),
+                }
+                words += [(letter, offsets[letter]) for letter in "IJK" if letter in offsets]
+            yield words, self.run[end - 1][1]
+            i = end
+
+
+def iter_fitted_arcs(
+    blocks: t.Iterable[Block],
+    tolerance: float = 0.0005,
+    use_radius: bool = False,
+    min_moves: int = 3,
+    max_run: int = 100_000,
+) -> t.Iterator[Block]:
+    """Replace runs of G01 moves that lie on a circle with G02/G03 blocks.
+
+    Only absolute G01 moves of X/Y/Z with the same feedrate are merged, into arcs in the active plane (helical when
+    the normal axis moves in step with the turn). Every original point and chord stays within `tolerance` of the arc,
+    and a commented block always stays the end of a block so its comment is kept. Arcs have IJK centers, or R words
+    with `use_radius`. Runs are fitted greedily as they go by, so time is close to linear and memory is bounded by
+    `max_run`.
+    """
+    fitter = _ArcFitter(tolerance, use_radius, min_moves, max_run)
+    for words, comment in blocks:
+        yield from fitter.feed(words, comment)
+    yield from fitter.flush()
+
+
+def fit_arcs(store: CodeStore, tolerance: float = 0.0005, use_radius: bool = False) -> CodeStore:
+    fitted = CodeStore()
+    for words, comment in iter_fitted_arcs(store.blocks(), tolerance=tolerance, use_radius=use_radius):
+        fitted.append_words(words, comment)
+    return fitted
+
+
+def _douglas_peucker(points: np.ndarray) -> np.ndarray:
+    """Which points to keep so no dropped one is more than 1 away, on any axis, from the chord that replaces it"""
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    spans = [(0, len(points) - 1)]
+    while spans:
+        lo, hi = spans.pop()
+        if hi - lo < 2:
+            continue
+        chord = points[hi] - points[lo]
+        inner = points[lo + 1 : hi] - points[lo]
+        length = chord @ chord
+        along = np.clip(inner @ chord / length, 0, 1) if length else np.zeros(len(inner))
+        deviation = np.abs(inner - along[:, None] * chord).max(axis=1)
+        worst = int(np.argmax(deviation))
+        if deviation[worst] > 1:
+            split = lo + 1 + worst
+            keep[split] = True
+            spans.extend([(lo, split), (split, hi)])
+    return keep
+
+
+class _Simplifier(_RunPass):
+    def __init__(self, tolerances: dict[str, float], max_run: int) -> None:
+        super().__init__(max_run)
+        self.axes = tuple(tolerances)
+        self.tolerances = np.array([max(tolerance, 1e-12) for tolerance in tolerances.values()])
+
+    def _rewrite(self, points: np.ndarray) -> t.Iterator[Block]:
+        keep = _douglas_peucker(points / self.tolerances)
+        # the run's first block may set the motion mode and feedrate, which the first block kept has to take over
+        leading = [word for word in self.run[0][0] if word[0] not in self.axes]
+        previous = points[0]
+        for index in np.flatnonzero(keep[1:]) + 1:
+            words: list[Word] = [
+                (axis, float(value)) for axis, value, last in zip(self.axes, points[index], previous) if value != last
+            ]
+            words, leading = leading + words, []
+            comment = self.run[index - 1][1]
+            if words or comment:
+                yield self._linear(words), comment
+            previous = points[index]
+
+
+def iter_simplified_lines(
+    blocks: t.Iterable[Block],
+    tolerance: float | t.Mapping[str, float] = 0.0005,
+    rotary_tolerance: float | None = None,
+    max_run: int = 100_000,
+) -> t.Iterator[Block]:
+    """Drop G01 points that a straight move between their neighbors passes close enough to (Douglas-Peucker).
+
+    `tolerance` is how far each axis may stray from the original path, either one value for X, Y and Z or one per
+    axis. Moves of the rotary axes are only simplified when they get their own `rotary_tolerance` (in degrees), and
+    otherwise pass through untouched. Like the other passes only absolute moves with the same feedrate are merged and
+    commented points stay, and memory is bounded by `max_run`.
+    """
+    tolerances = dict.fromkeys(LINEAR_AXES, tolerance) if not isinstance(tolerance, t.Mapping) else dict(tolerance)
+    tolerances = {axis: float(tolerances.get(axis, 0.0005)) for axis in LINEAR_AXES}
+    if rotary_tolerance is not None:
+        tolerances.update(dict.fromkeys("ABC", rotary_tolerance))
+    simplifier = _Simplifier(tolerances, max_run)
+    for words, comment in blocks:
+        yield from simplifier.feed(words, comment)
+    yield from simplifier.flush()
+
+
+def simplify_lines(
+    store: CodeStore, tolerance: float | t.Mapping[str, float] = 0.0005, rotary_tolerance: float | None = None
+) -> CodeStore:
+    simplified = CodeStore()
+    for words, comment in iter_simplified_lines(store.blocks(), tolerance=tolerance, rotary_tolerance=rotary_tolerance):
+        simplified.append_words(words, comment)
+    return simplified
+
+
+# the "left symbol" of a suffix array interval when the blocks before its occurrences differ
+_MIXED = -1
+
+
+class _Repeat(t.NamedTuple):
+    blocks: int
+    starts: list[int]
+
+    @property
+    def savings(self) -> int:
+        # every occurrence becomes one call, and the subprogram takes its blocks plus G90 and M99
+        return len(self.starts) * (self.blocks - 1) - self.blocks - 2
+
+
+def _suffix_array(ids: np.ndarray) -> np.ndarray:
+    """The start of every suffix of `ids` in sorted order, by prefix doubling"""
+    n = len(ids)
+    rank = np.unique(ids, return_inverse=True)[1].reshape(-1).astype(np.int64)
+    order = np.argsort(rank, kind="stable")
+    step = 1
+    while n > 1:
+        second = np.full(n, -1, dtype=np.int64)
+        if step < n:
+            second[: n - step] = rank[step:]
+        order = np.lexsort((second, rank))
+        first_sorted, second_sorted = rank[order], second[order]
+        new = np.empty(n, dtype=bool)
+        new[0] = True
+        new[1:] = (first_sorted[1:] != first_sorted[:-1]) | (second_sorted[1:] != second_sorted[:-1])
+        rank = np.empty(n, dtype=np.int64)
+        rank[order] = np.cumsum(new) - 1
+        if not step < n or rank[order[-1]] == n - 1:
+            break
+        step *= 2
+    return order
+
+
+def _longest_common_prefixes(ids: list[int], suffixes: list[int]) -> list[int]:
+    """How many ids each suffix shares with the one sorted before it (Kasai)"""
+    n = len(ids)
+    rank = [0] * n
+    for i, start in enumerate(suffixes):
+        rank[start] = i
+    common = [0] * n
+    h = 0
+    for start in range(n):
+        i = rank[start]
+        if not i:
+            h = 0
+            continue
+        other = suffixes[i - 1]
+        while start + h < n and other + h < n and ids[start + h] == ids[other + h]:
+            h += 1
+        common[i] = h
+        h = max(h - 1, 0)
+    return common
+
+
+def _best_repeat(ids: np.ndarray, min_blocks: int) -> _Repeat | None:
+    """The repeated run of blocks whose non-overlapping occurrences save the most blocks as one subprogram.
+
+    Every interval of the suffix array that shares a prefix of at least `min_blocks` is a candidate. Only left-maximal
+    ones are scored (the blocks before their occurrences aren't all the same, or the run could be one block longer),
+    and only when they could beat the best one so far, which keeps periodic programs like a contour cut over and over
+    from scoring every one of their many nested intervals.
+    """
+    suffixes = _suffix_array(ids).tolist()
+    values = ids.tolist()
+    common = _longest_common_prefixes(values, suffixes)
+    before = [values[start - 1] if start else _MIXED for start in suffixes]
+    best: _Repeat | None = None
+
+    def merge(left: int | None, right: int | None) -> int | None:
+        if left is None or left == right:
+            return right
+        return left if right is None else _MIXED
+
+    def score(blocks: int, lo: int, hi: int) -> None:
+        nonlocal best
+        bound = (hi - lo) * (blocks - 1) - blocks - 2
+        if bound <= 0 or (best is not None and bound <= best.savings):
+            return
+        starts: list[int] = []
+        end = 0
+        for start in sorted(suffixes[lo:hi]):
+            if start >= end:
+                starts.append(start)
+                end = start + blocks
+        repeat = _Repeat(blocks, starts)
+        if repeat.savings > 0 and (best is None or repeat.savings > best.savings):
+            best = repeat
+
+    # bottom up walk over the intervals of the suffix array: (shared prefix, first suffix, left symbol)
+    stack: list[list[t.Any]] = [[0, 0, None]]
+    for i in range(1, len(suffixes) + 1):
+        shared = common[i] if i < len(suffixes) else 0
+        left, lo = before[i - 1], i - 1
+        while shared < stack[-1][0]:
+            blocks, lo, interval_left = stack.pop()
+            left = merge(interval_left, left)
+            if blocks >= min_blocks and left == _MIXED:
+                score(blocks, lo, i)
+        if shared > stack[-1][0]:
+            stack.append([shared, lo, left])
+        else:
+            stack[-1][2] = merge(stack[-1][2], left)
+    return best
+
+
+class _Relocated(t.NamedTuple):
+    """A block with its axis words made incremental, so it's the same wherever it is cut"""
+
+    incremental: bool
+    words: tuple[Word, ...]
+    comment: str | None
+
+
+def _relocated_blocks(
+    blocks: t.Iterable[Block], number_format: NumberFormat
+) -> t.Iterator[tuple[list[Word], str | None, _Relocated | None]]:
+    """Every block with its relocated form, or None for blocks that can't be moved into a subprogram.
+
+    Positions are kept in steps of the precision each axis is written with, so the incremental moves add up to
+    exactly the absolute positions they replace.
+    """
+    state = _ModalState()
+    units = number_format.units
+    position: dict[str, int] = {}
+    for words, comment in blocks:
+        state.enter(words)
+        g_codes, m_codes = state.g_codes, state.m_codes
+        assert not m_codes & {97, 98, 99}, "the program already has subprograms"
+        loses_position = bool(g_codes & _LOSE_POSITION_G or m_codes & _LOSE_POSITION_M)
+        movable = not (loses_position or m_codes & _PROGRAM_FLOW_M or g_codes & {53, 90, 91})
+        relocated: list[Word] = []
+        for code_type, number in words:
+            if code_type not in AXES:
+                relocated.append((code_type, number))
+                continue
+            scale = 10 ** number_format.decimals(units, code_type)
+            steps = round(float(number) * scale)
+            current = position.get(code_type)
+            # canned cycles (where a Z is a hole's depth) stay out of subprograms
+            movable = movable and not state.canned and (state.incremental or current is not None)
+            relocated.append((code_type, (steps if state.incremental or current is None else steps - current) / scale))
+            if 53 in g_codes or (state.canned and code_type == "Z"):
+                position.pop(code_type, None)
+            elif not state.incremental:
+                position[code_type] = steps
+            elif current is not None:
+                position[code_type] = current + steps
+        if loses_position:
+            position.clear()
+        units = units_after(words, units)
+        yield words, comment, _Relocated(state.incremental, tuple(relocated), comment) if movable else None
+
+
+def extract_subprograms(
+    store: CodeStore,
+    min_blocks: int = 4,
+    max_subprograms: int = 100,
+    number_format: NumberFormat = DEFAULT_FORMAT,
+) -> CodeStore:
+    """Move repeated runs of blocks into local subprograms, called with M97 and placed after the M30.
+
+    Blocks are compared with their axis words made incremental, so a contour cut at several places is one
+    subprogram: a run that was written in absolute (G90) positions is switched to G91 for the subprogram and back to
+    G90 before its M99. Runs never take in blocks that call or end programs, change units, offsets or tools, use
+    machine coordinates or switch between G90 and G91, and a called subprogram never calls another one.
+
+    Runs are picked greedily from a suffix array of the blocks, the one saving the most blocks first, until no repeat
+    of at least `min_blocks` blocks saves any. M97 P refers to the N number of the subprogram's first block, so the
+    program has to be written with line numbers. `number_format` should be the one the program is written with, since
+    positions are compared at the precision they're written at.
+    """
+    # blocks that relocate the same share an id, and every other block gets one of its own so it never matches
+    keys: dict[_Relocated, int] = {}
+    relocated: list[_Relocated | None] = []
+    ids: list[int] = []
+    ended = False
+    for index, (words, _, block) in enumerate(_relocated_blocks(store.blocks(), number_format)):
+        ended = ended or ("M", 30) in words
+        relocated.append(block)
+        ids.append(index if block is None else keys.setdefault(block, index))
+
+    # blocks of the program as it's being rewritten: original block indexes, or -1 - n for a call of subprogram n
+    sequence = np.array(ids, dtype=np.int64)
+    origin = np.arange(len(store), dtype=np.int64)
+    subprograms: list[list[int]] = []
+    next_id = len(store)
+    while len(subprograms) < max_subprograms and (repeat := _best_repeat(sequence, min_blocks)) is not None:
+        first = repeat.starts[0]
+        subprograms.append(origin[first : first + repeat.blocks].tolist())
+        keep = np.ones(len(sequence), dtype=bool)
+        for start in repeat.starts:
+            keep[start + 1 : start + repeat.blocks] = False
+        starts = np.array(repeat.starts)
+        # every call gets an id no block has, so calls are never part of a later repeat
+        sequence[starts] = np.arange(len(starts)) + next_id
+        next_id += len(starts)
+        origin[starts] = -len(subprograms)
+        sequence, origin = sequence[keep], origin[keep]
+
+    if not subprograms:
+        return store
+    # a subprogram starts on the line after the main program (and the M30 added to it if it had none) and the
+    # subprograms before it
+    line = len(origin) + (not ended) + 1
+    labels = []
+    for blocks in subprograms:
+        labels.append(line)
+        line += len(blocks) + 1 + (not t.cast(_Relocated, relocated[blocks[0]]).incremental)
+
+    extracted = CodeStore()
+    for index in origin.tolist():
+        if index < 0:
+            extracted.append_words([("M", 97), ("P", labels[-1 - index])])
+        else:
+            extracted.append_words(store.words(index), store.comment(index))
+    if not ended:
+        extracted.append_words([("M", 30)])
+    for blocks in subprograms:
+        body = [t.cast(_Relocated, relocated[index]) for index in blocks]
+        absolute = not body[0].incremental
+        for i, block in enumerate(body):
+            words = list(block.words)
+            extracted.append_words([("G", 91)] + words if absolute and not i else words, block.comment)
+        if absolute:
+            extracted.append_words([("G", 90)])
+        extracted.append_words([("M", 99)])
+    return extracted
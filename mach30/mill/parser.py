@@ -0,0 +1,247 @@
+import codecs
+import itertools
+import re
+import typing as t
+from pathlib import Path
+
+from .builder import ProgramBuilder
+from .models import Word
+from .store import CODE_TYPES, TYPE_INDEX, CodeStore
+
+# One alternative per token: a word with an integer number, a word with a decimal number, a comment, and anything
+# else (which is either a % or a syntax error).
+_TOKEN = re.compile(
+    r"([A-Za-z])\s*(?:([-+]?\d+)(?![\d.eE])|([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?))|\(([^)\n]*)\)|(\S)"
+)
+_LETTERS: dict[str, int] = {**TYPE_INDEX, **{code_type.lower(): i for code_type, i in TYPE_INDEX.items()}}
+
+# "Plain" lines only hold upper case words (plus N line numbers) and are parsed in bulk, a run of lines at a time.
+# E and e can only be exponents there, since E isn't a code type.
+_PLAIN_LETTERS = "".join(CODE_TYPES) + "N"
+_NOT_PLAIN = re.compile(rf"[^{_PLAIN_LETTERS}0-9.+\-eE \t\r\n]")
+# translating ASCII text with this turns every character that isn't allowed in a plain line into a NUL, which is much
+# quicker to find than searching with _NOT_PLAIN
+_MARK_NOT_PLAIN = {i: 0 for i in range(128) if _NOT_PLAIN.match(chr(i))}
+_KEEP_LETTERS = {i: None for i in range(128) if chr(i) not in _PLAIN_LETTERS + "\n"}
+_LETTERS_TO_SPACES = str.maketrans(_PLAIN_LETTERS + "\n", " " * (len(_PLAIN_LETTERS) + 1))
+_LINE_NUMBER = re.compile(r"\nN(\d+)")
+# Reduces a plain run to its shape: an L per letter and a d per number character. Every line has to start with an L
+# and every L has to be followed by a d.
+_SHAPE = str.maketrans(_PLAIN_LETTERS + "0123456789.+-eE", "L" * len(_PLAIN_LETTERS) + "d" * 15, " \t\r")
+
+Source = Path | str | t.Iterable[str | bytes]
+
+
+class ParseError(ValueError):
+    def __init__(self, message: str, line: int) -> None:
+        super().__init__(f"line {line}: {message}")
+        self.line = line
+
+
+class ParsedBlock(t.NamedTuple):
+    words: list[Word]
+    comment: str | None
+    line_number: int | None
+
+
+class _Columns:
+    def __init__(self, with_line_numbers: bool) -> None:
+        self.with_line_numbers = with_line_numbers
+        self.types: list[int] = []
+        self.numbers: list[float] = []
+        self.is_int: list[bool] = []
+        self.ends: list[int] = []
+        self.comments: dict[int, str] = {}
+        self.line_numbers: dict[int, int] = {}
+
+    def blocks(self) -> list[ParsedBlock]:
+        blocks = []
+        start = 0
+        for i, end in enumerate(self.ends):
+            words: list[Word] = [
+                (CODE_TYPES[self.types[j]], int(self.numbers[j]) if self.is_int[j] else self.numbers[j])
+                for j in range(start, end)
+            ]
+            blocks.append(ParsedBlock(words, self.comments.get(i), self.line_numbers.get(i)))
+            start = end
+        return blocks
+
+
+class ProgramParser:
+    """Incremental parser for Haas-style programs.
+
+    Feed it text (or bytes) in chunks of any size; blocks come back as soon as their line is complete. Header
+    comments and the program number are collected on the parser rather than returned as blocks, and N words are
+    returned as the block's line_number. A parser made with `in_body` starts past the header, to parse from the
+    middle of a program.
+    """
+
+    def __init__(self, in_body: bool = False) -> None:
+        self.number: int | None = None
+        self.header_comments: list[str] = []
+        self.finished = False
+        self._in_body = in_body
+        self._line = 0
+        self._tail = ""
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+
+    def feed(self, data: str | bytes) -> list[ParsedBlock]:
+        return self._scan_chunk(data, with_line_numbers=True).blocks()
+
+    def feed_store(self, store: CodeStore, data: str | bytes, final: bool = False) -> None:
+        columns = self._scan_chunk(data, final=final, with_line_numbers=False)
+        store.extend_columns(columns.types, columns.numbers, columns.is_int, columns.ends, columns.comments)
+
+    def close(self) -> list[ParsedBlock]:
+        return self._scan_chunk(b"\n", final=True, with_line_numbers=True).blocks()
+
+    def close_store(self, store: CodeStore) -> None:
+        self.feed_store(store, b"\n", final=True)
+
+    def parse(self, source: Source, chunk_size: int = 1 << 20) -> t.Iterator[ParsedBlock]:
+        for chunk in self._chunks(source, chunk_size):
+            yield from self.feed(chunk)
+        yield from self.close()
+
+    def parse_into(self, store: CodeStore, source: Source, chunk_size: int = 1 << 20) -> CodeStore:
+        for chunk in self._chunks(source, chunk_size):
+            self.feed_store(store, chunk)
+        self.close_store(store)
+        return store
+
+    @staticmethod
+    def _chunks(source: Source, chunk_size: int) -> t.Iterator[str | bytes]:
+        if isinstance(source, (str, Path)):
+            with open(source, "rb") as f:
+                yield from iter(lambda: f.read(chunk_size), b"")
+        else:
+            yield from source
+
+    def _scan_chunk(self, data: str | bytes, with_line_numbers: bool, final: bool = False) -> _Columns:
+        text = self._tail + (self._decoder.decode(data, final=final) if isinstance(data, bytes) else data)
+        cut = text.rfind("\n") + 1
+        self._tail = text[cut:]
+        columns = _Columns(with_line_numbers)
+
+        # Alternate between runs of plain lines and single lines that need the tokenizer
+        marked = text.translate(_MARK_NOT_PLAIN) if text.isascii() else None
+        pos = 0
+        while True:
+            if marked is not None:
+                special = marked.find("\0", pos, cut)
+            else:
+                special = match.start() if (match := _NOT_PLAIN.search(text, pos, cut)) else -1
+            if special < 0:
+                break
+            start = text.rfind("\n", 0, special) + 1
+            end = text.find("\n", special)
+            self._scan_plain(text[pos:start], columns)
+            self._line += 1
+            self._scan_line(text[start:end], columns)
+            pos = end + 1
+        self._scan_plain(text[pos:cut], columns)
+        return columns
+
+    def _scan_plain(self, run: str, columns: _Columns) -> None:
+        if not run:
+            return
+        # N words are line numbers rather than part of the block, and are only allowed as the first word
+        # (matched after a newline rather than with ^ and MULTILINE since that is several times faster)
+        stripped = _LINE_NUMBER.sub("\n", "\n" + run)[1:] if "N" in run else run
+        letter_lines = stripped.translate(_KEEP_LETTERS).split("\n")
+        letter_lines.pop()
+        letters = "".join(letter_lines)
+        tokens = stripped.translate(_LETTERS_TO_SPACES).split()
+        shape = stripped.translate(_SHAPE)
+        try:
+            if self.finished or "N" in letters or len(letters) != len(tokens) or shape[:1] == "d":
+                raise ValueError(run)
+            if "LL" in shape or "L\n" in shape or "\nd" in shape:
+                raise ValueError(run)
+            numbers = list(map(float, tokens))
+        except ValueError:
+            # let the tokenizer find (and report) whatever is wrong
+            for line in run.split("\n")[:-1]:
+                self._line += 1
+                self._scan_line(line, columns)
+            return
+
+        self._line += len(letter_lines)
+        first_block = len(columns.ends)
+        counts = list(map(len, letter_lines))
+        ends = itertools.accumulate(counts, initial=len(columns.types))
+        next(ends)
+        columns.ends.extend([end for end, count in zip(ends, counts) if count])
+        columns.types.extend(map(TYPE_INDEX.__getitem__, letters))
+        columns.numbers.extend(numbers)
+        columns.is_int.extend(["." not in token and "e" not in token and "E" not in token for token in tokens])
+        if len(columns.ends) > first_block:
+            self._in_body = True
+        if columns.with_line_numbers and stripped is not run:
+            block_lines = (line for line, count in zip(run.split("\n"), counts) if count)
+            for block, line in enumerate(block_lines, start=first_block):
+                if match := _LINE_NUMBER.match("\n" + line):
+                    columns.line_numbers[block] = int(match[1])
+
+    def _scan_line(self, line: str, columns: _Columns) -> None:
+        types = columns.types
+        block_start = len(types)
+        comments: list[str] = []
+        line_number: int | None = None
+        marker = False
+
+        for letter, int_number, float_number, comment, other in _TOKEN.findall(line):
+            if letter:
+                if self.finished:
+                    raise ParseError("content after the closing %", self._line)
+                code_type = _LETTERS.get(letter)
+                if code_type is not None:
+                    types.append(code_type)
+                    columns.numbers.append(float(int_number or float_number))
+                    columns.is_int.append(not float_number)
+                    continue
+                first = len(types) == block_start
+                if letter in "Nn" and int_number and first and line_number is None:
+                    line_number = int(int_number)
+                elif letter in "Oo" and int_number and first and not self._in_body and self.number is None:
+                    self.number = int(int_number)
+                else:
+                    raise ParseError(f"unsupported word {letter}{int_number or float_number}", self._line)
+            elif other == "%" and not marker and len(types) == block_start and not comments:
+                # the first % opens the program and the second one closes it
+                self.finished = self._in_body or self.number is not None
+                marker = True
+            elif other:
+                raise ParseError(f"unexpected {other!r}", self._line)
+            else:
+                if self.finished:
+                    raise ParseError("content after the closing %", self._line)
+                comments.append(comment)
+
+        if len(types) > block_start or (self._in_body and any(comments)):
+            if comments:
+                columns.comments[len(columns.ends)] = " ".join(comments)
+            if line_number is not None:
+                columns.line_numbers[len(columns.ends)] = line_number
+            columns.ends.append(len(types))
+            self._in_body = True
+        elif not self._in_body:
+            self.header_comments.extend(comments)
+
+
+def iter_blocks(source: Source) -> t.Iterator[ParsedBlock]:
+    return ProgramParser().parse(source)
+
+
+def load_store(source: Source) -> CodeStore:
+    return ProgramParser().parse_into(CodeStore(), source)
+
+
+def load_program(source: Source) -> ProgramBuilder:
+    parser = ProgramParser()
+    store = parser.parse_into(CodeStore(), source)
+    builder = ProgramBuilder(number=parser.number or 0, preamble_comments=parser.header_comments, codes=store)
+    # so blocks added to the loaded program know which modes are in effect and where the tool is
+    for words, _ in store.blocks():
+        builder.modal.replay(words)
+    return builder
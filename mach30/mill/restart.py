@@ -0,0 +1,329 @@
+import mmap
+import re
+import typing as t
+from bisect import bisect_right
+from pathlib import Path
+
+import numpy as np
+from pydantic import BaseModel
+
+from mach30.enums import (
+    GGroups,
+    PositionMode,
+    SpindleDirection,
+    Units,
+)
+
+from .estimate import MM_PER_INCH, ProgramColumns, ffill
+from .gcode_basic import (
+    CancelCannedCycle,
+    CancelCutterComp,
+    CancelToolLengthComp,
+    LinearFeed,
+    Rapid,
+    UseMachineCoord,
+)
+from .mcode import MCode, ToolChange
+from .models import MODAL_G_CODES, Code, CodeType, GCode, SpindleSettings
+from .parser import ProgramParser
+from .store import CodeStore
+
+# the modal groups that are tracked, and restored by a restart
+_MODAL_G: dict[GGroups, tuple[int, ...]] = {
+    group: tuple(sorted(MODAL_G_CODES[group]))
+    for group in (
+        GGroups.MOTION,
+        GGroups.PLANE_SELECTION,
+        GGroups.DISTANCE_MODE,
+        GGroups.UNITS,
+        GGroups.CUTTER_COMPENSATION,
+        GGroups.TOOL_LENGTH_OFFSET,
+        GGroups.CANNED_CYCLE,
+        GGroups.CANNED_CYCLE_RETURN_MODE,
+        GGroups.COORDINATE_SYSTEM,
+    )
+}
+_AXES = "XYZABC"
+_LINE_NUMBER = re.compile(rb"N(\d+)")
+
+
+class ProgramState(BaseModel):
+    """The modal state of a program when the block numbered `line` is about to run.
+
+    `modes` holds the last G code of every modal group that was set. Positions are in the units in effect, and an axis
+    is left out of `position` when it can't be known from the program: before it's first programmed, after an
+    incremental, G28 or G53 move of it, or at the bottom of a canned cycle's holes.
+    """
+
+    line: int = 0
+    modes: dict[GGroups, int] = {}
+    # the tool in the spindle (the T of the last tool change) and the last T word, which a tool change without one loads
+    tool: int | None = None
+    selected_tool: int | None = None
+    spindle: SpindleSettings = SpindleSettings(direction=SpindleDirection.OFF, speed=0)
+    feedrate: float | None = None
+    # the last H and D words, which the tool length and cutter compensation modes use
+    length_offset: int | None = None
+    diameter_offset: int | None = None
+    coolant: bool = False
+    position: dict[str, float] = {}
+
+    def advance(self, store: CodeStore) -> "ProgramState":
+        """The state after the blocks of `store` run, starting from this one"""
+        if not len(store):
+            return self
+        program = ProgramColumns(store)
+        modes = dict(self.modes)
+        per_block: dict[GGroups, np.ndarray] = {}
+        for group, numbers in _MODAL_G.items():
+            per_block[group] = program.mode(numbers, initial=self.modes.get(group, -1))
+            if per_block[group][-1] >= 0:
+                modes[group] = int(per_block[group][-1])
+
+        selected = program.values("T")
+        loads = np.flatnonzero(program.has("M", [6]))
+        tool = self.tool
+        if len(loads):
+            # a tool change loads the T in its own block, or the last one before it
+            loaded = ffill(selected, ~np.isnan(selected), np.nan if self.selected_tool is None else self.selected_tool)
+            tool = None if np.isnan(loaded[loads[-1]]) else int(loaded[loads[-1]])
+        direction = _last_of(program, "M", [direction.value for direction in SpindleDirection])
+        coolant = _last_of(program, "M", [7, 8, 9])
+
+        incremental = per_block[GGroups.DISTANCE_MODE] == PositionMode.INCREMENTAL.value
+        canned = per_block[GGroups.CANNED_CYCLE] > 80
+        machine = program.has("G", [28, 53])
+        # positions are kept in the units the program ends up in
+        units = per_block[GGroups.UNITS]
+        position = {
+            axis: _convert(value, self.modes.get(GGroups.UNITS), units[-1]) for axis, value in self.position.items()
+        }
+        # where an axis ends up: its last absolute position, or an unknown one after a move that can't be followed,
+        # moved by every incremental move of it since
+        for axis in _AXES:
+            values = program.values(axis)
+            programmed = np.flatnonzero(~np.isnan(values))
+            if not len(programmed):
+                continue
+            lost = machine[programmed] | (canned[programmed] & (axis == "Z"))
+            anchors = programmed[lost | ~incremental[programmed]]
+            if len(anchors):
+                anchor = anchors[-1]
+                if lost[np.searchsorted(programmed, anchor)]:
+                    position.pop(axis, None)
+                else:
+                    position[axis] = _convert(float(values[anchor]), units[anchor], units[-1])
+                programmed = programmed[programmed > anchor]
+            if axis in position:
+                position[axis] += sum(_convert(float(values[i]), units[i], units[-1]) for i in programmed.tolist())
+
+        return ProgramState(
+            line=self.line,
+            modes=modes,
+            tool=tool,
+            selected_tool=_last_value(program, "T", self.selected_tool),
+            spindle=SpindleSettings(
+                direction=self.spindle.direction if direction is None else SpindleDirection(direction),
+                speed=_last_value(program, "S", self.spindle.speed),
+            ),
+            feedrate=_last_value(program, "F", self.feedrate),
+            length_offset=_last_value(program, "H", self.length_offset),
+            diameter_offset=_last_value(program, "D", self.diameter_offset),
+            coolant=self.coolant if coolant is None else coolant != 9,
+            position=position,
+        )
+
+
+def _convert(value: float, before: int | None, after: int) -> float:
+    """`value` in the units selected by G`after`, from the ones selected by G`before`"""
+    if before == Units.INCHES.value and after == Units.MILLIMETERS.value:
+        return value * MM_PER_INCH
+    if before == Units.MILLIMETERS.value and after == Units.INCHES.value:
+        return value / MM_PER_INCH
+    return value
+
+
+def _last_value(program: ProgramColumns, letter: str, initial: t.Any) -> t.Any:
+    values = program.values(letter)
+    programmed = np.flatnonzero(~np.isnan(values))
+    if not len(programmed):
+        return initial
+    value = float(values[programmed[-1]])
+    return int(value) if letter in "THD" or (letter == "S" and value.is_integer()) else value
+
+
+def _last_of(program: ProgramColumns, letter: str, numbers: list[int]) -> int | None:
+    """Which of `numbers` came last as a `letter` word, if any did"""
+    last, found = -1, None
+    for number in numbers:
+        blocks = np.flatnonzero(program.has(letter, [number]))
+        if len(blocks) and blocks[-1] > last:
+            last, found = blocks[-1], number
+    return found
+
+
+class ProgramIndex:
+    """Random access to the blocks of a saved program by their N line number, for restarting in the middle of it.
+
+    The file is memory-mapped and parsed once, a chunk of `checkpoint_lines` lines at a time, keeping the byte offset,
+    first line number and modal state at the start of every chunk. The state at a line is then the state at the
+    closest checkpoint before it, advanced by the few blocks in between. Line numbers have to increase through the
+    file, as they do in programs saved with `ProgramBuilder.save(with_line_numbers=True)`.
+    """
+
+    def __init__(self, fname: Path | str, checkpoint_lines: int = 4096) -> None:
+        assert checkpoint_lines > 0, "checkpoints need at least a line between them"
+        with open(fname, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.parser = ProgramParser()
+        # checkpoint 0 is the start of the file, which is the only one parsed with the header
+        self._lines = [0]
+        self._offsets = [0]
+        self._states = [ProgramState()]
+        start, state = 0, self._states[0]
+        for end in self._chunk_ends(checkpoint_lines):
+            store = CodeStore()
+            self.parser.feed_store(store, self._map[start:end], final=end == len(self._map))
+            state = state.advance(store)
+            start = end
+            match = _LINE_NUMBER.match(self._map, end)
+            if match and int(match[1]) > self._lines[-1]:
+                self._lines.append(int(match[1]))
+                self._offsets.append(end)
+                self._states.append(state)
+
+    @property
+    def number(self) -> int | None:
+        return self.parser.number
+
+    def close(self) -> None:
+        self._map.close()
+
+    def offset(self, line: int) -> int:
+        """Byte offset of the block numbered `line`"""
+        data = self._map
+        position = self._offsets[bisect_right(self._lines, line) - 1]
+        while position < len(data):
+            match = _LINE_NUMBER.match(data, position)
+            if match and int(match[1]) == line:
+                return position
+            if match and int(match[1]) > line:
+                break
+            position = data.find(b"\n", position) + 1
+            if not position:
+                break
+        raise KeyError(f"there is no block numbered N{line}")
+
+    def state_at(self, line: int) -> ProgramState:
+        """The modal state the block numbered `line` runs in"""
+        checkpoint = bisect_right(self._lines, line) - 1
+        end = self.offset(line)
+        start = self._offsets[checkpoint]
+        store = CodeStore()
+        ProgramParser(in_body=checkpoint > 0).parse_into(store, [self._map[start:end]])
+        return self._states[checkpoint].advance(store).model_copy(update={"line": line})
+
+    def lines_from(self, line: int) -> t.Iterator[str]:
+        """The text of the program from the block numbered `line` on, a line at a time"""
+        data, position = self._map, self.offset(line)
+        while position < len(data):
+            end = data.find(b"\n", position)
+            end = len(data) if end < 0 else end
+            yield data[position:end].decode()
+            position = end + 1
+
+    def _chunk_ends(self, lines: int, scan_bytes: int = 1 << 23) -> t.Iterator[int]:
+        """Byte offsets just past every `lines`th newline, and the end of the file"""
+        data = np.frombuffer(self._map, dtype=np.uint8)
+        seen = 0
+        for start in range(0, len(data), scan_bytes):
+            newlines = np.flatnonzero(data[start : start + scan_bytes] == ord("\n"))
+            yield from (newlines[(lines - 1 - seen) % lines :: lines] + start + 1).tolist()
+            seen += len(newlines)
+        del data
+        yield len(self._map)
+
+
+def restart_preamble(state: ProgramState, clearance: float = 1.0) -> list[Code]:
+    """Blocks that bring a machine into `state` so a program can be restarted at `state.line`.
+
+    Compensation and canned cycles are cancelled, the units, plane and work offset set, and the tool changed at the
+    tool change height. The spindle and coolant are turned back on, then the tool moves over the restart position
+    (turning cutter compensation back on with that move if it was on), down to `clearance` (in the program's units)
+    with tool length compensation, and feeds down to the restart depth when it's known. Last, the distance mode, motion
+    mode and feedrate the program was in are set again. A canned cycle's parameters aren't known in the middle of it,
+    so restarting inside one is refused.
+    """
+    modes = state.modes
+    if modes.get(GGroups.CANNED_CYCLE, 80) != 80:
+        raise ValueError(f"a canned cycle is active at N{state.line}; restart at the block that starts it")
+    compensation = modes.get(GGroups.CUTTER_COMPENSATION, 40)
+    xy: tuple[CodeType, ...] = ("X", "Y")
+    over = [Code(code_type=axis, code_number=state.position[axis]) for axis in xy if axis in state.position]
+    if compensation != 40 and (len(over) < 2 or state.diameter_offset is None):
+        raise ValueError(f"cutter compensation is on at N{state.line} but it can't be turned on again there")
+
+    codes: list[Code] = [
+        CancelCannedCycle(comment="restart"),
+        CancelCutterComp(),
+        CancelToolLengthComp(),
+    ]
+    for group in (GGroups.UNITS, GGroups.PLANE_SELECTION, GGroups.COORDINATE_SYSTEM):
+        if group in modes:
+            codes.append(GCode(code_number=modes[group], group=group))
+    codes.append(GCode(code_number=PositionMode.ABSOLUTE.value, group=GGroups.DISTANCE_MODE))
+    codes.append(
+        UseMachineCoord(
+            sub_codes=[Rapid(sub_codes=[Code(code_type="Z", code_number=0.0)])], comment="tool change height"
+        )
+    )
+    if state.tool is not None:
+        codes.append(ToolChange(tool_number=state.tool))
+    if state.spindle.direction != SpindleDirection.OFF:
+        codes.append(
+            MCode(
+                code_number=state.spindle.direction.value,
+                sub_codes=[Code(code_type="S", code_number=state.spindle.speed)],
+            )
+        )
+    if state.coolant:
+        codes.append(MCode(code_number=8))
+
+    if compensation != 40:
+        diameter = Code(code_type="D", code_number=t.cast(int, state.diameter_offset))
+        codes.append(GCode(code_number=compensation, group=GGroups.CUTTER_COMPENSATION, sub_codes=[diameter, *over]))
+    elif over:
+        codes.append(Rapid(sub_codes=over))
+    down = Code(code_type="Z", code_number=float(clearance))
+    length = modes.get(GGroups.TOOL_LENGTH_OFFSET, 49)
+    if length != 49 and state.length_offset is not None:
+        codes.append(
+            GCode(
+                code_number=length,
+                group=GGroups.TOOL_LENGTH_OFFSET,
+                sub_codes=[Code(code_type="H", code_number=state.length_offset), down],
+            )
+        )
+    else:
+        codes.append(Rapid(sub_codes=[down]))
+    if "Z" in state.position and state.feedrate is not None:
+        codes.append(
+            LinearFeed(
+                sub_codes=[
+                    Code(code_type="F", code_number=state.feedrate),
+                    Code(code_type="Z", code_number=state.position["Z"]),
+                ]
+            )
+        )
+
+    if modes.get(GGroups.DISTANCE_MODE) == PositionMode.INCREMENTAL.value:
+        codes.append(GCode(code_number=PositionMode.INCREMENTAL.value, group=GGroups.DISTANCE_MODE))
+    # the program's motion mode and feedrate are set last whatever moves came before, as the blocks after the restart
+    # may rely on both
+    feedrate = [] if state.feedrate is None else [Code(code_type="F", code_number=state.feedrate)]
+    motion = modes.get(GGroups.MOTION)
+    if motion is not None:
+        codes.append(GCode(code_number=motion, group=GGroups.MOTION, sub_codes=feedrate))
+    elif feedrate:
+        codes.append(feedrate[0])
+    return codes
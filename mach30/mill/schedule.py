@@ -0,0 +1,181 @@
+import itertools
+import logging
+import math
+import typing as t
+
+from pydantic import BaseModel
+
+from .builder import ProgramBuilder
+from .models import Tool
+
+logger = logging.getLogger(__name__)
+
+XY = tuple[float, float]
+
+
+class Operation(BaseModel):
+    """A unit of work cut with a single tool.
+
+    `cut` adds the operation's blocks to a builder that already has `tool` loaded. `after` names the operations that
+    have to be cut before this one, and `start` / `end` are the XY positions it starts and finishes at, which are used
+    to cut down the rapid travel between operations.
+    """
+
+    name: str
+    tool: Tool
+    cut: t.Callable[[ProgramBuilder], None]
+    after: list[str] = []
+    start: XY | None = None
+    end: XY | None = None
+
+
+class ScheduleReport(BaseModel):
+    """The order operations were cut in, and the tool changes and travel between them before and after reordering"""
+
+    order: list[str]
+    tool_changes_before: int
+    tool_changes_after: int
+    travel_before: float
+    travel_after: float
+
+    @property
+    def tool_changes_saved(self) -> int:
+        return self.tool_changes_before - self.tool_changes_after
+
+    def __str__(self) -> str:
+        return (
+            f"{len(self.order)} operations: {self.tool_changes_after} tool changes instead of "
+            f"{self.tool_changes_before} ({self.tool_changes_saved} saved), {self.travel_after:.3f} travel between "
+            f"operations instead of {self.travel_before:.3f}"
+        )
+
+
+def _tool_changes(operations: t.Sequence[Operation], tool: Tool | None) -> int:
+    changes = 0
+    for operation in operations:
+        if tool is None or operation.tool.number != tool.number:
+            changes += 1
+        tool = operation.tool
+    return changes
+
+
+def _travel(operations: t.Sequence[Operation]) -> float:
+    """XY distance from the end of every operation to the start of the next, where both are known"""
+    travel = 0.0
+    for previous, operation in itertools.pairwise(operations):
+        if previous.end is not None and operation.start is not None:
+            travel += math.dist(previous.end, operation.start)
+    return travel
+
+
+class Schedule:
+    """Operations recorded in any order, to be cut in an order that needs fewer tool changes.
+
+    Operations are only ever moved after the ones they have to follow. The scheduler keeps the loaded tool for as
+    long as there are operations ready for it, taking the closest one each time, and then switches to the tool that
+    can cut the most operations before it has to change again. The order they were added in is kept if reordering
+    doesn't do better.
+    """
+
+    def __init__(self) -> None:
+        self.operations: dict[str, Operation] = {}
+
+    def add(
+        self,
+        name: str,
+        tool: Tool,
+        cut: t.Callable[[ProgramBuilder], None],
+        after: t.Iterable[str] = (),
+        start: XY | None = None,
+        end: XY | None = None,
+    ) -> Operation:
+        assert name not in self.operations, f"there already is an operation named {name!r}"
+        operation = Operation(name=name, tool=tool, cut=cut, after=list(after), start=start, end=end)
+        for before in operation.after:
+            assert before in self.operations, f"{name!r} has to come after {before!r}, which wasn't added before it"
+        self.operations[name] = operation
+        return operation
+
+    def order(self, tool: Tool | None = None) -> tuple[list[Operation], ScheduleReport]:
+        """The operations in the order they're cut, starting with `tool` loaded"""
+        recorded = list(self.operations.values())
+        scheduled = self._schedule(tool)
+        before = (_tool_changes(recorded, tool), _travel(recorded))
+        after = (_tool_changes(scheduled, tool), _travel(scheduled))
+        if after > before:
+            scheduled, after = recorded, before
+        report = ScheduleReport(
+            order=[operation.name for operation in scheduled],
+            tool_changes_before=before[0],
+            tool_changes_after=after[0],
+            travel_before=before[1],
+            travel_after=after[1],
+        )
+        return scheduled, report
+
+    def emit(self, builder: ProgramBuilder, tool: Tool | None = None) -> ScheduleReport:
+        """Cut every operation into `builder`, changing tools only when the next operation needs another one.
+
+        `tool` is the one already loaded, if any. The returned report, with the tool changes saved, is also logged.
+        """
+        operations, report = self.order(tool)
+        for operation in operations:
+            if tool is None or tool.number != operation.tool.number:
+                builder.use_tool(operation.tool)
+                tool = operation.tool
+            operation.cut(builder)
+        logger.info("program %s: %s", builder.number, report)
+        return report
+
+    def _schedule(self, tool: Tool | None) -> list[Operation]:
+        waiting = {name: set(operation.after) for name, operation in self.operations.items()}
+        followers: dict[str, list[str]] = {name: [] for name in self.operations}
+        for name, operation in self.operations.items():
+            for before in operation.after:
+                followers[before].append(name)
+        # ready operations keep the order they were added in, so ties go to the one recorded first
+        ready = [name for name, after in waiting.items() if not after]
+        position: XY | None = None
+        scheduled: list[Operation] = []
+        while ready:
+            same_tool = [
+                name for name in ready if tool is not None and self.operations[name].tool.number == tool.number
+            ]
+            if not same_tool:
+                tool = self._next_tool(ready, waiting, followers)
+                same_tool = [name for name in ready if self.operations[name].tool.number == tool.number]
+            name = min(same_tool, key=lambda name: self._distance(position, name))
+            operation = self.operations[name]
+            scheduled.append(operation)
+            ready.remove(name)
+            position = operation.end if operation.end is not None else position
+            for follower in followers[name]:
+                waiting[follower].discard(name)
+                if not waiting[follower]:
+                    ready.append(follower)
+        return scheduled
+
+    def _next_tool(self, ready: list[str], waiting: dict[str, set[str]], followers: dict[str, list[str]]) -> Tool:
+        """The tool of the ready operations that can cut the most of them, and those they free up, in one go"""
+        tools: dict[int, Tool] = {}
+        for name in ready:
+            tools.setdefault(self.operations[name].tool.number, self.operations[name].tool)
+        return max(tools.values(), key=lambda tool: self._run_length(tool, ready, waiting, followers))
+
+    def _run_length(
+        self, tool: Tool, ready: list[str], waiting: dict[str, set[str]], followers: dict[str, list[str]]
+    ) -> int:
+        """How many operations `tool` could cut without another tool change"""
+        done: set[str] = set()
+        pending = [name for name in ready if self.operations[name].tool.number == tool.number]
+        while pending:
+            name = pending.pop()
+            done.add(name)
+            for follower in followers[name]:
+                if self.operations[follower].tool.number == tool.number and waiting[follower] <= done:
+                    pending.append(follower)
+        return len(done)
+
+    def _distance(self, position: XY | None, name: str) -> float:
+        start = self.operations[name].start
+        return 0.0 if position is None or start is None else math.dist(position, start)
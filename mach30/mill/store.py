@@ -0,0 +1,634 @@
+import io
+import typing as t
+from array import array
+from collections import deque
+from itertools import islice
+from typing import get_args
+
+from pydantic import GetCoreSchemaHandler
+from pydantic_core import core_schema
+
+from mach30.enums import GGroups, Units
+
+from . import gcode_basic
+from .formatting import DEFAULT_FORMAT, NumberFormat, format_numbers
+from .mcode import MCode
+from .models import (
+    G_CODE_GROUPS,
+    Code,
+    CodeType,
+    Comment,
+    GCode,
+    Word,
+    flatten_code,
+    render_word,
+)
+
+if t.TYPE_CHECKING:
+    import numpy as np
+
+# numpy is imported by the methods that use it rather than here, as it takes longer to import than the whole package
+# and a program that's only built and written never needs it
+
+CODE_TYPES: tuple[str, ...] = get_args(CodeType)
+TYPE_INDEX: dict[str, int] = {code_type: i for i, code_type in enumerate(CODE_TYPES)}
+_G = TYPE_INDEX["G"]
+
+_UNITS_G = {units.value for units in Units}
+# dtypes of the (types, numbers, is_int, offsets) columns
+_COLUMN_DTYPES = ("uint8", "float64", "bool", "uint64")
+
+_G_CATALOG: dict[int, type[GCode]] = {
+    cls.model_fields["code_number"].default: cls
+    for cls in vars(gcode_basic).values()
+    if isinstance(cls, type) and issubclass(cls, GCode) and cls is not GCode
+}
+
+
+def render_words(
+    words: t.Iterable[Word],
+    comment: str | None = None,
+    number_format: NumberFormat = DEFAULT_FORMAT,
+    units: Units | None = None,
+) -> str:
+    rendered = " ".join(render_word(code_type, code_number, number_format, units) for code_type, code_number in words)
+    if comment:
+        return f"{rendered} ({comment})" if rendered else f"({comment})"
+    return rendered
+
+
+def units_after(words: t.Iterable[Word], units: Units) -> Units:
+    """The units in effect after a block, given the ones in effect before it"""
+    for code_type, code_number in words:
+        if code_type == "G" and isinstance(code_number, int) and code_number in _UNITS_G:
+            units = Units(code_number)
+    return units
+
+
+def write_lines(stream: t.IO, lines: list[str]) -> None:
+    if lines:
+        write_text(stream, "\n".join(lines) + "\n")
+
+
+def write_text(stream: t.IO, text: str) -> None:
+    # file wrappers (e.g. tempfile's) aren't TextIOBase instances but do expose an encoding
+    is_text = isinstance(stream, io.TextIOBase) or hasattr(stream, "encoding")
+    stream.write(text if is_text else text.encode())
+
+
+class _ChunkPayload(t.NamedTuple):
+    """The columns of a run of blocks as raw bytes, which is all a worker process needs to render them"""
+
+    types: bytes
+    numbers: bytes
+    is_int: bytes
+    offsets: bytes
+    comments: dict[int, str]
+    number_format: NumberFormat
+    units: Units
+    first_line: int | None
+
+
+def _render_payload(payload: _ChunkPayload) -> str:
+    store = CodeStore()
+    store._types.frombytes(payload.types)
+    store._numbers.frombytes(payload.numbers)
+    store._is_int.frombytes(payload.is_int)
+    store._offsets = array("Q")
+    store._offsets.frombytes(payload.offsets)
+    store._comments = payload.comments
+    texts, _ = store._render_chunk(0, len(store), payload.number_format, payload.units)
+    if payload.first_line is not None:
+        texts = [f"N{line:03} {text}" for line, text in enumerate(texts, start=payload.first_line)]
+    return "\n".join(texts) + "\n"
+
+
+def word_to_code(code_type: str, code_number: float) -> Code:
+    if code_type == "G":
+        if isinstance(code_number, int) and code_number in _G_CATALOG:
+            return _G_CATALOG[code_number].model_construct(sub_codes=[])
+        group = G_CODE_GROUPS.get(code_number, GGroups.NONMODAL)
+        return GCode.model_construct(code_number=code_number, group=group, sub_codes=[])
+    if code_type == "M":
+        return MCode.model_construct(code_number=code_number, sub_codes=[])
+    return Code.model_construct(code_type=code_type, code_number=code_number, sub_codes=[])
+
+
+class CodeStore(t.Sequence[Code]):
+    """Columnar storage for the blocks of a program.
+
+    Every block is kept as a run of words (code type + number) in flat typed arrays, with block boundaries in a
+    separate offset array and comments in a sparse dict. Code objects are only built when a block is read back, so
+    mutating a Code returned from the store does not change the program.
+
+    Blocks can only be added (or all cleared), so the text of blocks that were already rendered is kept and reused by
+    later renders.
+    """
+
+    def __init__(self, codes: t.Iterable[Code] = ()) -> None:
+        self._types = array("B")
+        self._numbers = array("d")
+        self._is_int = array("B")
+        self._offsets = array("Q", [0])
+        self._comments: dict[int, str] = {}
+        self._text: list[str] = []
+        # the format the cached text was rendered with, and the units in effect after the last cached block
+        self._text_format = DEFAULT_FORMAT
+        self._text_units = DEFAULT_FORMAT.units
+        # running hashes of each column and of the comments, and how many words, blocks and comments they've seen
+        self._hashes: list[t.Any] = []
+        self._hashed = (0, 0, 0)
+        self.extend(codes)
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source: t.Any, handler: GetCoreSchemaHandler) -> core_schema.CoreSchema:
+        return core_schema.no_info_plain_validator_function(
+            cls._validate,
+            serialization=core_schema.plain_serializer_function_ser_schema(
+                list, return_schema=handler.generate_schema(list[Code])
+            ),
+        )
+
+    @classmethod
+    def _validate(cls, value: t.Any) -> "CodeStore":
+        if isinstance(value, cls):
+            return value
+        return cls(Code.model_validate(code) for code in value)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    @t.overload
+    def __getitem__(self, index: int) -> Code: ...
+
+    @t.overload
+    def __getitem__(self, index: slice) -> list[Code]: ...
+
+    def __getitem__(self, index: int | slice) -> Code | list[Code]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        index = self._normalize(index)
+        codes = [word_to_code(code_type, code_number) for code_type, code_number in self.words(index)]
+        if not codes:
+            if (comment := self._comments.get(index)) is None:
+                raise ValueError(f"block {index} has no words")
+            return Comment.model_construct(comment=comment)
+        base = codes[0]
+        base.sub_codes = codes[1:]
+        base.comment = self._comments.get(index)
+        return base
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, CodeStore):
+            return NotImplemented
+        import numpy as np
+
+        # compared as numpy views, since the columns may be arrays or (for a mapped store) numpy arrays
+        return (
+            all(
+                np.array_equal(np.frombuffer(mine, dtype=dtype), np.frombuffer(theirs, dtype=dtype))
+                for mine, theirs, dtype in zip(self.columns, other.columns, _COLUMN_DTYPES)
+            )
+            and self._comments == other._comments
+        )
+
+    def __repr__(self) -> str:
+        return f"CodeStore({len(self)} blocks, {len(self._types)} words)"
+
+    @property
+    def columns(self) -> tuple[array, array, array, array]:
+        """The raw (types, numbers, is_int, offsets) arrays, for vectorized passes over the whole program"""
+        return self._types, self._numbers, self._is_int, self._offsets
+
+    @property
+    def comments(self) -> t.Mapping[int, str]:
+        """The comment of every block that has one, by block index"""
+        return self._comments
+
+    def _normalize(self, index: int) -> int:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("block index out of range")
+        return index
+
+    def append(self, code: Code) -> None:
+        self.append_words(flatten_code(code), code.comment)
+
+    def extend(self, codes: t.Iterable[Code]) -> None:
+        for code in codes:
+            self.append(code)
+
+    def append_words(self, words: t.Iterable[Word], comment: str | None = None) -> None:
+        words = list(words)
+        self._types.extend([TYPE_INDEX[code_type] for code_type, _ in words])
+        self._numbers.extend([code_number for _, code_number in words])
+        self._is_int.extend([isinstance(code_number, int) for _, code_number in words])
+        if comment:
+            self._comments[len(self)] = comment
+        self._offsets.append(len(self._types))
+
+    def extend_columns(
+        self,
+        types: t.Iterable[int],
+        numbers: t.Iterable[float],
+        is_int: t.Iterable[bool],
+        ends: t.Iterable[int],
+        comments: t.Mapping[int, str] | None = None,
+    ) -> None:
+        """Bulk append of blocks that are already split into columns.
+
+        `types` index into CODE_TYPES, `ends` holds the end offset of each new block and `comments` is keyed by
+        block, both relative to the words and blocks being appended.
+        """
+        word_base, block_base = len(self._types), len(self)
+        self._types.extend(types)
+        self._numbers.extend(numbers)
+        self._is_int.extend(is_int)
+        self._offsets.extend([word_base + end for end in ends])
+        if comments:
+            self._comments.update({block_base + i: comment for i, comment in comments.items() if comment})
+
+    def clear(self) -> None:
+        del self._types[:], self._numbers[:], self._is_int[:], self._offsets[1:]
+        self._comments.clear()
+        self._text.clear()
+        self._text_units = self._text_format.units
+        self._hashes, self._hashed = [], (0, 0, 0)
+
+    def digest(self) -> str:
+        """A hash of the blocks and their comments.
+
+        The hashes are kept between calls, and as blocks are only ever added, each call only hashes the blocks added
+        since the last one.
+        """
+        # imported here as hashlib is slow to import and most programs are never hashed
+        import hashlib
+
+        types, numbers, is_int, offsets = self.columns
+        if not self._hashes:
+            self._hashes = [hashlib.blake2b(digest_size=16) for _ in range(5)]
+        words, blocks, comments = self._hashed
+        for running, column, start in zip(
+            self._hashes, (types, numbers, is_int, offsets), (words,) * 3 + (blocks + 1,)
+        ):
+            running.update(memoryview(column)[start:])
+        # comments are added in block order, so the new ones are at the end
+        for index, comment in islice(self.comments.items(), comments, None):
+            self._hashes[-1].update(f"{index}\0{comment}\0".encode())
+        self._hashed = (len(types), len(self), len(self.comments))
+
+        total = hashlib.blake2b(digest_size=16)
+        for running in self._hashes:
+            total.update(running.digest())
+        return total.hexdigest()
+
+    def words(self, index: int) -> list[Word]:
+        index = self._normalize(index)
+        words = slice(self._offsets[index], self._offsets[index + 1])
+        return [
+            (CODE_TYPES[code_type], int(number) if is_int else number)
+            for code_type, number, is_int in zip(
+                self._types[words].tolist(), self._numbers[words].tolist(), self._is_int[words].tolist()
+            )
+        ]
+
+    def comment(self, index: int) -> str | None:
+        return self._comments.get(self._normalize(index))
+
+    def blocks(self, chunk_blocks: int = 4096) -> t.Iterator[tuple[list[Word], str | None]]:
+        # words are converted a chunk of blocks at a time, which is much quicker than going word by word
+        offsets, comments = self._offsets, self._comments
+        for start in range(0, len(self), chunk_blocks):
+            stop = min(start + chunk_blocks, len(self))
+            bounds = offsets[start : stop + 1].tolist()
+            base = bounds[0]
+            words = slice(base, bounds[-1])
+            letters = [CODE_TYPES[code_type] for code_type in self._types[words].tolist()]
+            numbers = [
+                int(number) if is_int else number
+                for number, is_int in zip(self._numbers[words].tolist(), self._is_int[words].tolist())
+            ]
+            for index in range(start, stop):
+                lo, hi = bounds[index - start] - base, bounds[index + 1 - start] - base
+                yield list(zip(letters[lo:hi], numbers[lo:hi])), comments.get(index)
+
+    def render_block(self, index: int, number_format: NumberFormat = DEFAULT_FORMAT) -> str:
+        import numpy as np
+
+        index = self._normalize(index)
+        if index < len(self._text) and number_format == self._text_format:
+            return self._text[index]
+        words = self.words(index)
+        units = number_format.units
+        if index:
+            is_units = self._units_words(0, index)
+            if is_units.any():
+                units = Units(int(self._numbers[int(np.flatnonzero(is_units)[-1])]))
+        return render_words(words, self._comments.get(index), number_format, units_after(words, units))
+
+    def render_blocks(
+        self, cache: bool = True, chunk_blocks: int = 4096, number_format: NumberFormat = DEFAULT_FORMAT
+    ) -> t.Iterator[str]:
+        """The text of every block. With `cache=False` newly rendered text isn't kept, so memory stays flat."""
+        cached, units = 0, number_format.units
+        if number_format == self._text_format:
+            cached, units = len(self._text), self._text_units
+            yield from islice(self._text, cached)
+        elif cache:
+            self._text.clear()
+            self._text_format, self._text_units = number_format, units
+        for start in range(cached, len(self), chunk_blocks):
+            texts, units = self._render_chunk(start, min(start + chunk_blocks, len(self)), number_format, units)
+            if cache and len(self._text) == start and number_format == self._text_format:
+                self._text.extend(texts)
+                self._text_units = units
+            yield from texts
+
+    def render_chunks(
+        self,
+        workers: int,
+        with_line_numbers: bool = False,
+        number_format: NumberFormat = DEFAULT_FORMAT,
+        chunk_blocks: int = 65536,
+    ) -> t.Iterator[str]:
+        """The text of every block (one line each, newline included), rendered in `workers` processes.
+
+        Chunks of blocks are sent to the workers as raw column bytes and come back as one string each, in program
+        order. Rendered text is neither cached nor taken from the cache.
+        """
+        assert workers >= 1, "need at least one worker"
+        starts = list(range(0, len(self), chunk_blocks))
+        units = self._units_at(starts, number_format)
+        payloads = (
+            self._payload(start, min(start + chunk_blocks, len(self)), number_format, start_units, with_line_numbers)
+            for start, start_units in zip(starts, units)
+        )
+        if workers == 1 or len(starts) <= 1:
+            yield from map(_render_payload, payloads)
+            return
+        # imported here as the process pool machinery is slow to import and most programs never need it
+        from concurrent.futures import Future, ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # only a few chunks per worker are in flight, so memory doesn't grow with the program
+            pending: deque[Future[str]] = deque()
+            for payload in payloads:
+                pending.append(pool.submit(_render_payload, payload))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def _payload(
+        self, start: int, stop: int, number_format: NumberFormat, units: Units, with_line_numbers: bool
+    ) -> _ChunkPayload:
+        import numpy as np
+
+        base, end = int(self._offsets[start]), int(self._offsets[stop])
+        offsets = np.frombuffer(self._offsets[start : stop + 1], dtype=np.uint64) - np.uint64(base)
+        comments = {index - start: self._comments[index] for index in range(start, stop) if index in self._comments}
+        return _ChunkPayload(
+            self._types[base:end].tobytes(),
+            self._numbers[base:end].tobytes(),
+            self._is_int[base:end].tobytes(),
+            offsets.tobytes(),
+            comments,
+            number_format,
+            units,
+            start + 1 if with_line_numbers else None,
+        )
+
+    def _units_at(self, blocks: list[int], number_format: NumberFormat) -> list[Units]:
+        """The units in effect before each of `blocks`"""
+        import numpy as np
+
+        selects = np.flatnonzero(self._units_words(0, len(self)))
+        if not len(selects):
+            return [number_format.units] * len(blocks)
+        offsets = np.frombuffer(self._offsets, dtype=np.uint64).astype(np.int64)
+        selecting_blocks = np.searchsorted(offsets, selects, side="right") - 1
+        last = np.searchsorted(selecting_blocks, blocks, side="left") - 1
+        return [number_format.units if i < 0 else Units(int(self._numbers[int(selects[i])])) for i in last.tolist()]
+
+    def _units_words(self, start: int, stop: int) -> "np.ndarray":
+        """Which words of blocks [start, stop) select units"""
+        import numpy as np
+
+        words = slice(self._offsets[start], self._offsets[stop])
+        types = np.frombuffer(self._types[words], dtype=np.uint8)
+        numbers = np.frombuffer(self._numbers[words], dtype=np.float64)
+        is_int = np.frombuffer(self._is_int[words], dtype=np.bool_)
+        return (types == _G) & is_int & np.isin(numbers, list(_UNITS_G))
+
+    def _render_chunk(
+        self, start: int, stop: int, number_format: NumberFormat, units: Units
+    ) -> tuple[list[str], Units]:
+        """Text of blocks [start, stop), given the units in effect before them, and the units in effect after"""
+        import numpy as np
+
+        offsets, comments = self._offsets, self._comments
+        base = int(offsets[start])
+        words = slice(base, offsets[stop])
+        types = np.frombuffer(self._types[words], dtype=np.uint8)
+        numbers = np.frombuffer(self._numbers[words], dtype=np.float64)
+        is_int = np.frombuffer(self._is_int[words], dtype=np.bool_)
+
+        # a units code changes how every number in its block is written, so units are tracked by block
+        block_units = np.full(stop - start, units.value, dtype=np.int64)
+        is_units = self._units_words(start, stop)
+        if is_units.any():
+            lengths: np.ndarray = np.diff(np.frombuffer(offsets[start : stop + 1], dtype=np.uint64).astype(np.int64))
+            block_of_word = np.repeat(np.arange(stop - start), lengths)
+            selected = np.full(stop - start, -1, dtype=np.int64)
+            selected[block_of_word[is_units]] = numbers[is_units]
+            last = np.maximum.accumulate(np.where(selected >= 0, np.arange(stop - start), -1))
+            block_units = np.where(last >= 0, selected[np.maximum(last, 0)], units.value)
+            word_units = block_units[block_of_word]
+        else:
+            word_units = block_units[:1].repeat(len(types))
+
+        decimals = number_format.decimals_table(CODE_TYPES)[
+            (word_units == Units.MILLIMETERS.value).astype(np.int64), types
+        ]
+        text = np.empty(len(types), dtype=object)
+        floats = np.flatnonzero(~is_int)
+        text[floats] = format_numbers(numbers[floats], decimals[floats], number_format.trailing_zeros)
+        ints = np.flatnonzero(is_int)
+        text[ints] = [f"{number:02}" for number in numbers[ints].astype(np.int64).tolist()]
+        rendered = [CODE_TYPES[code_type] + number for code_type, number in zip(types.tolist(), text.tolist())]
+
+        bounds = [bound - base for bound in offsets[start : stop + 1].tolist()]
+        texts = []
+        for index in range(start, stop):
+            text_ = " ".join(rendered[bounds[index - start] : bounds[index + 1 - start]])
+            if comment := comments.get(index):
+                text_ = f"{text_} ({comment})" if text_ else f"({comment})"
+            texts.append(text_)
+        return texts, Units(int(block_units[-1])) if stop > start else units
+
+
+class CodeSink(CodeStore):
+    """Write-through stand-in for a CodeStore.
+
+    Blocks are rendered and written to the stream as soon as they are appended and only a count is kept, so a program
+    of any length is built in constant memory. The blocks can't be read back.
+    """
+
+    def __init__(
+        self,
+        stream: t.IO,
+        with_line_numbers: bool = False,
+        chunk_lines: int = 4096,
+        number_format: NumberFormat = DEFAULT_FORMAT,
+    ) -> None:
+        super().__init__()
+        self.stream = stream
+        self.number_format = number_format
+        self._units = number_format.units
+        self.with_line_numbers = with_line_numbers
+        self.chunk_lines = chunk_lines
+        self._count = 0
+        self._chunk: list[str] = []
+        self.finished = False
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index: t.Any) -> t.Any:
+        raise TypeError("blocks written to a CodeSink are not kept, so a streamed program can't be read back")
+
+    def __repr__(self) -> str:
+        return f"CodeSink({self._count} blocks written)"
+
+    def append_words(self, words: t.Iterable[Word], comment: str | None = None) -> None:
+        if self.finished:
+            raise ValueError("the program was streamed and its stream is finished; blocks can't be added to it")
+        self._count += 1
+        words = list(words)
+        self._units = units_after(words, self._units)
+        rendered = render_words(words, comment, self.number_format, self._units)
+        self._chunk.append(f"N{self._count:03} {rendered}" if self.with_line_numbers else rendered)
+        if len(self._chunk) >= self.chunk_lines:
+            self.flush()
+
+    def extend_columns(
+        self,
+        types: t.Iterable[int],
+        numbers: t.Iterable[float],
+        is_int: t.Iterable[bool],
+        ends: t.Iterable[int],
+        comments: t.Mapping[int, str] | None = None,
+    ) -> None:
+        types, numbers, is_int = list(types), list(numbers), list(is_int)
+        comments = comments or {}
+        start = 0
+        for block, end in enumerate(ends):
+            words: list[Word] = [
+                (CODE_TYPES[types[j]], int(numbers[j]) if is_int[j] else numbers[j]) for j in range(start, end)
+            ]
+            self.append_words(words, comments.get(block))
+            start = end
+
+    def flush(self) -> None:
+        write_lines(self.stream, self._chunk)
+        self._chunk.clear()
+
+    def finish(self) -> None:
+        """Write out what's left, after which no more blocks can be added. The stream itself is left open."""
+        self.flush()
+        self.finished = True
+
+    @property
+    def columns(self) -> tuple[array, array, array, array]:
+        raise TypeError("blocks written to a CodeSink are not kept, so a streamed program can't be read back")
+
+    @property
+    def comments(self) -> t.Mapping[int, str]:
+        raise TypeError("blocks written to a CodeSink are not kept, so a streamed program can't be read back")
+
+    def words(self, index: int) -> list[Word]:
+        raise TypeError("blocks written to a CodeSink are not kept, so a streamed program can't be read back")
+
+    def comment(self, index: int) -> str | None:
+        raise TypeError("blocks written to a CodeSink are not kept, so a streamed program can't be read back")
+
+    def blocks(self, chunk_blocks: int = 4096) -> t.Iterator[tuple[list[Word], str | None]]:
+        raise TypeError("blocks written to a CodeSink are not kept, so a streamed program can't be read back")
+
+    def render_blocks(
+        self, cache: bool = True, chunk_blocks: int = 4096, number_format: NumberFormat = DEFAULT_FORMAT
+    ) -> t.Iterator[str]:
+        raise TypeError("blocks written to a CodeSink are not kept, so a streamed program can't be read back")
+
+    def render_chunks(
+        self,
+        workers: int,
+        with_line_numbers: bool = False,
+        number_format: NumberFormat = DEFAULT_FORMAT,
+        chunk_blocks: int = 65536,
+    ) -> t.Iterator[str]:
+        raise TypeError("blocks written to a CodeSink are not kept, so a streamed program can't be read back")
+
+
+def _copy_column(typecode: str, view: t.Any) -> array:
+    column = array(typecode)
+    column.frombytes(view.tobytes())
+    return column
+
+
+class MappedCodeStore(CodeStore):
+    """A CodeStore whose columns are read-only numpy views, e.g. of a memory-mapped file.
+
+    Reading and rendering work straight off the views. The first change copies the columns into arrays of their own,
+    so only a store that's added to pays for the copy.
+    """
+
+    def __init__(
+        self,
+        types: "np.ndarray",
+        numbers: "np.ndarray",
+        is_int: "np.ndarray",
+        offsets: "np.ndarray",
+        comments: dict[int, str] | None = None,
+    ) -> None:
+        super().__init__()
+        assert len(offsets) and offsets[0] == 0, "offsets start at the first word"
+        assert len(types) == len(numbers) == len(is_int) == offsets[-1], "the columns don't have the same length"
+        # the views support everything the store reads its columns with
+        self._types, self._numbers, self._is_int, self._offsets = t.cast(
+            tuple[array, ...], (types, numbers, is_int, offsets)
+        )
+        self._comments = comments or {}
+        self._mapped = True
+
+    def __repr__(self) -> str:
+        return f"MappedCodeStore({len(self)} blocks, {len(self._types)} words)"
+
+    def _unmap(self) -> None:
+        if not self._mapped:
+            return
+        self._types = _copy_column("B", self._types)
+        self._numbers = _copy_column("d", self._numbers)
+        self._is_int = _copy_column("B", self._is_int)
+        self._offsets = _copy_column("Q", self._offsets)
+        self._mapped = False
+
+    def append_words(self, words: t.Iterable[Word], comment: str | None = None) -> None:
+        self._unmap()
+        super().append_words(words, comment)
+
+    def extend_columns(
+        self,
+        types: t.Iterable[int],
+        numbers: t.Iterable[float],
+        is_int: t.Iterable[bool],
+        ends: t.Iterable[int],
+        comments: t.Mapping[int, str] | None = None,
+    ) -> None:
+        self._unmap()
+        super().extend_columns(types, numbers, is_int, ends, comments)
+
+    def clear(self) -> None:
+        self._unmap()
+        super().clear()
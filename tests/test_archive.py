@@ -0,0 +1,74 @@
+import mmap
+
+import numpy as np
+import pytest
+
+from mach30.enums import CircularMotionDirection, SpindleDirection, Units
+from mach30.mill.archive import ArchiveError, load_archive, save_archive
+from mach30.mill.builder import ProgramBuilder
+from mach30.mill.formatting import NumberFormat, Precision
+from mach30.mill.models import SpindleSettings, Tool
+
+
+def _builder() -> ProgramBuilder:
+    number_format = NumberFormat(inches=Precision(decimals=3, letters={"F": 1}), trailing_zeros=True)
+    builder = ProgramBuilder(number=21, preamble_comments=["archive", "façade"], number_format=number_format)
+    tool = Tool(
+        number=4, description="end mill", spindle=SpindleSettings(direction=SpindleDirection.FORWARD, speed=5000)
+    )
+    with builder.program():
+        builder.default_config()
+        builder.use_tool(tool)
+        builder.rapid(x=0, y=0, comment="start (ü)")
+        builder.linear_feed(z=-0.1, feedrate=18)
+        builder.circular_feed(direction=CircularMotionDirection.CLOCKWISE, x=1e-05, y=2.5, r=0.25)
+        builder.set_units(Units.MILLIMETERS)
+        builder.linear_feed_many(x=np.linspace(0, 10, 50), y=np.linspace(0, 5, 50))
+        builder.zhome()
+    return builder
+
+
+def test_round_trip(tmp_path):
+    builder = _builder()
+    save_archive(builder, tmp_path / "prog.m30")
+    loaded = load_archive(tmp_path / "prog.m30")
+    assert (loaded.number, loaded.preamble_comments, loaded.tools) == (21, builder.preamble_comments, builder.tools)
+    assert loaded.number_format == builder.number_format
+    assert loaded.codes == builder.codes and dict(loaded.codes.comments) == dict(builder.codes.comments)
+    assert loaded.render(with_line_numbers=True) == builder.render(with_line_numbers=True)
+    assert loaded.render(workers=2) == builder.render()
+    assert loaded.codes[-3] == builder.codes[-3]
+
+    # the columns are views of the mapped file rather than copies
+    for column in loaded.codes.columns:
+        assert isinstance(column, np.ndarray) and not column.flags.owndata and not column.flags.writeable
+        assert isinstance(column.base, memoryview) and isinstance(column.base.obj, mmap.mmap)
+
+    # adding to a loaded program copies its blocks first, and picks up where the saved one left off
+    assert (loaded.modal.position, loaded.modal.feedrate) == (builder.modal.position, builder.modal.feedrate)
+    loaded.linear_feed(x=1.0, feedrate=18)
+    assert len(loaded.codes) == len(builder.codes) + 1
+    assert load_archive(tmp_path / "prog.m30").codes == builder.codes
+    builder.linear_feed(x=1.0, feedrate=18)
+    assert loaded.render() == builder.render()
+
+
+def test_empty_program(tmp_path):
+    save_archive(ProgramBuilder(number=1), tmp_path / "empty.m30")
+    assert load_archive(tmp_path / "empty.m30").render() == ProgramBuilder(number=1).render()
+
+
+def test_bad_archives(tmp_path):
+    path = tmp_path / "prog.m30"
+    save_archive(_builder(), path)
+    data = path.read_bytes()
+
+    path.write_bytes(b"%\nO00001\n(not an archive)\n")
+    with pytest.raises(ArchiveError, match="not a program archive"):
+        load_archive(path)
+    path.write_bytes(data[:8] + b"\x02" + data[9:])
+    with pytest.raises(ArchiveError, match="version 2"):
+        load_archive(path)
+    path.write_bytes(data[:-100])
+    with pytest.raises(ArchiveError, match="truncated"):
+        load_archive(path)
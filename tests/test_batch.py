@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+from mach30.enums import SpindleDirection
+from mach30.mill.batch import ToolLibrary, parameter_grid, run_batch
+from mach30.mill.builder import ProgramBuilder
+from mach30.mill.models import SpindleSettings, Tool
+
+TOOLS = [
+    Tool(number=1, description="end mill", spindle=SpindleSettings(direction=SpindleDirection.FORWARD, speed=3000)),
+    Tool(number=2, description="drill", spindle=SpindleSettings(direction=SpindleDirection.FORWARD, speed=1500)),
+]
+
+
+def pocket(builder: ProgramBuilder, tools: ToolLibrary, width: float, depth: float) -> None:
+    if width <= 0:
+        raise ValueError("width must be positive")
+    with builder.program():
+        builder.default_config()
+        builder.use_tool(tools[1])
+        builder.rapid(x=0.0, y=0.0, z=0.1)
+        builder.linear_feed(z=-depth, feedrate=10)
+        builder.linear_feed(x=width)
+        builder.linear_feed(y=width)
+        builder.zhome()
+
+
+def test_run_batch(tmp_path):
+    grid = parameter_grid(width=[1.0, -1.0, 2.0], depth=[0.1, 0.25])
+    assert grid[:2] == [{"width": 1.0, "depth": 0.1}, {"width": 1.0, "depth": 0.25}]
+
+    report = run_batch(pocket, grid, tmp_path / "parallel", tools=TOOLS, workers=2, first_number=100)
+    assert report.workers == 2 and len(report.results) == 6
+    assert [result.number for result in report.results] == list(range(100, 106))
+    assert [result.params for result in report.results] == grid
+    assert [result.number for result in report.failures] == [102, 103]
+    assert "width must be positive" in str(report) and "4 of 6 programs" in str(report)
+    for result in report.results:
+        assert result.worker != os.getpid() and result.build_seconds > 0
+        if result.ok:
+            expected = ProgramBuilder(number=result.number)
+            pocket(expected, ToolLibrary(TOOLS), **result.params)
+            expected.save(tmp_path / "expected.nc")
+            assert result.path.read_text() == (tmp_path / "expected.nc").read_text()
+            assert result.blocks == len(expected.codes) and result.save_seconds > 0
+        else:
+            assert not result.path.exists() and "ValueError" in str(result.error)
+
+    # streaming in the calling process writes the same files and cleans up after failures too
+    streamed = run_batch(pocket, grid, tmp_path / "streamed", tools=TOOLS, workers=1, first_number=100, stream=True)
+    assert [result.ok for result in streamed.results] == [result.ok for result in report.results]
+    assert sorted(path.name for path in (tmp_path / "streamed").iterdir()) == sorted(
+        path.name for path in (tmp_path / "parallel").iterdir()
+    )
+    for result in streamed.results:
+        assert result.worker == os.getpid()
+        if result.ok:
+            assert result.path.read_text() == (tmp_path / "parallel" / result.path.name).read_text()
+
+
+def shared_tools(builder: ProgramBuilder, tools: ToolLibrary, tool: int) -> None:
+    # a tool that was never validated reaches the worker as it was built
+    assert tools[tool].description is None
+    with builder.program():
+        builder.use_tool(tools[tool])
+
+
+def test_tools_are_not_validated_again(tmp_path):
+    unchecked = Tool.model_construct(number=3, description=None, spindle=TOOLS[0].spindle)
+    report = run_batch(
+        shared_tools, [{"tool": 3}] * 3, tmp_path, tools=TOOLS + [unchecked], workers=2, filename="{tool}-{number}.nc"
+    )
+    assert not report.failures, str(report)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["3-1.nc", "3-2.nc", "3-3.nc"]
+
+
+def missing_tool(builder: ProgramBuilder, tools: ToolLibrary, tool: int) -> None:
+    with builder.program():
+        builder.use_tool(tools[tool])
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_bugs_are_raised(tmp_path, workers):
+    # a KeyError is a bug in the generator, not a job that failed
+    with pytest.raises(KeyError):
+        run_batch(missing_tool, [{"tool": 1}, {"tool": 9}], tmp_path, tools=TOOLS, workers=workers)
@@ -0,0 +1,100 @@
+import os
+
+import pytest
+
+from mach30.enums import SpindleDirection
+from mach30.mill.archive import load_archive, save_archive
+from mach30.mill.builder import ProgramBuilder
+from mach30.mill.cache import SaveCache
+from mach30.mill.formatting import NumberFormat, Precision
+from mach30.mill.models import SpindleSettings, Tool
+
+TOOL = Tool(number=5, description="chamfer", spindle=SpindleSettings(direction=SpindleDirection.FORWARD, speed=2500))
+
+
+def _build(builder: ProgramBuilder, passes: int = 10) -> ProgramBuilder:
+    builder.default_config()
+    builder.use_tool(TOOL)
+    for i in range(passes):
+        builder.rapid(x=i * 0.5, y=0.0, comment=f"pass {i}" if i % 3 == 0 else None)
+        builder.linear_feed(z=-0.05, feedrate=12)
+        builder.linear_feed(y=1.0)
+    return builder
+
+
+def test_digest(tmp_path):
+    builder = _build(ProgramBuilder(number=3))
+    before = builder.digest()
+    assert before == _build(ProgramBuilder(number=3)).digest()
+
+    # adding blocks after hashing gives the same digest as hashing the whole program at once
+    builder.zhome()
+    expected = _build(ProgramBuilder(number=3))
+    expected.zhome()
+    assert builder.digest() == expected.digest() != before
+    save_archive(builder, tmp_path / "prog.m30")
+    assert load_archive(tmp_path / "prog.m30").digest() == builder.digest()
+
+    # and so does everything else the text is made from
+    assert _build(ProgramBuilder(number=4)).digest() != before
+    assert _build(ProgramBuilder(number=3, preamble_comments=["v2"])).digest() != before
+    other = TOOL.model_copy(update={"number": 6})
+    assert _build(ProgramBuilder(number=3, tools=[other])).digest() != before
+    number_format = NumberFormat(inches=Precision(decimals=3))
+    assert _build(ProgramBuilder(number=3, number_format=number_format)).digest() != before
+    assert _build(ProgramBuilder(number=3), passes=9).digest() != before
+
+    builder.codes.clear()
+    assert builder.digest() == ProgramBuilder(number=3, tools=[TOOL]).digest()
+
+
+def test_save_skips_unchanged_files(tmp_path, monkeypatch):
+    path, cache_path = tmp_path / "prog.nc", tmp_path / "cache.json"
+    with SaveCache(cache_path) as cache:
+        _build(ProgramBuilder(number=3)).save(path, with_line_numbers=True, cache=cache)
+    expected = path.read_text()
+    written = os.stat(path).st_mtime_ns
+
+    def write(*args, **kwargs):
+        raise AssertionError("an unchanged program was written again")
+
+    # the same program isn't rendered or written again, by a later run either
+    with monkeypatch.context() as patch:
+        patch.setattr(ProgramBuilder, "write", write)
+        cache = SaveCache(cache_path)
+        assert len(cache) == 1
+        _build(ProgramBuilder(number=3)).save(path, with_line_numbers=True, cache=cache)
+    assert os.stat(path).st_mtime_ns == written
+
+    # but a changed program, other options, or a file that was changed since are
+    _build(ProgramBuilder(number=3)).save(path, cache=cache)
+    assert path.read_text() != expected
+    _build(ProgramBuilder(number=3), passes=9).save(path, with_line_numbers=True, cache=cache)
+    assert path.read_text() != expected
+    _build(ProgramBuilder(number=3)).save(path, with_line_numbers=True, cache=cache)
+    assert path.read_text() == expected
+    path.write_text("edited")
+    _build(ProgramBuilder(number=3)).save(path, with_line_numbers=True, cache=cache)
+    assert path.read_text() == expected
+    path.unlink()
+    _build(ProgramBuilder(number=3)).save(path, with_line_numbers=True, cache=cache)
+    assert path.read_text() == expected
+
+    cache_path.write_text("not json")
+    assert len(SaveCache(cache_path)) == 0
+
+
+def test_save_is_atomic(tmp_path, monkeypatch):
+    path = tmp_path / "prog.nc"
+    _build(ProgramBuilder(number=3)).save(path)
+    expected = path.read_text()
+
+    def write(self, stream, **kwargs):
+        stream.write("%\nO00003\n")
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(ProgramBuilder, "write", write)
+    with pytest.raises(RuntimeError, match="disk full"):
+        _build(ProgramBuilder(number=3), passes=9).save(path)
+    assert path.read_text() == expected
+    assert [child.name for child in tmp_path.iterdir()] == ["prog.nc"]
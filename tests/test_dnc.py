@@ -0,0 +1,155 @@
+import asyncio
+import os
+
+import pytest
+
+from mach30.mill.builder import ProgramBuilder
+from mach30.mill.dnc import (
+    XOFF,
+    XON,
+    DripFeeder,
+    FeedMetrics,
+    FlowControl,
+    drip_feed,
+    open_serial,
+    program_lines,
+)
+
+
+class FakeController:
+    """Stands in for a controller: takes lines into a buffer of `capacity` and runs one every `step` seconds"""
+
+    def __init__(self, flow: FlowControl, capacity: int = 8, step: float = 0.001) -> None:
+        self.flow = flow
+        self.capacity = capacity
+        self.step = step
+        self.received: list[str] = []
+        self.most_buffered = 0
+        self.paused = False
+        self.sent_while_paused = 0
+        self.most_sent_while_paused = 0
+        self.done = asyncio.Event()
+
+    async def serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        buffer: asyncio.Queue[str] = asyncio.Queue()
+        runner = asyncio.create_task(self._run(buffer, writer))
+        while line := await _readline(reader):
+            self.received.append(line.decode().rstrip("\n"))
+            buffer.put_nowait(self.received[-1])
+            self.most_buffered = max(self.most_buffered, buffer.qsize())
+            if self.paused:
+                self.sent_while_paused += 1
+                self.most_sent_while_paused = max(self.most_sent_while_paused, self.sent_while_paused)
+            elif self.flow == FlowControl.XON_XOFF and buffer.qsize() >= self.capacity:
+                self.paused, self.sent_while_paused = True, 0
+                writer.write(bytes([XOFF]))
+        await buffer.join()
+        runner.cancel()
+        writer.close()
+        self.done.set()
+
+    async def _run(self, buffer: asyncio.Queue[str], writer: asyncio.StreamWriter) -> None:
+        while True:
+            await buffer.get()
+            await asyncio.sleep(self.step)
+            buffer.task_done()
+            if self.flow == FlowControl.ACK:
+                writer.write(b"ok\n")
+            elif self.paused and buffer.qsize() <= self.capacity // 2:
+                self.paused = False
+                writer.write(bytes([XON]))
+
+
+async def _readline(reader: asyncio.StreamReader) -> bytes:
+    try:
+        return await reader.readline()
+    except ConnectionResetError:
+        # the feeder hung up without reading the last XON
+        return b""
+
+
+def _program() -> ProgramBuilder:
+    builder = ProgramBuilder(number=5, preamble_comments=["drip", "feed"])
+    with builder.program():
+        for i in range(60):
+            builder.linear_feed(x=i * 0.1, y=1.0, feedrate=10)
+    return builder
+
+
+async def _feed_over_tcp(controller: FakeController, **options) -> FeedMetrics:
+    server = await asyncio.start_server(controller.serve, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    metrics = await drip_feed(_program(), reader, writer, **options)
+    writer.close()
+    await controller.done.wait()
+    server.close()
+    return metrics
+
+
+def test_ack_flow_control_over_tcp():
+    controller = FakeController(FlowControl.ACK)
+    metrics = asyncio.run(_feed_over_tcp(controller, flow=FlowControl.ACK, buffer_lines=4))
+    assert controller.received == list(program_lines(_program()))
+    assert controller.most_buffered <= 4
+    assert metrics.lines_sent == metrics.acks == metrics.last_line == len(controller.received)
+    assert metrics.ack_latency_mean is not None and 0 < metrics.ack_latency_mean <= metrics.ack_latency_max
+    assert metrics.lines_per_second > 0
+
+
+def test_xon_xoff_flow_control_and_resume_over_tcp():
+    controller = FakeController(FlowControl.XON_XOFF, capacity=8)
+    metrics = asyncio.run(_feed_over_tcp(controller, buffer_lines=1, start_line=10, with_line_numbers=True))
+    lines = list(program_lines(_program(), with_line_numbers=True))
+    assert controller.received == lines[9:]
+    assert metrics.last_line == len(lines)
+    assert metrics.bytes_sent == sum(len(line) + 1 for line in lines[9:])
+    # the feeder stops as soon as it sees an XOFF, so it only overruns by what was on its way before it got there
+    assert controller.most_sent_while_paused <= 8
+    assert metrics.paused_seconds > 0
+
+
+def test_controller_errors_stop_the_feed():
+    async def refuse(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        await reader.readline()
+        writer.write(b"error: bad block\n")
+
+    async def feed() -> DripFeeder:
+        server = await asyncio.start_server(refuse, "127.0.0.1", 0)
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.sockets[0].getsockname()[1])
+        feeder = DripFeeder(reader, writer, flow=FlowControl.ACK, buffer_lines=1)
+        with pytest.raises(RuntimeError, match="bad block"):
+            await feeder.feed(_program())
+        writer.close()
+        server.close()
+        return feeder
+
+    assert asyncio.run(feed()).metrics.last_line == 1
+
+
+def test_ack_flow_control_over_a_pty():
+    async def feed() -> tuple:
+        controller = FakeController(FlowControl.ACK)
+        primary, secondary = os.openpty()
+        loop = asyncio.get_running_loop()
+        controller_reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(controller_reader), os.fdopen(primary, "rb", buffering=0)
+        )
+        transport, protocol = await loop.connect_write_pipe(
+            asyncio.streams.FlowControlMixin, os.fdopen(os.dup(primary), "wb", buffering=0)
+        )
+        controller_writer = asyncio.StreamWriter(transport, protocol, controller_reader, loop)
+        serving = asyncio.create_task(controller.serve(controller_reader, controller_writer))
+
+        reader, writer = await open_serial(os.ttyname(secondary), baudrate=115200)
+        os.close(secondary)
+        metrics = await drip_feed(_program(), reader, writer, flow=FlowControl.ACK, buffer_lines=4)
+        writer.close()
+        serving.cancel()
+        controller_writer.close()
+        return controller, metrics
+
+    controller, metrics = asyncio.run(feed())
+    assert controller.received == list(program_lines(_program()))
+    assert metrics.acks == metrics.lines_sent
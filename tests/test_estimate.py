@@ -0,0 +1,92 @@
+import math
+
+import pytest
+
+from mach30.enums import CircularMotionDirection, Units
+from mach30.mill.builder import ProgramBuilder
+from mach30.mill.estimate import MachineSettings, SegmentKind, estimate, simulate
+from mach30.mill.parser import load_store
+
+NO_ACCEL = MachineSettings(rapid_rate=600, tool_change_time=2.0)
+
+
+def test_linear_and_rapid():
+    builder = ProgramBuilder(number=1)
+    builder.rapid(x=3.0, y=4.0)
+    builder.linear_feed(x=3.0, y=0.0, feedrate=60)
+    result = estimate(builder, NO_ACCEL)
+    assert result.rapid_length == pytest.approx(5.0)
+    assert result.feed_length == pytest.approx(4.0)
+    assert result.rapid_time == pytest.approx(0.5)
+    assert result.feed_time == pytest.approx(4.0)
+
+
+def test_arcs():
+    builder = ProgramBuilder(number=1)
+    builder.rapid(x=1.0, y=0.0)
+    builder.circular_feed(CircularMotionDirection.COUNTERCLOCKWISE, x=0.0, y=1.0, r=1.0, feedrate=60)
+    builder.circular_feed(CircularMotionDirection.COUNTERCLOCKWISE, x=-1.0, y=0.0, r=-1.0)
+    builder.circular_feed(CircularMotionDirection.CLOCKWISE, x=0.0, y=1.0, i=1.0, j=0.0)
+    builder.circular_feed(CircularMotionDirection.CLOCKWISE, i=0.0, j=-1.0, z=-1.0)
+    segments = simulate(builder, NO_ACCEL)
+    assert list(segments.kind[1:]) == [SegmentKind.ARC] * 4
+    assert segments.feed_length[1:4] == pytest.approx([math.pi / 2, 3 * math.pi / 2, math.pi / 2])
+    # a full helical turn
+    assert segments.feed_length[4] == pytest.approx(math.hypot(2 * math.pi, 1.0))
+
+
+def test_incremental_metric_and_machine_coordinates():
+    store = load_store(["G21 G91 G00 X25.4\n", "X25.4\n", "G90 X0. Z0.\n", "G20 G53 Z0.\n"])
+    # the program starts at machine zero, one inch above the work offset
+    segments = simulate(store, MachineSettings(work_offset={"Z": -1.0}))
+    assert segments.rapid_length == pytest.approx([1.0, 1.0, math.sqrt(5), 1.0])
+
+
+def test_canned_cycle_and_tools():
+    builder = ProgramBuilder(number=1)
+    builder.set_units(Units.INCHES)
+    builder.rapid(x=0.0, y=0.0, z=1.0)
+    store = load_store(
+        [
+            "M06 T02\n",
+            "G00 X0. Y0. Z1.\n",
+            "G81 F6. Z-0.5 R0.1\n",
+            "X3. Y4.\n",
+            "G80\n",
+            "M06 T03\n",
+            "G04 P500\n",
+            "G04 P1.5\n",
+        ]
+    )
+    builder.codes.extend(store)
+    result = estimate(builder, NO_ACCEL)
+    # each hole: 0.9 down and 1.5 back up at rapid, 0.6 at the feedrate
+    assert result.feed_length == pytest.approx(1.2)
+    assert result.rapid_length == pytest.approx(1.0 + 2 * 2.4 + 5.0)
+    assert result.dwell_time == pytest.approx(2.0)
+    assert result.tool_change_time == pytest.approx(4.0)
+    assert sorted(result.by_tool) == [0, 2, 3]
+    assert result.by_tool[2].feed_length == pytest.approx(1.2)
+    assert [(op.tool, op.first_block) for op in result.by_operation] == [(0, 0), (2, 2), (3, 7)]
+    assert sum(op.time for op in result.by_operation) == pytest.approx(result.time)
+
+
+def test_tool_change_with_a_move():
+    # the second tool change is on the same block as a rapid, and still starts an operation
+    store = load_store(["M06 T01\n", "G00 X6.\n", "M06 T02 G00 X0.\n", "G01 F60. X1.\n"])
+    result = estimate(store, NO_ACCEL)
+    assert [(op.tool, op.first_block) for op in result.by_operation] == [(1, 0), (2, 2)]
+    assert result.by_tool[2].time == pytest.approx(2.0 + 0.6 + 1.0)
+    assert result.tool_change_time == pytest.approx(4.0)
+    assert result.rapid_time == pytest.approx(1.2)
+    assert result.time == pytest.approx(result.tool_change_time + result.rapid_time + result.feed_time)
+
+
+def test_acceleration():
+    builder = ProgramBuilder(number=1)
+    builder.linear_feed(x=10.0, feedrate=60)
+    builder.linear_feed(x=10.001)
+    segments = simulate(builder, MachineSettings(acceleration=1.0))
+    # 10 at 1/s takes 10s plus 1s lost to speeding up and slowing down; the short move never reaches the feedrate
+    assert segments.time[0] == pytest.approx(11.0)
+    assert segments.time[1] == pytest.approx(2 * math.sqrt(0.001))
@@ -0,0 +1,70 @@
+import io
+import math
+
+import numpy as np
+
+from mach30.enums import Units
+from mach30.mill.builder import ProgramBuilder
+from mach30.mill.formatting import (
+    NumberFormat,
+    Precision,
+    format_number,
+    format_numbers,
+)
+
+
+def _builder(number_format: NumberFormat | None = None) -> ProgramBuilder:
+    builder = ProgramBuilder(number=1, number_format=number_format or NumberFormat())
+    builder.linear_feed(x=0.1 + 0.2, y=-1e-9, feedrate=12.5)
+    builder.set_units(Units.MILLIMETERS)
+    builder.linear_feed(x=25.4 / 3, y=-0.0625)
+    builder.set_units(Units.INCHES)
+    builder.rapid(x=1 / 3, z=2)
+    return builder
+
+
+def test_numbers_follow_units():
+    builder = _builder()
+    assert builder._render_codes().splitlines() == [
+        "G01 F12.5 X0.3 Y0.0",
+        "G21 (use MILLIMETERS)",
+        "G01 F12.5 X8.467 Y-0.062",
+        "G20 (use INCHES)",
+        "G00 X0.3333 Z2.0",
+    ]
+    # single blocks and streamed programs are written the same way
+    assert builder.codes.render_block(2) == "G01 F12.5 X8.467 Y-0.062"
+    stream = io.StringIO()
+    streamed = ProgramBuilder(number=1)
+    with streamed.stream_to(stream):
+        streamed.codes.extend(builder.codes)
+    assert builder.render() + "\n" == stream.getvalue()
+
+
+def test_configured_precision():
+    number_format = NumberFormat(
+        inches=Precision(decimals=4, letters={"F": 1}),
+        millimeters=Precision(decimals=2),
+        units=Units.MILLIMETERS,
+        trailing_zeros=True,
+    )
+    builder = _builder(number_format)
+    assert builder._render_codes().splitlines()[::2] == [
+        "G01 F12.50 X0.30 Y0.00",
+        "G01 F12.50 X8.47 Y-0.06",
+        "G00 X0.3333 Z2.0000",
+    ]
+    # rendering with a different format doesn't reuse the cached text
+    assert builder.codes.render_block(0) == "G01 F12.5 X0.3 Y0.0"
+    assert next(builder.codes.render_blocks()) == "G01 F12.5 X0.3 Y0.0"
+
+
+def test_batch_matches_single():
+    values = [0.0, -0.0, 1.0, -1.23456, 0.99999, 1e-5, 1e20, math.inf, math.nan, 123456.5]
+    for decimals in (0, 3, 4, 7):
+        for trailing_zeros in (False, True):
+            expected = [format_number(value, decimals, trailing_zeros) for value in values]
+            assert format_numbers(values, decimals, trailing_zeros) == expected
+    assert format_numbers(values[:4], [0, 1, 2, 3]) == ["0.0", "0.0", "1.0", "-1.235"]
+    numbers = np.random.default_rng(3).uniform(-100, 100, 1000)
+    assert [float(text) for text in format_numbers(numbers, 4)] == np.round(numbers, 4).tolist()
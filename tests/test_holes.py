@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from mach30.mill.builder import ProgramBuilder
+from mach30.mill.gcode import DrillCycle
+from mach30.mill.holes import order_holes, path_length
+
+
+def test_order_holes_cuts_travel():
+    rng = np.random.default_rng(3)
+    points = rng.random((500, 2)) * 10
+    report = order_holes(points, start=(0.0, 0.0))
+    assert sorted(report.order) == list(range(500))
+    assert report.travel_before == pytest.approx(path_length(points, np.zeros(2)))
+    assert report.travel_after == pytest.approx(path_length(points[report.order], np.zeros(2)))
+    assert report.travel_after < report.travel_before / 5
+
+
+def test_start_is_pinned():
+    # a row of holes given back to front: the tour has to begin at the end closest to the start
+    points = [(float(x), 0.0) for x in range(10, 0, -1)]
+    report = order_holes(points, start=(0.0, 0.0))
+    assert report.order == list(range(9, -1, -1))
+    assert report.travel_after == pytest.approx(10.0)
+    assert report.travel_before == pytest.approx(19.0)
+
+
+def test_move_many():
+    builder = ProgramBuilder(number=1)
+    with DrillCycle(builder=builder, f=15, z=-0.35, r=0.1) as drill:
+        report = drill.move_many([(2.0, 0.0), (0.0, 1.0), (1.0, 0.0)], optimize=True, start=(0.0, 0.0))
+    assert report.order == [1, 2, 0]
+    assert builder._render_codes().split("\n")[1:-1] == ["X0.0 Y1.0", "X1.0 Y0.0", "X2.0 Y0.0"]
+
+    builder = ProgramBuilder(number=1)
+    with DrillCycle(builder=builder, f=15, z=-0.35) as drill:
+        report = drill.move_many(np.array([[2.0, 0.0, -0.5], [0.0, 0.0, -0.25]]))
+    assert report.travel_before == report.travel_after == pytest.approx(2.0)
+    assert builder._render_codes().split("\n")[1:-1] == ["X2.0 Y0.0 Z-0.5", "X0.0 Y0.0 Z-0.25"]
+
+    # without a start, the tour begins where the spindle is
+    builder = ProgramBuilder(number=1)
+    builder.rapid(x=3.0, y=0.0)
+    with DrillCycle(builder=builder, f=15, z=-0.35) as drill:
+        report = drill.move_many([(0.0, 0.0), (2.0, 0.0), (1.0, 0.0)], optimize=True)
+    assert report.order == [1, 2, 0]
+    assert report.travel_before == pytest.approx(6.0) and report.travel_after == pytest.approx(3.0)
+
+
+def test_move_many_checks_the_points():
+    builder = ProgramBuilder(number=1)
+    with DrillCycle(builder=builder, f=15, z=-0.35) as drill:
+        for points in ([1.0, 2.0], np.zeros((2, 4)), [[1.0]]):
+            with pytest.raises(ValueError, match="points must be"):
+                drill.move_many(points)
+        for points in ([], np.zeros((0, 2))):
+            report = drill.move_many(points, optimize=True)
+            assert report.order == [] and report.travel_before == report.travel_after == 0.0
+    assert len(builder.codes) == 2
@@ -9,7 +9,7 @@ T1_FEED = 7.0
 RADIUS = 0.375 + 0.25
 
 
-def test_build_homework():
+def test_build_homework(tmp_path):
 
     tool_4 = Tool(
         number=4,
@@ -68,5 +68,5 @@ def test_build_homework():
             builder.rapid(x=0, y=0)
         # exiting context manager should turn the spindle off and end the program
 
-    builder.save("generated_programs/prog6_readable.nc", with_line_numbers=False)
-    builder.save("generated_programs/eric_hennenfent_program6.nc", with_line_numbers=True)
+    builder.save(tmp_path / "prog6_readable.nc", with_line_numbers=False)
+    builder.save(tmp_path / "eric_hennenfent_program6.nc", with_line_numbers=True)
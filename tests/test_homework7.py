@@ -5,7 +5,7 @@ from mach30.mill.models import SpindleDirection, SpindleSettings, Tool
 T4_FEED = 18.0
 
 
-def test_build_homework():
+def test_build_homework(tmp_path):
 
     tool_4 = Tool(
         number=4,
@@ -41,5 +41,5 @@ def test_build_homework():
             builder.rapid(z=0)
             builder.rapid(x=0, y=0)
 
-    builder.save("generated_programs/prog7_readable.nc", with_line_numbers=False)
-    builder.save("generated_programs/eric_hennenfent_program7.nc", with_line_numbers=True)
+    builder.save(tmp_path / "prog7_readable.nc", with_line_numbers=False)
+    builder.save(tmp_path / "eric_hennenfent_program7.nc", with_line_numbers=True)
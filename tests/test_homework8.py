@@ -5,7 +5,7 @@ from mach30.mill.models import SpindleDirection, SpindleSettings, Tool
 T4_FEED = 18.0
 
 
-def test_build_homework():
+def test_build_homework(tmp_path):
 
     tool_4 = Tool(
         number=4,
@@ -62,5 +62,5 @@ def test_build_homework():
         with builder.use_global():
             builder.rapid(x=0, y=0)
 
-    builder.save("generated_programs/prog8_readable.nc", with_line_numbers=False)
-    builder.save("generated_programs/eric_hennenfent_program8.nc", with_line_numbers=True)
+    builder.save(tmp_path / "prog8_readable.nc", with_line_numbers=False)
+    builder.save(tmp_path / "eric_hennenfent_program8.nc", with_line_numbers=True)
@@ -0,0 +1,69 @@
+import io
+
+from mach30.enums import CircularMotionDirection
+from mach30.mill.builder import ProgramBuilder
+
+
+def test_instrument_counts_and_times():
+    builder = ProgramBuilder(number=1)
+    builder.rapid(x=5.0)
+    with builder.instrument() as stats:
+        with builder.program():
+            builder.default_config()
+            builder.rapid(x=0.0, y=0.0)
+            builder.linear_feed(x=1.0, feedrate=10)
+            builder.linear_feed(x=2.0, y=1.0)
+            builder.linear_feed_many(10, x=[3.0, 4.0, 5.0])
+            builder.circular_feed(CircularMotionDirection.CLOCKWISE, x=0.0, y=0.0, r=2.0)
+            builder.zhome()
+        builder.render()
+    assert type(builder) is ProgramBuilder and builder.stats is None
+
+    assert stats.groups == {
+        "CANNED_CYCLE": 1,
+        "CUTTER_COMPENSATION": 1,
+        "TOOL_LENGTH_OFFSET": 1,
+        "PLANE_SELECTION": 1,
+        "UNITS": 1,
+        "DISTANCE_MODE": 1,
+        "MOTION": 4,
+    }
+    # the X from before instrumenting isn't counted
+    assert stats.words["X"] == 7 and stats.words["G"] == 11 and stats.words["M"] == 2 and stats.words["R"] == 1
+    # program() adds its blocks in one call at either end, and the moves that set the motion mode add a code each
+    assert stats.calls == {"render": 1, "add_columns": 1, "move_many": 1, "move": 6, "add": 9}
+    assert all(stats.nanoseconds[timer] > 0 for timer in stats.calls)
+
+    exported = stats.to_dict()
+    assert exported["timers"]["render"]["calls"] == 1 and exported["words"]["Y"] == 3
+    prometheus = stats.to_prometheus()
+    assert "# TYPE mach30_builder_seconds_total counter\n" in prometheus
+    assert 'mach30_builder_modal_codes_total{group="MOTION"} 4\n' in prometheus
+    assert 'mach30_builder_calls_total{timer="render"} 1\n' in prometheus
+
+
+def test_detailed_instrumentation_keeps_accumulating(tmp_path):
+    builder = ProgramBuilder(number=1)
+    with builder.instrument(detailed=True) as stats:
+        for i in range(10):
+            builder.linear_feed(x=float(i), feedrate=10)
+            builder.rapid(y=float(i))
+    assert type(builder) is ProgramBuilder and builder.stats is None
+    assert stats.calls["move"] == stats.calls["should_update_motion"] == 20
+    assert stats.calls["build_codes"] == stats.calls["add"] == 20
+    assert stats.to_dict()["timers"]["move"] == {"calls": 20, "seconds": stats.nanoseconds["move"] / 1e9}
+    moves = stats.nanoseconds["move"]
+
+    with builder.instrument(stats):
+        builder.write(io.StringIO())
+        builder.linear_feed(x=1.0)
+    assert stats.calls["write"] == 1 and stats.calls["move"] == 21 and stats.nanoseconds["move"] > moves
+    # only a detailed context times the parts of a move
+    assert stats.calls["should_update_motion"] == 20
+    # every block changes the motion mode
+    assert stats.groups["MOTION"] == len(builder.codes)
+
+    stats.write_prometheus(tmp_path / "builder.prom")
+    assert (tmp_path / "builder.prom").read_text() == stats.to_prometheus()
+    assert 'mach30_builder_calls_total{timer="build_codes"} 20\n' in stats.to_prometheus()
+    assert [path.name for path in tmp_path.iterdir()] == ["builder.prom"]
@@ -0,0 +1,56 @@
+import io
+
+import numpy as np
+
+from mach30.enums import CircularMotionDirection
+from mach30.mill.builder import ProgramBuilder
+
+NAN = float("nan")
+
+
+def _optional(value: float) -> float | None:
+    return None if np.isnan(value) else float(value)
+
+
+def test_linear_feed_many_matches_loop():
+    xs = np.array([0.0, 0.5, 1.0, NAN, 2.0, 2.5])
+    ys = np.array([1.0, NAN, 1.0, 1.5, 0.25, 0.1 + 0.2])
+    feedrates = np.array([10.0, 10.0, 20.0, 20.0, 20.0, 10.0])
+
+    expected = ProgramBuilder(number=1)
+    expected.rapid(x=0.0, y=0.0)
+    for x, y, feedrate in zip(xs, ys, feedrates):
+        expected.linear_feed(feedrate=feedrate, x=_optional(x), y=_optional(y))
+    expected.linear_feed(x=3.0)
+
+    builder = ProgramBuilder(number=1)
+    builder.rapid(x=0.0, y=0.0)
+    builder.linear_feed_many(feedrate=feedrates, x=xs, y=ys)
+    builder.linear_feed(x=3.0)
+    assert builder.render() == expected.render()
+
+
+def test_rapid_and_circular_many():
+    zs = [1.0, 2.0, 3.0]
+    expected = ProgramBuilder(number=1)
+    expected.linear_feed(feedrate=5, x=1.0)
+    with expected.use_global():
+        for z in zs:
+            expected.rapid(z=z)
+    for x in zs:
+        expected.circular_feed(CircularMotionDirection.CLOCKWISE, x=x, r=0.5)
+
+    builder = ProgramBuilder(number=1)
+    builder.linear_feed(feedrate=5, x=1.0)
+    with builder.use_global():
+        builder.rapid_many(z=zs)
+    builder.circular_feed_many(CircularMotionDirection.CLOCKWISE, x=zs, r=0.5)
+    assert builder.render() == expected.render()
+
+
+def test_many_into_stream():
+    stream = io.StringIO()
+    builder = ProgramBuilder(number=1)
+    with builder.stream_to(stream):
+        builder.linear_feed_many(feedrate=4, x=np.arange(3.0), y=np.arange(3.0))
+    assert "G01 F4.0 X0.0 Y0.0\nX1.0 Y1.0\nX2.0 Y2.0\n" in stream.getvalue()
@@ -0,0 +1,77 @@
+import warnings
+
+from mach30.enums import GGroups, PositionMode, SpindleDirection
+from mach30.mill.builder import ProgramBuilder
+from mach30.mill.gcode import DrillCycle
+from mach30.mill.gcode_basic import UseInches
+from mach30.mill.models import SpindleSettings, freeze
+
+
+def test_modal_state_tracks_codes_and_position():
+    builder = ProgramBuilder(number=1)
+    builder.default_config()
+    builder.rapid(x=1.0, y=2.0, z=1.0)
+    builder.linear_feed(x=3.0, feedrate=12)
+    modal = builder.modal
+    assert builder.current_mode == GGroups.MOTION
+    assert builder.current_mode_op is modal.codes[GGroups.MOTION]
+    assert modal.codes[GGroups.UNITS].code_number == 20
+    assert (modal.position, modal.feedrate) == ({"X": 3.0, "Y": 2.0, "Z": 1.0}, 12.0)
+
+    snapshot = modal.snapshot()
+    builder.set_position_mode(PositionMode.INCREMENTAL)
+    builder.linear_feed(x=0.5, y=-1.0)
+    builder.linear_feed_many(x=[0.25, 0.25], z=[-0.5, float("nan")])
+    assert modal.position == {"X": 4.0, "Y": 1.0, "Z": 0.5}
+    # machine coordinates aren't positions in the work coordinates
+    builder.zhome()
+    assert modal.position == {"X": 4.0, "Y": 1.0}
+    assert not modal.machine_coordinates
+    assert snapshot.position == {"X": 3.0, "Y": 2.0, "Z": 1.0}
+    assert snapshot.codes[GGroups.DISTANCE_MODE].code_number == 90
+
+
+def test_modal_state_canned_cycles_and_spindle():
+    builder = ProgramBuilder(number=1)
+    builder.rapid(x=0.0, y=0.0, z=1.0)
+    with DrillCycle(builder=builder, f=15, z=-0.35, r=0.1) as drill:
+        drill.move(x=1.0, y=1.0)
+        drill.move_many([(2.0, 1.0, -0.5)])
+        assert builder.modal.canned
+    assert not builder.modal.canned
+    assert builder.modal.position == {"X": 2.0, "Y": 1.0}
+
+    slow = SpindleSettings(direction=SpindleDirection.FORWARD, speed=500)
+    with builder.override_spindle(slow):
+        assert builder.modal.spindle == slow
+    assert builder.modal.spindle.direction == SpindleDirection.OFF
+
+
+def test_modal_state_is_dumped_with_the_builder():
+    builder = ProgramBuilder(number=2)
+    builder.default_config()
+    builder.rapid(x=1)
+    builder.linear_feed(y=2.0, feedrate=5)
+    dumped = builder.model_dump_json()
+
+    loaded = ProgramBuilder.model_validate_json(dumped)
+    assert loaded.render() == builder.render()
+    assert loaded.modal.codes[GGroups.MOTION].group == GGroups.MOTION
+    assert (loaded.modal.position, loaded.modal.feedrate) == ({"X": 1, "Y": 2.0}, 5.0)
+    assert loaded.modal.last_group == GGroups.MOTION
+    # so it carries on where the dumped builder left off
+    loaded.linear_feed(y=3.0)
+    assert loaded.render().splitlines()[-2] == "Y3.0"
+
+
+def test_frozen_codes_are_dumped_as_declared():
+    # like the codes the builder adds itself, e.g. the ones that start and end a program
+    code = freeze(UseInches())
+    builder = ProgramBuilder(number=3)
+    builder.add(code)
+    assert builder.modal.current_code is code
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        dumped = builder.model_dump_json()
+    loaded = ProgramBuilder.model_validate_json(dumped).modal.current_code
+    assert loaded is not None and loaded.render() == code.render()
@@ -0,0 +1,392 @@
+import random
+from pathlib import Path
+
+import numpy as np
+import pytest
+import test_homework6
+import test_homework7
+
+from mach30.enums import GGroups, MotionPlane, SpindleDirection
+from mach30.mill.builder import ProgramBuilder
+from mach30.mill.estimate import estimate
+from mach30.mill.models import SpindleSettings, Tool
+from mach30.mill.optimize import (
+    POWER_ON_MODES,
+    extract_subprograms,
+    fit_arcs,
+    remove_redundant_axes,
+    remove_redundant_modes,
+    simplify_lines,
+)
+from mach30.mill.parser import load_program, load_store
+from mach30.mill.store import CodeStore
+
+HOMEWORK = {"eric_hennenfent_program6.nc": test_homework6, "eric_hennenfent_program7.nc": test_homework7}
+
+
+def _homework_program(directory: Path, name: str) -> Path:
+    """Build one of the homework programs into `directory`, as its own test does"""
+    HOMEWORK[name].test_build_homework(directory)
+    return directory / name
+
+
+def _optimized(lines: list[str]) -> list[str]:
+    return list(remove_redundant_axes(load_store(line + "\n" for line in lines)).render_blocks())
+
+
+def _assert_equivalent(store: CodeStore, optimize=remove_redundant_axes) -> None:
+    before, after = estimate(store), estimate(optimize(store))
+    fields = ["time", "rapid_length", "feed_length"]
+    assert after.model_dump(include=set(fields)) == pytest.approx(before.model_dump(include=set(fields)))
+    assert after.by_tool.keys() == before.by_tool.keys()
+    for tool, totals in before.by_tool.items():
+        assert after.by_tool[tool].model_dump() == pytest.approx(totals.model_dump())
+
+
+def test_drops_unchanged_axes():
+    builder = ProgramBuilder(number=1)
+    builder.rapid(z=1.0)
+    builder.rapid(x=1.0, y=2.0)
+    builder.rapid(x=1.0, y=4.0, z=1.0, comment="y only")
+    builder.linear_feed(x=1.0, y=4.0, feedrate=10)
+    builder.linear_feed(x=1.0, y=4.0)
+    assert list(remove_redundant_axes(builder.codes).render_blocks()) == [
+        "G00 Z1.0",
+        "X1.0 Y2.0",
+        "Y4.0 (y only)",
+        "G01 F10.0",
+    ]
+
+
+def test_incremental_and_machine_coordinates():
+    assert _optimized(["G90 X1. Y1.", "G91 X0. Y1.", "X1. Y0.", "G90 X2. Y2.", "G53 Z0.", "G53 Z0.", "X2."]) == [
+        "G90 X1.0 Y1.0",
+        "G91 Y1.0",
+        "X1.0",
+        "G90",
+        "G53 Z0.0",
+        "G53 Z0.0",
+    ]
+
+
+def test_keeps_canned_cycles_and_arcs():
+    lines = ["G00 X0. Y0. Z1.", "G81 F5. Z-0.5 R0.1", "X0. Y0.", "X1. Y0.", "G80", "G00 X1. Y0. Z1.", "G02 X1. Y0. I1."]
+    assert _optimized(lines) == [
+        "G00 X0.0 Y0.0 Z1.0",
+        "G81 F5.0 Z-0.5 R0.1",
+        "X0.0 Y0.0",
+        "X1.0 Y0.0",
+        "G80",
+        "G00 Z1.0",
+        "G02 X1.0 Y0.0 I1.0",
+    ]
+
+
+def test_position_is_forgotten_after_tool_change():
+    assert _optimized(["G00 Z1.", "M06 T02", "Z1."]) == ["G00 Z1.0", "M06 T02", "Z1.0"]
+
+
+@pytest.mark.parametrize("name", HOMEWORK)
+def test_homework_programs_are_equivalent(tmp_path, name):
+    _assert_equivalent(load_program(_homework_program(tmp_path, name)).codes)
+
+
+def test_random_programs_are_equivalent():
+    rng = random.Random(7)
+    values = [0.0, 0.5, 1.0, -1.0]
+    for _ in range(50):
+        lines = ["G90 G01 F20.", "M06 T01"]
+        for _ in range(60):
+            roll = rng.random()
+            if roll < 0.05:
+                lines.append(rng.choice(["G90", "G91", "G53 Z0.", "M06 T02", "G00", "G01"]))
+            elif roll < 0.08:
+                lines.extend(["G90 G00 Z1.", "G81 F5. Z-0.5 R0.1", "X0. Y0.", "X0. Y0.", "G80"])
+            else:
+                axes = rng.sample("XYZ", rng.randint(1, 3))
+                lines.append(" ".join(f"{axis}{rng.choice(values)}" for axis in axes))
+        store = load_store(line + "\n" for line in lines)
+        _assert_equivalent(store)
+        assert len(list(remove_redundant_axes(store).render_blocks())) <= len(store)
+
+
+def _without_modes(lines: list[str], **kwargs) -> list[str]:
+    return list(remove_redundant_modes(load_store(line + "\n" for line in lines), **kwargs).render_blocks())
+
+
+def test_drops_redundant_modes():
+    lines = ["G80", "G40", "G49", "G17", "G20", "G90", "G17 (again)", "G00 X0. Y0.", "G00 X1.", "G90 G01 F10. X2."]
+    lines += ["G43 H01 Z0.1", "G43 H01 Z0.2", "G43 H02 Z0.3", "G41 D02 X1.", "G41 D02 X2.", "G49 Z1.", "G49", "G40"]
+    lines += ["M03 S3000", "M03 S3000", "M03 S4000", "M03", "M05", "S5000", "M05 (stop)", "M03 S5000"]
+    lines += ["M06 T02", "M03 S5000", "M30", "G90"]
+    assert _without_modes(lines) == [
+        "G80",
+        "G40",
+        "G49",
+        "G17",
+        "G20",
+        "G90",
+        "G00 X0.0 Y0.0",
+        "X1.0",
+        "G01 F10.0 X2.0",
+        "G43 H01 Z0.1",
+        "Z0.2",
+        "G43 H02 Z0.3",
+        "G41 D02 X1.0",
+        "X2.0",
+        "G49 Z1.0",
+        "G40",
+        "M03 S3000",
+        "M03 S4000",
+        "M05",
+        "S5000",
+        "M03 S5000",
+        "M06 T02",
+        "M03 S5000",
+        "M30",
+        "G90",
+    ]
+
+
+def test_modes_around_canned_cycles_and_program_start():
+    lines = ["G80", "G00 X0.", "G81 Z-1. R0.1 F5.", "X1.", "G80", "G00 X2.", "G00 X3.", "G81 Z-1. R0.1 F5.", "G00 X4."]
+    assert _without_modes(lines) == [
+        "G80",
+        "G00 X0.0",
+        "G81 Z-1.0 R0.1 F5.0",
+        "X1.0",
+        "G80",
+        "G00 X2.0",
+        "X3.0",
+        "G81 Z-1.0 R0.1 F5.0",
+        "G00 X4.0",
+    ]
+
+    # the safety cancels a program opens with stay unless asked otherwise, even when they're the power on modes
+    lines = ["G80", "G40", "G49", "G17", "G90", "G00 Z1.", "G49", "G80"]
+    assert _without_modes(lines, initial=POWER_ON_MODES) == ["G80", "G40", "G49", "Z1.0"]
+    assert _without_modes(lines, initial=POWER_ON_MODES, keep_opening=()) == ["Z1.0"]
+    assert _without_modes(lines, initial={GGroups.PLANE_SELECTION: 18}) == lines[:3] + ["G17", "G90", "G00 Z1.0"]
+
+
+@pytest.mark.parametrize("name", HOMEWORK)
+def test_homework_programs_keep_their_modes(tmp_path, name):
+    store = load_program(_homework_program(tmp_path, name)).codes
+    _assert_equivalent(store, remove_redundant_modes)
+    # a second pass finds nothing left to drop
+    optimized = remove_redundant_modes(store)
+    assert remove_redundant_modes(optimized) == optimized
+
+
+def test_nested_compensation_modes():
+    tool = Tool(
+        number=1, description="end mill", spindle=SpindleSettings(direction=SpindleDirection.FORWARD, speed=3000)
+    )
+    builder = ProgramBuilder(number=1)
+    with builder.program():
+        builder.default_config()
+        builder.use_tool(tool)
+        with builder.compensate(tool, {"x": 1.0, "z": 0.1}, {"x": 1.0, "y": 0.0, "z": 1.0}):
+            builder.linear_feed(z=-0.1, feedrate=10)
+            with builder.compensate(tool, {"x": 1.0, "z": 0.1}, {"x": 1.0, "y": 0.0, "z": 1.0}):
+                builder.linear_feed(x=-1.0)
+            builder.linear_feed(x=0.5)
+    optimized = list(remove_redundant_modes(builder.codes).render_blocks())
+    assert optimized[9:] == [
+        "G43 H01 Z0.1",
+        "G41 D01 X1.0",
+        "G01 F10.0 Z-0.1",
+        "Z0.1",
+        "X1.0",
+        "F10.0 X-1.0",
+        "G49 Z1.0",
+        "G40 X1.0 Y0.0",
+        "F10.0 X0.5",
+        "Z1.0",
+        "X1.0 Y0.0",
+        "M05 (turn off spindle)",
+        "M30 (end program)",
+    ]
+    assert list(builder.codes.render_blocks())[:9] == optimized[:9]
+    _assert_equivalent(builder.codes, remove_redundant_modes)
+
+
+def _semicircle(builder: ProgramBuilder, points: int = 100, **kwargs) -> None:
+    angles = np.linspace(0, np.pi, points)
+    builder.rapid(x=1.0, y=0.0, z=0.0)
+    builder.linear_feed_many(feedrate=10, x=np.cos(angles), y=np.sin(angles), **kwargs)
+
+
+def test_fit_arcs_collapses_a_semicircle():
+    builder = ProgramBuilder(number=1)
+    _semicircle(builder)
+    builder.linear_feed(x=-2.0, y=0.0)
+    blocks = [fit_arcs(builder.codes, use_radius=use_radius).words(i) for use_radius in (False, True) for i in (2, 3)]
+    ijk, line, radius, _ = blocks
+    assert [word[0] for word in ijk] == ["G", "F", "X", "Y", "I", "J"]
+    assert ijk[:3] == [("G", 3), ("F", 10.0), ("X", -1.0)]
+    assert ijk[4:] == [("I", pytest.approx(-1.0)), ("J", pytest.approx(0.0, abs=1e-9))]
+    assert radius[-1] == ("R", pytest.approx(1.0))
+    # the line after the arc needs its motion code back
+    assert line == [("G", 1), ("F", 10.0), ("X", -2.0), ("Y", 0.0)]
+
+    before, after = estimate(builder.codes), estimate(fit_arcs(builder.codes))
+    assert after.feed_length == pytest.approx(before.feed_length, abs=0.001)
+
+
+def test_fit_arcs_keeps_comments_and_feedrate_changes():
+    builder = ProgramBuilder(number=1)
+    angles = np.linspace(0, 1.5 * np.pi, 150)
+    builder.rapid(x=1.0, y=0.0, z=0.0)
+    builder.linear_feed_many(feedrate=10, x=np.cos(angles[:100]), y=np.sin(angles[:100]))
+    builder.linear_feed(x=np.cos(angles[100]), y=np.sin(angles[100]), comment="halfway")
+    builder.linear_feed_many(feedrate=20, x=np.cos(angles[101:]), y=np.sin(angles[101:]))
+    fitted = fit_arcs(builder.codes, use_radius=True)
+    rendered = list(fitted.render_blocks())
+    assert len(rendered) == 4
+    assert rendered[2].startswith("G03 F10.0") and rendered[2].endswith("(halfway)")
+    assert rendered[3].startswith("G03 F20.0")
+    assert fitted.words(3)[-2:] == [("Y", -1.0), ("R", pytest.approx(1.0))]
+
+    # more than half a turn needs a negative R
+    builder = ProgramBuilder(number=1)
+    builder.rapid(x=1.0, y=0.0, z=0.0)
+    builder.linear_feed_many(feedrate=10, x=np.cos(angles), y=-np.sin(angles))
+    assert fit_arcs(builder.codes, use_radius=True).words(2)[0] == ("G", 2)
+    assert fit_arcs(builder.codes, use_radius=True).words(2)[-1] == ("R", pytest.approx(-1.0))
+
+
+def test_fit_arcs_honors_the_plane():
+    builder = ProgramBuilder(number=1)
+    builder.set_plane(MotionPlane.XZ)
+    angles = np.linspace(0, np.pi / 2, 50)
+    builder.rapid(x=1.0, y=0.0, z=0.0)
+    builder.linear_feed_many(feedrate=10, x=np.cos(angles), z=np.sin(angles))
+    words = fit_arcs(builder.codes).words(3)
+    # G18 turns from Z to X, so going from X to Z is clockwise
+    assert [word[0] for word in words] == ["G", "F", "X", "Z", "I", "K"]
+    assert words[0] == ("G", 2)
+
+
+def test_fit_arcs_leaves_lines_and_incremental_moves():
+    builder = ProgramBuilder(number=1)
+    builder.rapid(x=0.0, y=0.0, z=0.0)
+    builder.linear_feed_many(feedrate=10, x=np.linspace(0, 1, 20), y=np.linspace(0, 1, 20) ** 2 * 1e-5)
+    assert fit_arcs(builder.codes) == builder.codes
+
+    store = load_store(
+        f"G91 G01 F10. X{np.cos(a) - np.cos(a - 0.05)} Y{np.sin(a) - np.sin(a - 0.05)}\n"
+        for a in np.linspace(0.05, 1, 20)
+    )
+    assert fit_arcs(store) == store
+
+
+def test_simplify_lines():
+    builder = ProgramBuilder(number=1)
+    builder.rapid(x=0.0, y=0.0, z=0.0)
+    xs = np.linspace(0, 1, 101)
+    builder.linear_feed_many(feedrate=10, x=xs, y=np.where(xs < 0.5, 0.0, xs - 0.5) + np.sin(xs * 300) * 1e-4)
+    builder.linear_feed(x=1.0, y=1.0, comment="corner")
+    builder.linear_feed(x=0.5, y=1.0, feedrate=20)
+    builder.linear_feed(x=0.0, y=1.0)
+    simplified = list(simplify_lines(builder.codes, tolerance=0.001).render_blocks())
+    assert len(simplified) == 5
+    assert simplified[1].startswith("G01 F10.0 X0.5")
+    # the commented point stays, and so does the last point before the feedrate changes
+    assert simplified[3:] == ["Y1.0 (corner)", "G01 F20.0 X0.0"]
+
+    # each axis gets its own tolerance
+    assert len(simplify_lines(builder.codes, tolerance={"X": 0.001, "Y": 1e-6})) > len(simplified)
+
+
+def test_simplify_lines_rotary_axes():
+    store = load_store(["G00 X0. A0.\n", "G01 F10. X1. A10.\n", "X2. A20.5\n", "X3. A30.\n"])
+    assert simplify_lines(store) == store
+    assert list(simplify_lines(store, rotary_tolerance=1.0).render_blocks()) == [
+        "G00 X0.0 A0.0",
+        "G01 F10.0 X3.0 A30.0",
+    ]
+    assert len(simplify_lines(store, rotary_tolerance=0.1)) == 4
+
+
+def _trace(store: CodeStore) -> list[tuple]:
+    """Positions after every move, running M97 calls the way the controller does (P is the line number)"""
+    blocks = list(store.blocks())
+    position = {"X": 0.0, "Y": 0.0, "Z": 0.0}
+    incremental, line = False, 0
+    returns: list[int] = []
+    trace = []
+    while line < len(blocks):
+        words = dict(blocks[line][0])
+        g_codes = {number for code_type, number in blocks[line][0] if code_type == "G"}
+        line += 1
+        incremental = 91 in g_codes or (incremental and 90 not in g_codes)
+        if words.get("M") == 30 and not returns:
+            break
+        if words.get("M") == 97:
+            returns.append(line)
+            line = int(words["P"]) - 1
+        elif words.get("M") == 99:
+            line = returns.pop()
+        moved = {axis: value for axis, value in words.items() if axis in position}
+        for axis, value in moved.items():
+            position[axis] = round(position[axis] + value if incremental else value, 6)
+        if moved:
+            trace.append(tuple(position.values()))
+    return trace
+
+
+def test_extract_subprograms_shares_a_contour_cut_at_different_places():
+    builder = ProgramBuilder(number=1)
+    with builder.program():
+        builder.rapid(x=0, y=0, z=1)
+        for x in range(3):
+            for y in range(2):
+                builder.rapid(x=x * 2.0, y=y * 2.0)
+                builder.linear_feed(z=-0.1, feedrate=10)
+                builder.linear_feed(x=x * 2.0 + 1)
+                builder.linear_feed(y=y * 2.0 + 1)
+                builder.linear_feed(x=x * 2.0)
+                builder.linear_feed(y=y * 2.0)
+                builder.rapid(z=1)
+    extracted = extract_subprograms(builder.codes)
+    rendered = list(extracted.render_blocks())
+    assert rendered.count("M97 P19") == 6
+    assert rendered[17:] == [
+        "M30 (end program)",
+        "G91 G01 F10.0 Z-1.1",
+        "X1.0",
+        "Y1.0",
+        "X-1.0",
+        "Y-1.0",
+        "G00 Z1.1",
+        "G90",
+        "M99",
+    ]
+    assert _trace(extracted) == _trace(builder.codes)
+
+
+def test_extract_subprograms_keeps_programs_without_repeats():
+    store = load_store(["G90 G00 X0. Y0. Z1.\n", "G01 F10. Z0.\n", "X1.\n", "Y1.\n", "M30\n"])
+    assert extract_subprograms(store) is store
+
+
+def test_extract_subprograms_keeps_the_toolpath():
+    rng = random.Random(3)
+    contours = [["G01 F10. Z-0.1", "X{x1} Y{y}", "Y{y1}", "X{x}", "G00 Z1."], ["G01 F5. X{x1} Y{y1} Z-0.2", "Z1."]]
+    for _ in range(20):
+        lines = ["G90 G00 X0. Y0. Z1."]
+        for _ in range(30):
+            roll = rng.random()
+            if roll < 0.1:
+                lines.extend(["G91 G01 F20. X0.5", "Y0.5", "X-0.5", "Y-0.5", "G90"])
+            elif roll < 0.15:
+                lines.extend(["M06 T02", "G00 X0. Y0. Z1."])
+            else:
+                x, y = rng.choice([0.0, 0.5, 2.25]), rng.choice([0.0, 1.0, 3.0])
+                lines.append(f"G00 X{x} Y{y}")
+                lines.extend(line.format(x=x, y=y, x1=x + 1, y1=y + 1) for line in rng.choice(contours))
+        store = load_store(line + "\n" for line in lines + ["M30"])
+        extracted = extract_subprograms(store, min_blocks=2)
+        assert len(extracted) < len(store)
+        assert _trace(extracted) == _trace(store)
@@ -0,0 +1,93 @@
+import io
+
+import pytest
+
+from mach30.enums import CircularMotionDirection
+from mach30.mill.builder import ProgramBuilder
+from mach30.mill.gcode_basic import LinearFeed, UseMachineCoord
+from mach30.mill.models import Comment
+from mach30.mill.parser import (
+    ParseError,
+    ProgramParser,
+    iter_blocks,
+    load_program,
+    load_store,
+)
+
+
+def _builder() -> ProgramBuilder:
+    builder = ProgramBuilder(number=21, preamble_comments=["round trip", "T04 0.5 inch end mill"])
+    with builder.program():
+        builder.default_config()
+        builder.rapid(x=0, y=0, comment="start")
+        builder.linear_feed(z=-0.1 + 0.2 - 0.1, feedrate=18)
+        builder.circular_feed(direction=CircularMotionDirection.CLOCKWISE, x=1e-05, y=2.5, r=0.25)
+        builder.zhome()
+    return builder
+
+
+def test_round_trip(tmp_path):
+    builder = _builder()
+    for with_line_numbers in (False, True):
+        builder.save(tmp_path / "prog.nc", with_line_numbers=with_line_numbers)
+        loaded = load_program(tmp_path / "prog.nc")
+        assert loaded.number == 21
+        assert loaded.render(with_line_numbers=with_line_numbers) == builder.render(with_line_numbers=with_line_numbers)
+        # numbers are written rounded to the precision of the active units
+        types, numbers, is_int, offsets = builder.codes.columns
+        assert loaded.codes.columns[0] == types and loaded.codes.columns[2:] == (is_int, offsets)
+        assert list(loaded.codes.columns[1]) == pytest.approx(list(numbers), abs=0.00005)
+
+
+def test_materialized_codes():
+    store = load_store([b"%\nO00001\nN001 G53 G01 F18.0 X1.0 (machine move)\n%\n"])
+    code = store[0]
+    assert isinstance(code, UseMachineCoord)
+    assert isinstance(code.sub_codes[0], LinearFeed)
+    assert code.comment == "machine move"
+
+
+def test_comment_blocks_and_modes():
+    loaded = load_program(["%\nO1\n(hdr)\nG20 G00 X1.\n(OP 2 contour)\nG01 X2. F10.\nM03 S1200\n%\n"])
+    codes = list(loaded.codes)
+    assert isinstance(codes[1], Comment) and codes[1].render() == "(OP 2 contour)"
+    rebuilt = ProgramBuilder(number=1, preamble_comments=["hdr"])
+    rebuilt.add(*codes)
+    assert rebuilt.render() == loaded.render()
+
+    # the modes of the loaded blocks carry on, so a move in the same mode only needs its axes
+    assert loaded.modal.position == {"X": 2.0}
+    assert (loaded.modal.feedrate, loaded.modal.spindle.speed) == (10.0, 1200)
+    loaded.linear_feed(x=3.0, feedrate=10.0)
+    assert loaded.render().splitlines()[-2] == "X3.0"
+
+
+def test_incremental_feed():
+    text = _builder().render(with_line_numbers=True).encode()
+    parser = ProgramParser()
+    blocks = []
+    for i in range(0, len(text), 7):
+        blocks.extend(parser.feed(text[i : i + 7]))
+    blocks.extend(parser.close())
+    assert blocks == list(iter_blocks(io.BytesIO(text)))
+    assert [block.line_number for block in blocks] == list(range(1, len(blocks) + 1))
+    assert parser.header_comments == ["round trip", "T04 0.5 inch end mill"]
+    assert parser.finished
+
+
+def test_parse_errors():
+    with pytest.raises(ParseError, match="line 2: unsupported word E1"):
+        list(iter_blocks(["G01 X1.0\nE1\n"]))
+    with pytest.raises(ParseError, match="unexpected"):
+        list(iter_blocks(["G01 X1.0 (unclosed\n"]))
+
+
+def test_compact_and_lower_case_words():
+    blocks = list(iter_blocks(["N10G01X1.0Y-.5\n", "n20 g00 z1.\n", "X1E-3 (tiny)\n"]))
+    assert [block.words for block in blocks] == [
+        [("G", 1), ("X", 1.0), ("Y", -0.5)],
+        [("G", 0), ("Z", 1.0)],
+        [("X", 0.001)],
+    ]
+    assert [block.line_number for block in blocks] == [10, 20, None]
+    assert blocks[2].comment == "tiny"
@@ -0,0 +1,103 @@
+import gc
+import io
+import weakref
+
+import pytest
+from pydantic import ValidationError
+
+from mach30.enums import GGroups, Units
+from mach30.mill.builder import ProgramBuilder
+from mach30.mill.gcode_basic import CancelCannedCycle
+from mach30.mill.mcode import MCode
+from mach30.mill.models import Code, GCode, freeze
+
+
+def _builder() -> ProgramBuilder:
+    builder = ProgramBuilder(number=42, preamble_comments=["streaming"])
+    builder.rapid(z=1.0, comment="clear")
+    for i in range(10):
+        builder.linear_feed(x=i * 0.5, y=i, feedrate=20)
+    return builder
+
+
+def test_iter_lines_matches_render():
+    builder = _builder()
+    assert "\n".join(builder.iter_lines(with_line_numbers=True)) == builder.render(with_line_numbers=True)
+    assert builder.render().startswith("%\nO00042\n(streaming)\n\nG00 Z1.0 (clear)\nG01 F20.0 X0.0 Y0.0\n")
+
+
+def test_empty_program():
+    assert ProgramBuilder(number=1).render() == "%\nO00001\n\n\n\n%"
+
+
+def test_save_in_chunks(tmp_path):
+    builder = _builder()
+    expected = builder.render(with_line_numbers=True) + "\n"
+
+    binary = io.BytesIO()
+    builder.save(binary, with_line_numbers=True, chunk_lines=3)
+    assert binary.getvalue().decode() == expected
+
+    text = io.StringIO()
+    builder.write(text, with_line_numbers=True, chunk_lines=1)
+    assert text.getvalue() == expected
+
+    builder.save(tmp_path / "prog.nc", with_line_numbers=True)
+    assert (tmp_path / "prog.nc").read_text() == expected
+
+
+def test_frozen_codes_are_interned():
+    cancel = freeze(CancelCannedCycle(comment="cancel canned cycle"))
+    assert cancel is freeze(CancelCannedCycle(comment="cancel canned cycle"))
+    assert cancel is not freeze(CancelCannedCycle())
+    assert cancel.render() == "G80 (cancel canned cycle)" and cancel.group == GGroups.CANNED_CYCLE
+    # 1 and 1.0 render differently, so they must not share an instance
+    assert freeze(MCode(code_number=3, sub_codes=[Code(code_type="S", code_number=1)])).render() == "M03 S01"
+    assert freeze(MCode(code_number=3, sub_codes=[Code(code_type="S", code_number=1.0)])).render() == "M03 S1.0"
+    with pytest.raises(ValidationError):
+        cancel.comment = "changed"
+    with pytest.raises(AttributeError):
+        cancel.sub_codes.append(Code(code_type="X", code_number=1.0))  # type: ignore[attr-defined]
+
+    # every field is part of the key, not just the words, and codes nothing uses any more aren't kept
+    motion = freeze(GCode(code_number=500, group=GGroups.MOTION))
+    other = freeze(GCode(code_number=500, group=GGroups.NONMODAL))
+    assert other is not motion and other.group == GGroups.NONMODAL
+    ref = weakref.ref(motion)
+    del motion
+    gc.collect()
+    assert ref() is None
+
+
+def test_rendered_text_is_reused():
+    builder = _builder()
+    with builder.program():
+        pass
+    first = builder.render()
+    numbered = builder.render(with_line_numbers=True)
+    assert numbered.splitlines()[4] == "N001 G00 Z1.0 (clear)"
+    assert builder.codes.render_block(0) is next(builder.codes.render_blocks())
+
+    # blocks added after a render are rendered too
+    builder.rapid(x=1.0)
+    assert builder.render() == first[:-1] + "G00 X1.0\n%"
+
+
+def test_render_in_worker_processes(tmp_path):
+    builder = _builder()
+    with builder.program():
+        builder.set_units(Units.MILLIMETERS)
+        for i in range(20):
+            builder.linear_feed(x=i / 3, y=i, comment="third" if i % 7 == 0 else None)
+    for with_line_numbers in (False, True):
+        expected = builder.render(with_line_numbers=with_line_numbers)
+        assert builder.render(with_line_numbers=with_line_numbers, workers=2) == expected
+        # chunks start in the middle of the program, after the units changed
+        chunks = list(builder.codes.render_chunks(2, with_line_numbers, chunk_blocks=4))
+        assert len(chunks) == 10 and "".join(chunks) == "\n".join(builder._iter_code_lines(with_line_numbers)) + "\n"
+
+        binary = io.BytesIO()
+        builder.save(binary, with_line_numbers=with_line_numbers, workers=2)
+        assert binary.getvalue().decode() == expected + "\n"
+    builder.save(tmp_path / "prog.nc", workers=2)
+    assert (tmp_path / "prog.nc").read_text() == builder.render() + "\n"
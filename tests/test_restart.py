@@ -0,0 +1,170 @@
+import typing as t
+
+import pytest
+
+from mach30.enums import (
+    CircularMotionDirection,
+    GGroups,
+    PositionMode,
+    SpindleDirection,
+    Units,
+    WorkOffset,
+)
+from mach30.mill.builder import ProgramBuilder
+from mach30.mill.gcode import DrillCycle
+from mach30.mill.mcode import MCode
+from mach30.mill.models import SpindleSettings, Tool
+from mach30.mill.parser import iter_blocks
+from mach30.mill.restart import ProgramIndex, restart_preamble
+
+TOOLS = [
+    Tool(number=1, description="end mill", spindle=SpindleSettings(direction=SpindleDirection.FORWARD, speed=3000)),
+    Tool(number=2, description="drill", spindle=SpindleSettings(direction=SpindleDirection.REVERSE, speed=4500)),
+]
+
+
+def _builder() -> ProgramBuilder:
+    builder = ProgramBuilder(number=7, preamble_comments=["restart"])
+    with builder.program():
+        builder.default_config()
+        builder.set_work_offset(WorkOffset.TWO)
+        for tool in TOOLS:
+            builder.use_tool(tool)
+            builder.add(MCode(code_number=8))
+            with builder.compensate(tool, {"x": 1.0, "z": 0.1}, {"x": 1.0, "y": 0.0, "z": 1.0}):
+                builder.linear_feed(z=-0.1, feedrate=10 * tool.number)
+                builder.circular_feed(CircularMotionDirection.COUNTERCLOCKWISE, x=0.0, y=1.0, r=1.0)
+                builder.linear_feed(x=-1.0)
+            builder.add(MCode(code_number=9))
+            with DrillCycle(builder=builder, f=15, z=-0.35, r=0.1) as drill:
+                drill.move(x=1.0, y=1.0)
+                drill.move(x=2.0, y=1.0)
+            builder.set_position_mode(PositionMode.INCREMENTAL)
+            builder.rapid(x=0.5)
+            builder.set_position_mode(PositionMode.ABSOLUTE)
+            builder.set_units(Units.MILLIMETERS)
+            builder.rapid(y=2.0, z=5.0)
+            builder.set_units(Units.INCHES)
+            builder.zhome()
+    return builder
+
+
+_GROUPS = {
+    GGroups.MOTION: (0, 1, 2, 3),
+    GGroups.DISTANCE_MODE: (90, 91),
+    GGroups.UNITS: (20, 21),
+    GGroups.CUTTER_COMPENSATION: (40, 41, 42),
+    GGroups.CANNED_CYCLE: (80, 81),
+    GGroups.COORDINATE_SYSTEM: (54, 55),
+}
+
+
+def _expected_states(path) -> t.Iterator[tuple[int, dict[str, t.Any]]]:
+    """The state every block runs in, simulated a block at a time"""
+    groups: dict[int | float, GGroups] = {number: group for group, numbers in _GROUPS.items() for number in numbers}
+    state: dict[str, t.Any] = {"modes": {}, "tool": None, "selected": None, "feedrate": None, "position": {}}
+    for block in iter_blocks(path):
+        yield t.cast(int, block.line_number), {**state, "position": dict(state["position"])}
+        g_codes = {number for letter, number in block.words if letter == "G"}
+        units = state["modes"].get(GGroups.UNITS)
+        for number in g_codes:
+            if number in groups:
+                state["modes"][groups[number]] = number
+        if units is not None and state["modes"][GGroups.UNITS] != units:
+            scale = 25.4 if units == 20 else 1 / 25.4
+            state["position"] = {axis: value * scale for axis, value in state["position"].items()}
+        for letter, number in block.words:
+            if letter == "T":
+                state["selected"] = number
+            elif letter == "M" and number == 6:
+                state["tool"] = dict(block.words).get("T", state["selected"])
+            elif letter == "F":
+                state["feedrate"] = number
+            elif letter in "XYZ" and isinstance(number, float):
+                if g_codes & {28, 53} or (letter == "Z" and state["modes"].get(GGroups.CANNED_CYCLE, 80) != 80):
+                    state["position"].pop(letter, None)
+                elif state["modes"].get(GGroups.DISTANCE_MODE) == 91:
+                    if letter in state["position"]:
+                        state["position"][letter] += number
+                else:
+                    state["position"][letter] = number
+
+
+def test_state_at_every_line(tmp_path):
+    builder = _builder()
+    builder.save(tmp_path / "prog.nc", with_line_numbers=True)
+    index = ProgramIndex(tmp_path / "prog.nc", checkpoint_lines=7)
+    assert index.number == 7
+    for line, expected in _expected_states(tmp_path / "prog.nc"):
+        state = index.state_at(line)
+        assert state.line == line
+        assert {group: state.modes[group] for group in expected["modes"]} == expected["modes"]
+        assert (state.tool, state.selected_tool, state.feedrate) == (
+            expected["tool"],
+            expected["selected"],
+            expected["feedrate"],
+        )
+        assert {axis: state.position[axis] for axis in "XYZ" if axis in state.position} == pytest.approx(
+            expected["position"]
+        )
+
+    # the spindle is turned off in the second to last block
+    state = index.state_at(len(builder.codes) - 1)
+    assert state.spindle == TOOLS[1].spindle and state.tool == 2 and not state.coolant
+    assert (state.length_offset, state.diameter_offset) == (2, 2)
+    assert next(index.lines_from(len(builder.codes))) == f"N{len(builder.codes):03} M30 (end program)"
+    with pytest.raises(KeyError):
+        index.offset(len(builder.codes) + 1)
+    index.close()
+
+
+def test_restart_preamble(tmp_path):
+    builder = _builder()
+    builder.save(tmp_path / "prog.nc", with_line_numbers=True)
+    index = ProgramIndex(tmp_path / "prog.nc", checkpoint_lines=5)
+    lines = builder.render(with_line_numbers=True).splitlines()
+    # restart on the arc of the second tool, with cutter compensation on and coolant flowing
+    line = [text for text in lines if text.endswith("X0.0 Y1.0 R1.0")][1]
+    number = int(line.split()[0][1:])
+    state = index.state_at(number)
+    restart = ProgramBuilder(number=7)
+    restart.add(*restart_preamble(state, clearance=0.5))
+    assert restart._render_codes().splitlines() == [
+        "G80 (restart)",
+        "G40",
+        "G49",
+        "G20",
+        "G17",
+        "G55",
+        "G90",
+        "G53 G00 Z0.0 (tool change height)",
+        "M06 T02",
+        "M04 S4500",
+        "M08",
+        # Y was last programmed in millimeters
+        "G41 D02 X1.0 Y0.0787",
+        "G43 H02 Z0.5",
+        "G01 F20.0 Z-0.1",
+        "G01 F20.0",
+    ]
+    assert list(index.lines_from(number))[:2] == [line, lines[lines.index(line) + 1]]
+
+    drilling = next(int(text.split()[0][1:]) for text in lines if text.endswith("X2.0 Y1.0"))
+    with pytest.raises(ValueError, match="canned cycle"):
+        restart_preamble(index.state_at(drilling))
+
+
+def test_restart_preamble_with_unknown_depth(tmp_path):
+    (tmp_path / "prog.nc").write_text(
+        "%\nO0008\nN001 G20 G17 G90\nN002 M06 T01\nN003 G00 X0. Y0. Z0.1\nN004 G01 F12. Z-0.1\nN005 G91 X1. Y0.5\n"
+        "N006 G28 G91 Z0.\nN007 G90\nN008 G01 X2.\nN009 Y1.\nN010 M30\n%\n"
+    )
+    index = ProgramIndex(tmp_path / "prog.nc", checkpoint_lines=3)
+    state = index.state_at(9)
+    assert state.position == {"X": 2.0, "Y": 0.5}
+    assert index.state_at(6).position == {"X": 1.0, "Y": 0.5, "Z": -0.1}
+    restart = ProgramBuilder(number=8)
+    restart.add(*restart_preamble(state, clearance=0.5))
+    # Z is lost after going home, so the tool stays at the clearance height, but the blocks after the restart still
+    # feed rather than rapid
+    assert restart._render_codes().splitlines()[-2:] == ["G00 Z0.5", "G01 F12.0"]
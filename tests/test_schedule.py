@@ -0,0 +1,61 @@
+import logging
+
+import pytest
+
+from mach30.enums import SpindleDirection
+from mach30.mill.builder import ProgramBuilder
+from mach30.mill.models import SpindleSettings, Tool
+from mach30.mill.schedule import Schedule
+
+SPINDLE = SpindleSettings(direction=SpindleDirection.FORWARD, speed=3000)
+TOOLS = [Tool(number=number, description=f"tool {number}", spindle=SPINDLE) for number in (1, 2, 3)]
+
+
+def _pocket(x: float):
+    def cut(builder: ProgramBuilder) -> None:
+        builder.rapid(x=x, y=0.0)
+        builder.linear_feed(z=-0.1, feedrate=10)
+        builder.rapid(z=1.0)
+
+    return cut
+
+
+def test_schedule_groups_operations_by_tool(caplog):
+    schedule = Schedule()
+    for i in range(6):
+        x = float(i)
+        schedule.add(f"rough {i}", TOOLS[0], _pocket(x), start=(x, 0.0), end=(x, 0.0))
+        schedule.add(f"finish {i}", TOOLS[1], _pocket(x), after=[f"rough {i}"], start=(x, 0.0), end=(x, 0.0))
+    schedule.add("chamfer", TOOLS[2], _pocket(0.0), after=["finish 5"], start=(0.0, 0.0), end=(0.0, 0.0))
+
+    builder = ProgramBuilder(number=1)
+    with caplog.at_level(logging.INFO, logger="mach30.mill.schedule"):
+        report = schedule.emit(builder)
+    assert caplog.messages == [f"program 1: {report}"]
+    # the finishing passes go back the way the roughing ones came
+    assert report.order == [f"rough {i}" for i in range(6)] + [f"finish {i}" for i in range(5, -1, -1)] + ["chamfer"]
+    assert (report.tool_changes_before, report.tool_changes_after, report.tool_changes_saved) == (13, 3, 10)
+    assert report.travel_before == report.travel_after == pytest.approx(10.0)
+    assert "3 tool changes instead of 13 (10 saved)" in str(report)
+    assert [line for line in builder._render_codes().split("\n") if line.startswith("M06")] == [
+        "M06 T01",
+        "M06 T02",
+        "M06 T03",
+    ]
+
+
+def test_schedule_keeps_precedence_and_cuts_travel():
+    schedule = Schedule()
+    for x in (0.0, 5.0, 1.0, 4.0, 2.0, 3.0):
+        schedule.add(f"hole {x}", TOOLS[0], _pocket(x), start=(x, 0.0), end=(x, 0.0))
+    schedule.add("tap", TOOLS[1], _pocket(0.0), after=["hole 0.0"])
+    # the loaded tool keeps cutting first, and another tool only goes in once the first one is done
+    schedule.add("spot", TOOLS[2], _pocket(0.0), start=(0.0, 0.0), end=(0.0, 0.0))
+    _, report = schedule.order(TOOLS[0])
+    assert report.order[:6] == [f"hole {x}" for x in (0.0, 1.0, 2.0, 3.0, 4.0, 5.0)]
+    assert report.order.index("tap") > report.order.index("hole 0.0")
+    assert report.tool_changes_after == 2
+    assert (report.travel_before, report.travel_after) == pytest.approx((15.0, 10.0))
+
+    with pytest.raises(AssertionError):
+        schedule.add("deburr", TOOLS[0], _pocket(0.0), after=["polish"])
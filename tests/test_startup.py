@@ -0,0 +1,66 @@
+import runpy
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+# the benchmark is a script rather than part of the package
+import_times = runpy.run_path(str(Path(__file__).parent.parent / "benchmarks" / "startup.py"))["import_times"]
+
+
+def _run(code: str) -> str:
+    """What `code` prints in a fresh interpreter"""
+    return subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+
+
+def test_builder_import_skips_heavy_modules():
+    # building and writing a program needs neither numpy nor the process pool, so importing the builder (and the canned
+    # cycles) leaves them to the code that uses them
+    code = (
+        "import sys\n"
+        "import mach30.mill.builder, mach30.mill.gcode\n"
+        "print(sorted({name.split('.')[0] for name in sys.modules}))\n"
+        "print('concurrent.futures.process' in sys.modules)\n"
+    )
+    modules, process_pool = _run(code).splitlines()
+    assert "'numpy'" not in modules and "'mach30'" in modules
+    assert process_pool == "False"
+
+
+def test_import_builds_no_models():
+    # models are built when first used, and the first one built also loads pydantic's plugins (importlib.metadata)
+    code = (
+        "import sys\n"
+        "import mach30.mill.builder, mach30.mill.gcode\n"
+        "from mach30.mill.builder import ProgramBuilder\n"
+        "from mach30.mill.formatting import NumberFormat\n"
+        "print(ProgramBuilder.__pydantic_complete__, NumberFormat.__pydantic_complete__)\n"
+        "print(sorted(name for name in sys.modules if name.startswith(('mach30.mill.cache', 'mach30.mill.instrument', "
+        "'importlib.metadata'))))\n"
+    )
+    assert _run(code).splitlines() == ["False False", "[]"]
+
+
+def test_code_catalog_is_built_lazily():
+    code = (
+        "import mach30.mill.builder\n"
+        "from mach30.mill.gcode_basic import CWFeed, UseInches\n"
+        "print(CWFeed.__pydantic_complete__, UseInches.__pydantic_complete__)\n"
+        "print(CWFeed().render(), CWFeed.__pydantic_complete__)\n"
+    )
+    assert _run(code).splitlines() == ["False False", "G02 True"]
+
+
+def test_import_time(record_property):
+    # `python -X importtime`, as run by benchmarks/startup.py. Machines differ too much for a fixed budget, so the
+    # package's own modules are measured against pydantic in the same interpreter: they took about 1.4 times as long
+    # to import before the models were built lazily, and about 0.75 times after
+    runs = [import_times(["mach30.mill.builder", "mach30.mill.gcode"]) for _ in range(3)]
+    own = statistics.median(
+        sum(own for name, (own, _) in times.items() if name.split(".")[0] == "mach30") for times, _ in runs
+    )
+    pydantic = statistics.median(times["pydantic"][1] for times, _ in runs)
+    record_property("import_ms", statistics.median(total for _, total in runs) / 1000)
+    record_property("mach30_self_ms", own / 1000)
+    record_property("pydantic_ms", pydantic / 1000)
+    assert own < pydantic
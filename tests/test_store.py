@@ -0,0 +1,60 @@
+from mach30.enums import GGroups, MotionPlane
+from mach30.mill.builder import ProgramBuilder
+from mach30.mill.gcode_basic import (
+    CancelToolLengthComp,
+    Dwell,
+    LinearFeed,
+    Rapid,
+    UseMachineCoord,
+)
+from mach30.mill.mcode import MCode, ToolChange
+from mach30.mill.models import Code, GCode
+from mach30.mill.store import CodeStore
+
+
+def test_store_renders_like_codes():
+    codes = [
+        LinearFeed(sub_codes=[Code(code_type="F", code_number=1250), Code(code_type="X", code_number=0.1 + 0.2)]),
+        UseMachineCoord(sub_codes=[CancelToolLengthComp(sub_codes=[Code(code_type="Z", code_number=0.0)])]),
+        ToolChange(tool_number=4),
+        MCode(code_number=3, sub_codes=[Code(code_type="S", code_number=3056)], comment="spindle"),
+        Dwell(p=500, is_millis=True),
+        GCode(code_number=41, group=GGroups.CUTTER_COMPENSATION, sub_codes=[Code(code_type="D", code_number=-1)]),
+    ]
+    store = CodeStore(codes)
+    assert len(store) == len(codes)
+    assert list(store.render_blocks()) == [code.render() for code in codes]
+    assert [code.render() for code in store] == [code.render() for code in codes]
+
+
+def test_store_materializes_lazily():
+    store = CodeStore([Rapid(sub_codes=[Code(code_type="Z", code_number=1.0)], comment="up")])
+    code = store[-1]
+    assert isinstance(code, Rapid)
+    assert code.group == GGroups.MOTION
+    assert code.comment == "up"
+    assert store.words(0) == [("G", 0), ("Z", 1.0)]
+
+    code.comment = "changed"
+    assert store.comment(0) == "up"
+
+
+def test_materialized_codes_keep_their_group():
+    builder = ProgramBuilder(number=1)
+    builder.set_plane(MotionPlane.XZ)
+    builder.add(GCode(code_number=95, group=GGroups.FEEDRATE_MODE), GCode(code_number=4, group=GGroups.NONMODAL))
+    builder.add(GCode(code_number=73, group=GGroups.CANNED_CYCLE, sub_codes=[Code(code_type="Z", code_number=-1.0)]))
+    assert [code.group for code in builder.codes if isinstance(code, GCode)] == [
+        GGroups.PLANE_SELECTION,
+        GGroups.FEEDRATE_MODE,
+        GGroups.NONMODAL,
+        GGroups.CANNED_CYCLE,
+    ]
+
+
+def test_builder_accepts_code_lists():
+    builder = ProgramBuilder(number=1, codes=[MCode(code_number=30, comment="end program")])
+    assert isinstance(builder.codes, CodeStore)
+    builder.rapid(z=1.0)
+    assert builder._render_codes() == "M30 (end program)\nG00 Z1.0"
+    assert builder.model_dump()["codes"][0]["code_number"] == 30
@@ -0,0 +1,68 @@
+import io
+
+import pytest
+
+from mach30.enums import SpindleDirection
+from mach30.mill.builder import ProgramBuilder
+from mach30.mill.models import SpindleSettings, Tool
+from mach30.mill.store import CodeSink
+
+TOOL = Tool(number=3, description="drill", spindle=SpindleSettings(direction=SpindleDirection.FORWARD, speed=2000))
+
+
+def _build(builder: ProgramBuilder, blocks: int = 50) -> None:
+    with builder.program():
+        builder.default_config()
+        builder.use_tool(TOOL)
+        for i in range(blocks):
+            builder.rapid(z=1.0)
+            builder.linear_feed(x=i * 0.25, y=i, z=-0.1, feedrate=12)
+
+
+def test_stream_to_path_matches_save(tmp_path):
+    expected = ProgramBuilder(number=7, preamble_comments=["sink"])
+    _build(expected)
+    expected.save(tmp_path / "expected.nc", with_line_numbers=True)
+
+    # the file is replaced in one go when the stream is done, so until then it's the old program
+    (tmp_path / "streamed.nc").write_text("old\n")
+    builder = ProgramBuilder(number=7, preamble_comments=["sink"])
+    with builder.stream_to(tmp_path / "streamed.nc", with_line_numbers=True, chunk_lines=7):
+        _build(builder)
+        assert (tmp_path / "streamed.nc").read_text() == "old\n"
+
+    assert (tmp_path / "streamed.nc").read_text() == (tmp_path / "expected.nc").read_text()
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["expected.nc", "streamed.nc"]
+
+
+def test_stream_to_stream_keeps_bounded_state():
+    expected = ProgramBuilder(number=8, tools=[TOOL])
+    _build(expected, blocks=500)
+
+    stream = io.BytesIO()
+    builder = ProgramBuilder(number=8, tools=[TOOL])
+    with builder.stream_to(stream):
+        _build(builder, blocks=500)
+
+    assert stream.getvalue().decode() == expected.render() + "\n"
+    assert isinstance(builder.codes, CodeSink)
+    assert len(builder.codes) == len(expected.codes)
+    assert builder.modal.codes.keys() == expected.modal.codes.keys()
+    assert builder.modal.position == expected.modal.position == {"X": 124.75, "Y": 499.0, "Z": -0.1}
+
+
+def test_streamed_program_is_finished(tmp_path):
+    builder = ProgramBuilder(number=9)
+    with builder.stream_to(tmp_path / "streamed.nc"):
+        _build(builder, blocks=5)
+    written = (tmp_path / "streamed.nc").read_text()
+    assert len(builder.codes) == len(written.splitlines()) - 5
+
+    with pytest.raises(ValueError, match="streamed"):
+        builder.rapid(x=1.0)
+    with pytest.raises(TypeError, match="streamed program"):
+        builder.render()
+    with pytest.raises(TypeError, match="streamed program"):
+        builder.save(tmp_path / "again.nc")
+    assert (tmp_path / "streamed.nc").read_text() == written
+    assert [path.name for path in tmp_path.iterdir()] == ["streamed.nc"]